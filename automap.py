@@ -0,0 +1,148 @@
+import numpy as np
+from datatypes import block_map
+from helper_routines import deg_to_bam, fine_sine, fine_cosine
+
+# the map modes camera and the spatial index it draws from. the camera is a
+# centre in map units, a scale in pixels per map unit and a rotation, and turns
+# whole arrays of map points into screen points in one go. the index is the
+# maps BLOCKMAP (or a grid built the same way when there isn't one) so only
+# the linedefs that can be on screen are ever looked at.
+#
+#   camera = automap_camera(1600, 1000)
+#   camera.fit(map.get_map_bounds())
+#   camera.zoom(2, mouse_x, mouse_y)
+#   lines = automap_lines(map).in_view(camera)
+
+# pixels per map unit either side of which zooming stops
+MIN_SCALE = 1 / 64
+MAX_SCALE = 16
+# screen margin fit() leaves around the map
+MARGIN = 30
+
+class automap_camera:
+    # ROTATION is in degrees, counter-clockwise, 0 is north up. with follow on
+    # the centre sticks to the player, with rotate on the map turns so the
+    # player always faces the top of the screen
+    __slots__ = [ 'WIDTH', 'HEIGHT', 'CENTER_X', 'CENTER_Y', 'SCALE', 'ROTATION', 'follow', 'rotate', '__cos', '__sin' ]
+
+    def __init__(self, width, height):
+        self.WIDTH = width
+        self.HEIGHT = height
+        self.CENTER_X = 0.0
+        self.CENTER_Y = 0.0
+        self.SCALE = 1.0
+        self.follow = False
+        self.rotate = False
+        self.__set_rotation(0.0)
+
+    def __str__(self):
+        return f'automap_camera(({self.CENTER_X:.0f}, {self.CENTER_Y:.0f}) x{self.SCALE:.3f} {self.ROTATION:.0f} deg)'
+
+    def key(self):
+        # changes whenever anything on screen would move
+        return (self.WIDTH, self.HEIGHT, self.CENTER_X, self.CENTER_Y, self.SCALE, self.ROTATION)
+
+    def resize(self, width, height):
+        self.WIDTH = width
+        self.HEIGHT = height
+
+    def fit(self, bounds, margin=MARGIN):
+        # the whole of bounds (x_min, x_max, y_min, y_max) on screen, north up
+        x_min, x_max, y_min, y_max = bounds
+        self.CENTER_X = (x_min + x_max) / 2
+        self.CENTER_Y = (y_min + y_max) / 2
+        self.SCALE = min((self.WIDTH - 2 * margin) / max(x_max - x_min, 1), (self.HEIGHT - 2 * margin) / max(y_max - y_min, 1))
+        self.follow = False
+        self.rotate = False
+        self.__set_rotation(0.0)
+
+    def zoom(self, factor, sx=None, sy=None):
+        # zoom keeping the map point under screen (sx, sy) where it is, the
+        # middle of the screen by default
+        if sx is None or sy is None:
+            sx, sy = self.WIDTH / 2, self.HEIGHT / 2
+        x, y = self.to_world(sx, sy)
+        self.SCALE = min(max(self.SCALE * factor, MIN_SCALE), MAX_SCALE)
+        if not self.follow:
+            nx, ny = self.to_world(sx, sy)
+            self.CENTER_X += x - nx
+            self.CENTER_Y += y - ny
+
+    def pan(self, dx, dy):
+        # drag the map by (dx, dy) pixels, which lets go of the player
+        self.follow = False
+        self.CENTER_X, self.CENTER_Y = self.to_world(self.WIDTH / 2 - dx, self.HEIGHT / 2 - dy)
+
+    def track(self, x, y, angle):
+        # called once a frame with the player, angle in degrees with 0 east
+        if self.follow:
+            self.CENTER_X, self.CENTER_Y = float(x), float(y)
+        self.__set_rotation(90 - angle if self.rotate else 0.0)
+
+    def __set_rotation(self, degrees):
+        self.ROTATION = degrees % 360
+        bam = deg_to_bam(self.ROTATION)
+        self.__cos, self.__sin = (fine_cosine(bam), fine_sine(bam)) if self.ROTATION else (1.0, 0.0)
+
+    def to_screen(self, xs, ys):
+        # map points to (..., 2) int32 screen points, one vectorized transform
+        dx = np.asarray(xs, dtype=np.float64) - self.CENTER_X
+        dy = np.asarray(ys, dtype=np.float64) - self.CENTER_Y
+        c, s = self.__cos * self.SCALE, self.__sin * self.SCALE
+        sx = self.WIDTH / 2 + dx * c - dy * s
+        sy = self.HEIGHT / 2 - dx * s - dy * c
+        return np.stack([ np.rint(sx), np.rint(sy) ], axis=-1).astype(np.int32)
+
+    def to_screen_point(self, x, y):
+        dx, dy = x - self.CENTER_X, y - self.CENTER_Y
+        c, s = self.__cos * self.SCALE, self.__sin * self.SCALE
+        return round(self.WIDTH / 2 + dx * c - dy * s), round(self.HEIGHT / 2 - dx * s - dy * c)
+
+    def to_world(self, sx, sy):
+        rx = (sx - self.WIDTH / 2) / self.SCALE
+        ry = (self.HEIGHT / 2 - sy) / self.SCALE
+        c, s = self.__cos, self.__sin
+        return self.CENTER_X + rx * c + ry * s, self.CENTER_Y - rx * s + ry * c
+
+    def viewport(self):
+        # top, bottom, left, right of the map area on screen. when the map is
+        # rotated this is the box around the rotated screen
+        corners = [ self.to_world(sx, sy) for sx, sy in ((0, 0), (self.WIDTH, 0), (0, self.HEIGHT), (self.WIDTH, self.HEIGHT)) ]
+        xs, ys = [ c[0] for c in corners ], [ c[1] for c in corners ]
+        return max(ys), min(ys), min(xs), max(xs)
+
+class automap_lines:
+    # linedef lookups by area for the automap
+    __slots__ = [ 'BLOCKMAP', 'BOXES', 'ENDS', 'queried' ]
+
+    def __init__(self, map):
+        self.BOXES = map.GEOMETRY.LINEDEF_BBOX
+        blockmap = map.BLOCKMAP
+        if blockmap is None or blockmap.COLUMNS * blockmap.ROWS == 0:
+            blockmap = block_map.from_boxes(self.BOXES)
+        self.BLOCKMAP = blockmap
+        verts = map.VERTEXES.array
+        lines = map.LINEDEFS.array
+        # (linedefs, 2, 2) map space endpoints
+        self.ENDS = np.stack([ np.stack([ verts['x'][lines['start']], verts['y'][lines['start']] ], axis=-1),
+                               np.stack([ verts['x'][lines['end']], verts['y'][lines['end']] ], axis=-1) ], axis=1)
+        # how many linedefs the last query got out of the blockmap before the
+        # exact box test, for the stats
+        self.queried = 0
+
+    def in_box(self, top, bottom, left, right):
+        # linedefs whose box overlaps the area. the blockmap narrows it to the
+        # blocks under the area, the boxes do the rest
+        found = self.BLOCKMAP.linedefs_in_box(left, bottom, right, top)
+        self.queried = len(found)
+        boxes = self.BOXES[found]
+        keep = (boxes[:, 0] >= bottom) & (boxes[:, 1] <= top) & (boxes[:, 2] <= right) & (boxes[:, 3] >= left)
+        return found[keep]
+
+    def in_view(self, camera):
+        return self.in_box(*camera.viewport())
+
+    def screen_lines(self, camera, lines):
+        # (lines, 2, 2) screen endpoints of the given linedefs
+        ends = self.ENDS[lines]
+        return camera.to_screen(ends[..., 0], ends[..., 1])
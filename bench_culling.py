@@ -0,0 +1,89 @@
+import sys
+import time
+import math
+from pygame.math import Vector2 as vec2
+from constants import *
+from wadfile import WADFile
+from culling import view_frustum
+from benchmark import viewpoints
+
+# child boxes/sec for the bbox FOV test (two per node), the old per-box angle
+# version against the cross product frustum, one box at a time and every node
+# in one numpy call.
+#   python bench_culling.py [WAD] [MAP] [VIEWPOINTS]
+
+def legacy_bbox_in_fov(box, pos, angle):
+    # the atan2 based test the renderer used to run, kept here as the baseline
+    px, py = pos
+    top, bottom, left, right = box
+    a, b = vec2(left, bottom), vec2(left, top)
+    c, d = vec2(right, top), vec2(right, bottom)
+    if px < left:
+        if py > top:
+            sides = (b, a), (c, b)
+        elif py < bottom:
+            sides = (b, a), (a, d)
+        else:
+            sides = (b, a),
+    elif px > right:
+        if py > top:
+            sides = (c, b), (d, c)
+        elif py < bottom:
+            sides = (a, d), (d, c)
+        else:
+            sides = (d, c),
+    else:
+        if py > top:
+            sides = (c, b),
+        elif py < bottom:
+            sides = (a, d),
+        else:
+            return True
+    for vect1, vect2 in sides:
+        delta1, delta2 = vect1 - pos, vect2 - pos
+        a1 = math.degrees(math.atan2(delta1.y, delta1.x))
+        a2 = math.degrees(math.atan2(delta2.y, delta2.x))
+        sp = (a1 - a2) % 360
+        a1 -= angle
+        check_v = (a1 + H_FOV) % 360
+        if check_v > FOV:
+            if check_v > sp + FOV:
+                continue
+        return True
+    return False
+
+def run(map, count):
+    bsp = map.BSP
+    boxes = bsp.BBOXES.reshape(-1, 4).tolist()
+    views = viewpoints(map, count)
+    tested = len(boxes) * len(views)
+    results = {}
+
+    start = time.perf_counter()
+    for pos, angle in views:
+        for box in boxes:
+            legacy_bbox_in_fov(box, pos, angle)
+    results['angles (before)'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for pos, angle in views:
+        frustum = view_frustum(pos.x, pos.y, angle)
+        for box in boxes:
+            frustum.box_visible(*box)
+    results['frustum, scalar'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for pos, angle in views:
+        view_frustum(pos.x, pos.y, angle).bsp_visibility(bsp)
+    results['frustum, batched'] = time.perf_counter() - start
+
+    print(f'{map.name}: {len(bsp)} nodes, {len(boxes)} boxes, {len(views)} viewpoints')
+    for name, elapsed in results.items():
+        print(f'  {name:<18} {tested / elapsed:14,.0f} boxes/sec  ({elapsed * 1000:8.2f} ms)')
+
+if __name__ == '__main__':
+    wadname = sys.argv[1] if len(sys.argv) > 1 else 'DOOM.WAD'
+    mapname = sys.argv[2] if len(sys.argv) > 2 else 'E1M1'
+    count = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    with WADFile(wadname) as wad:
+        run(wad.load_map(mapname), count)
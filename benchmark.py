@@ -0,0 +1,161 @@
+import os
+# no display needed, this runs on CI and the render boxes
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+import sys
+import time
+import json
+import random
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import pygame as pg
+from pygame.math import Vector2 as vec2
+from constants import *
+from wadfile import WADFile, WADMap
+from datatypes import flat_bsp, NODE_DTYPE
+from renderer import DoomMapRenderer
+from synthwad import synthetic_map, write_wad
+
+# headless timings for everything between opening a WAD and putting a frame on
+# screen. without --wad it generates synthetic maps of growing size so the
+# numbers show how each stage scales.
+#   python benchmark.py                          synthetic 8x8 .. 64x64 rooms
+#   python benchmark.py --sizes 16,128 --detail 2
+#   python benchmark.py --wad DOOM.WAD --map E1M1
+
+def measure(fn, repeat):
+    # timings of repeat calls, then one more under tracemalloc for the
+    # allocation figures so tracing doesn't skew the clock
+    fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    fn()
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(max(stat.count_diff, 0) for stat in after.compare_to(before, 'lineno'))
+    times = np.array(times) * 1000
+    return {
+        'min_ms': float(times.min()),
+        'median_ms': float(np.median(times)),
+        'p99_ms': float(np.percentile(times, 99)),
+        'peak_kib': peak / 1024,
+        'blocks': blocks
+    }
+
+def viewpoints(map, count, seed=0):
+    x_min, x_max, y_min, y_max = map.get_map_bounds()
+    rng = random.Random(seed)
+    return [ (vec2(rng.uniform(x_min, x_max), rng.uniform(y_min, y_max)), rng.uniform(0, 360)) for _ in range(count) ]
+
+def bench_map(wadname, mapname, repeat, screen):
+    results = {}
+    def case(name, fn, times=repeat):
+        results[name] = measure(fn, times)
+
+    def open_close():
+        WADFile(wadname).close()
+    case('WADFile open', open_close)
+
+    wad = WADFile(wadname)
+    # maps decode lumps as they're used, preload() is everything up front
+    case('load_map (lazy)', lambda: wad.load_map(mapname))
+    case('load_map + preload', lambda: wad.load_map(mapname).preload())
+
+    # each lump on its own, REJECT wants the sectors so it's left for last
+    entries = sorted(wad.LUMPS.map_entries(mapname), key=lambda e: e.name == 'REJECT')
+    m = WADMap(mapname)
+    for entry in entries:
+        case(f'  lump {entry.name}', lambda entry=entry: m.load_lump(wad, entry))
+
+    map = wad.load_map(mapname)
+    node_entry = [ e for e in entries if e.name == 'NODES' ][0]
+    nodes = np.frombuffer(wad.lump(node_entry), dtype=NODE_DTYPE, count=node_entry.size // NODE_DTYPE.itemsize)
+    case('BSP build (flat_bsp)', lambda: flat_bsp(nodes))
+
+    renderer = DoomMapRenderer(screen, map)
+    views = viewpoints(map, max(repeat, 1))
+    player = renderer.__player__
+    cycle = [ 0 ]
+    def next_view():
+        player.POS, player.ANGLE = views[cycle[0] % len(views)]
+        cycle[0] += 1
+
+    walk = renderer._DoomMapRenderer__walk_tree
+    def walk_tree():
+        next_view()
+        for _ in walk(map.BSP, player):
+            pass
+    case('__walk_tree', walk_tree)
+
+    draw_list = renderer._DoomMapRenderer__build_draw_list
+    def build_draw_list():
+        next_view()
+        draw_list()
+    case('draw list', build_draw_list)
+
+    def frame():
+        next_view()
+        renderer.render()
+    case('render frame', frame)
+
+    def full_frame():
+        next_view()
+        renderer.invalidate()
+        renderer.render()
+    case('render frame (cold)', full_frame)
+
+    info = {
+        'vertexes': len(map.VERTEXES), 'linedefs': len(map.LINEDEFS), 'segs': len(map.SEGS),
+        'subsectors': len(map.SSECTORS), 'nodes': len(map.BSP), 'depth': map.BSP.depth()
+    }
+    del renderer, map, m
+    wad.close()
+    return info, results
+
+def report(label, info, results):
+    print(f'\n{label}: ' + ', '.join(f'{v} {k}' for k, v in info.items()))
+    print(f'  {"":<24}{"min ms":>10}{"median ms":>11}{"p99 ms":>10}{"peak KiB":>11}{"blocks":>9}')
+    for name, r in results.items():
+        print(f'  {name:<24}{r["min_ms"]:>10.3f}{r["median_ms"]:>11.3f}{r["p99_ms"]:>10.3f}{r["peak_kib"]:>11.1f}{r["blocks"]:>9}')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='headless load and render benchmarks')
+    parser.add_argument('--wad', help='benchmark a real WAD instead of synthetic maps')
+    parser.add_argument('--map', default='E1M1')
+    parser.add_argument('--sizes', default='8,16,32,64', help='synthetic grid sizes, rooms per side')
+    parser.add_argument('--detail', type=int, default=1, help='synthetic linedefs per room edge')
+    parser.add_argument('--unbalanced', action='store_true', help='synthetic maps with deep node trees')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--json', help='write the results here as well')
+    args = parser.parse_args(argv)
+
+    pg.init()
+    screen = pg.display.set_mode(WIN_RES)
+    runs = []
+    if args.wad:
+        info, results = bench_map(args.wad, args.map, args.repeat, screen)
+        report(f'{args.wad} {args.map}', info, results)
+        runs.append({ 'wad': args.wad, 'map': args.map, 'info': info, 'results': results })
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            for size in [ int(s) for s in args.sizes.split(',') ]:
+                wadname = os.path.join(tmp, f'synth{size}.wad')
+                write_wad(wadname, [ synthetic_map(args.map, size, size, balanced=not args.unbalanced, detail=args.detail) ])
+                info, results = bench_map(wadname, args.map, args.repeat, screen)
+                report(f'synthetic {size}x{size}', info, results)
+                runs.append({ 'size': size, 'info': info, 'results': results })
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(runs, f, indent=2)
+    pg.quit()
+
+if __name__ == '__main__':
+    main()
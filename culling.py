@@ -0,0 +1,55 @@
+import numpy as np
+from constants import FOV
+from helper_routines import deg_to_bam, fine_sine, fine_cosine
+
+class view_frustum:
+    # the players view wedge as two edge lines through the eye. a box is culled
+    # when all four of its corners are outside the same edge, which is a pair of
+    # cross products per corner and no angles at all. the test is conservative,
+    # a box sitting behind the eye across both edges is kept
+    __slots__ = [ 'x', 'y', 'lx', 'ly', 'rx', 'ry' ]
+
+    def __init__(self, x, y, angle, fov=FOV):
+        self.x = x
+        self.y = y
+        # the edge directions come straight out of the fine trig tables
+        left = deg_to_bam(angle + fov / 2)
+        right = deg_to_bam(angle - fov / 2)
+        self.lx, self.ly = fine_cosine(left), fine_sine(left)
+        self.rx, self.ry = fine_cosine(right), fine_sine(right)
+
+    def point_visible(self, x, y):
+        dx, dy = x - self.x, y - self.y
+        return self.lx * dy - self.ly * dx <= 0 and self.rx * dy - self.ry * dx >= 0
+
+    def box_visible(self, top, bottom, left, right):
+        # scalar version for a single box
+        lx, ly, rx, ry = self.lx, self.ly, self.rx, self.ry
+        out_left = out_right = True
+        for cx, cy in ((left, bottom), (left, top), (right, top), (right, bottom)):
+            dx, dy = cx - self.x, cy - self.y
+            if lx * dy - ly * dx <= 0:
+                out_left = False
+            if rx * dy - ry * dx >= 0:
+                out_right = False
+        return not (out_left or out_right)
+
+    def corners_visible(self, corners):
+        # corners is any (..., 4, 2) array of box corners, the result has the
+        # leading shape and is True for every box that survives
+        dx = corners[..., 0] - self.x
+        dy = corners[..., 1] - self.y
+        out_left = ((self.lx * dy - self.ly * dx) > 0).all(axis=-1)
+        out_right = ((self.rx * dy - self.ry * dx) < 0).all(axis=-1)
+        return ~(out_left | out_right)
+
+    def boxes_visible(self, boxes):
+        # boxes is (..., 4) of top, bottom, left, right
+        top, bottom, left, right = boxes[..., 0], boxes[..., 1], boxes[..., 2], boxes[..., 3]
+        corners = np.stack([ np.stack([ left, bottom ], axis=-1), np.stack([ left, top ], axis=-1),
+                             np.stack([ right, top ], axis=-1), np.stack([ right, bottom ], axis=-1) ], axis=-2)
+        return self.corners_visible(corners)
+
+    def bsp_visibility(self, bsp):
+        # every child box of every node in one go, (n, 2) indexed [node][side]
+        return self.corners_visible(bsp.CORNERS)
@@ -49,3 +49,16 @@ def read_unsigned_short(file):
         quit()
     finally:
         return struct.unpack('H', d)[0]
+
+
+# buffer based readers, these work straight out of a memoryview (or mmap) of the
+# WAD so there's no syscall per field and no intermediate copies
+def name_from_bytes(raw):
+    # names are NUL padded, anything after the first NUL is garbage
+    return raw.split(b'\0', 1)[0].decode('ascii', errors='replace')
+
+def iter_records(record, buf):
+    # a lump that isn't a whole multiple of the record size just loses the tail
+    # like it did when reading with size // record_size
+    usable = len(buf) - (len(buf) % record.size)
+    return record.iter_unpack(buf[:usable])
@@ -1,4 +1,55 @@
 from pygame.math import Vector2 as vec2
+import numpy as np
+from data_readers import name_from_bytes
+from helper_routines import bams16_to_bams
+
+# column layouts of the map lumps, these match the on-disk records byte for byte
+# so a lump can be viewed in place with np.frombuffer
+THING_DTYPE = np.dtype([ ('x', '<i2'), ('y', '<i2'), ('angle', '<i2'), ('type', '<i2'), ('flags', '<i2') ])
+LINEDEF_DTYPE = np.dtype([ ('start', '<u2'), ('end', '<u2'), ('flags', '<i2'), ('special', '<i2'), ('tag', '<i2'),
+                           ('front', '<i2'), ('back', '<i2') ])
+SIDEDEF_DTYPE = np.dtype([ ('x_off', '<i2'), ('y_off', '<i2'), ('upper', 'S8'), ('lower', 'S8'), ('middle', 'S8'),
+                           ('sector', '<i2') ])
+VERTEX_DTYPE = np.dtype([ ('x', '<i2'), ('y', '<i2') ])
+SEG_DTYPE = np.dtype([ ('start', '<u2'), ('end', '<u2'), ('angle', '<i2'), ('linedef', '<u2'), ('direction', '<i2'),
+                       ('offset', '<i2') ])
+SSECTOR_DTYPE = np.dtype([ ('count', '<u2'), ('first', '<u2') ])
+# boxes are top, bottom, left, right
+NODE_DTYPE = np.dtype([ ('x', '<i2'), ('y', '<i2'), ('dx', '<i2'), ('dy', '<i2'), ('right_box', '<i2', (4,)),
+                        ('left_box', '<i2', (4,)), ('right', '<u2'), ('left', '<u2') ])
+SECTOR_DTYPE = np.dtype([ ('floor', '<i2'), ('ceiling', '<i2'), ('floor_tex', 'S8'), ('ceiling_tex', 'S8'),
+                          ('light', '<i2'), ('special', '<i2'), ('tag', '<i2') ])
+
+class record_view:
+    # tuple-per-record view over a structured array for code that still wants
+    # map.SEGS[n][0] and friends. the tuples are only built the first time the
+    # view is indexed, code that works on .array never pays for them
+    __slots__ = [ 'array', '__rows', '__make_row' ]
+
+    def __init__(self, array, make_row=None):
+        self.array = array
+        self.__rows = None
+        self.__make_row = make_row
+
+    def __materialize(self):
+        if self.__rows is None:
+            rows = self.array.tolist()
+            if self.__make_row is not None:
+                rows = [ self.__make_row(*r) for r in rows ]
+            self.__rows = rows
+        return self.__rows
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, idx):
+        return self.__materialize()[idx]
+
+    def __iter__(self):
+        return iter(self.__materialize())
+
+    def __str__(self):
+        return f'record_view({len(self.array)} x {self.array.dtype})'
 
 class tree_node:
     __slots__ = [ 'PARENT', 'LEFT', 'RIGHT', 'DATA', 'TYPE', 'ID' ]
@@ -28,3 +79,627 @@ class tree_data:
 
 class tree:
     __slots__ = 'ROOT'
+
+# child references with bit 15 set point at a subsector rather than a node
+NF_SUBSECTOR = 0x8000
+
+# sides of a partition line, the right hand side is the front
+FRONT = 0
+BACK = 1
+
+class flat_bsp:
+    # the NODES lump as contiguous arrays indexed by node number instead of a
+    # tree of objects, every walk is iterative so deep trees can't blow the stack
+    #   PARTITIONS  (n, 4) x, y, dx, dy of each partition line
+    #   CHILDREN    (n, 2) front (right) and back (left) child references
+    #   BBOXES      (n, 2, 4) front and back child boxes as top, bottom, left, right
+    #   CORNERS     (n, 2, 4, 2) the same boxes as corner points, for culling
+    __slots__ = [ 'PARTITIONS', 'CHILDREN', 'BBOXES', 'CORNERS', 'ROOT', '__nodes', '__planes', '__leaves' ]
+
+    def __init__(self, nodes):
+        self.PARTITIONS = np.stack([ nodes['x'], nodes['y'], nodes['dx'], nodes['dy'] ], axis=1).astype(np.int32)
+        self.CHILDREN = np.stack([ nodes['right'], nodes['left'] ], axis=1).astype(np.int32)
+        self.BBOXES = np.stack([ nodes['right_box'], nodes['left_box'] ], axis=1).astype(np.int32)
+        top, bottom, left, right = [ self.BBOXES[..., n] for n in range(4) ]
+        self.CORNERS = np.stack([ np.stack([ left, bottom ], axis=-1), np.stack([ left, top ], axis=-1),
+                                  np.stack([ right, top ], axis=-1), np.stack([ right, bottom ], axis=-1) ], axis=2)
+        # a map with a single subsector has no nodes at all
+        self.ROOT = len(nodes) - 1 if len(nodes) > 0 else NF_SUBSECTOR
+        # plain python rows for the scalar walks, indexing numpy one element at
+        # a time is a lot slower than a list
+        self.__nodes = np.concatenate([ self.PARTITIONS, self.CHILDREN ], axis=1).tolist()
+        # subsector -> bounding half-planes, filled in as leaves get located
+        self.__planes = {}
+        self.__leaves = None
+
+    @classmethod
+    def from_tables(cls, partitions, children, bboxes, corners, root):
+        # rebuild from previously computed tables without touching a NODES lump
+        bsp = cls.__new__(cls)
+        bsp.PARTITIONS, bsp.CHILDREN, bsp.BBOXES, bsp.CORNERS, bsp.ROOT = partitions, children, bboxes, corners, root
+        bsp.__nodes = np.concatenate([ partitions, children ], axis=1).tolist()
+        bsp.__planes = {}
+        bsp.__leaves = None
+        return bsp
+
+    def __reduce__(self):
+        # pickles as its tables, the walk list and plane memo get rebuilt
+        return (flat_bsp.from_tables, (self.PARTITIONS, self.CHILDREN, self.BBOXES, self.CORNERS, self.ROOT))
+
+    def __len__(self):
+        return len(self.PARTITIONS)
+
+    def __str__(self):
+        return f'flat_bsp({len(self)} nodes)'
+
+    def is_valid(self, num_subsectors):
+        # cheap checks before a NODES lump is trusted: every child is a node or
+        # subsector that exists, and no node is the child of two parents or of
+        # nothing but the root. with the root never a child, that rules out a
+        # cycle anywhere under it
+        if len(self) == 0:
+            return num_subsectors > 0
+        children = self.CHILDREN.ravel()
+        leaf = (children & NF_SUBSECTOR) != 0
+        nodes = children[~leaf]
+        if (nodes >= len(self)).any() or ((children[leaf] & ~NF_SUBSECTOR) >= num_subsectors).any():
+            return False
+        parents = np.bincount(nodes, minlength=len(self))
+        return parents[self.ROOT] == 0 and (parents <= 1).all()
+
+    def point_on_side(self, node, x, y):
+        nx, ny, ndx, ndy, _, _ = self.__nodes[node]
+        return FRONT if (x - nx) * ndy - (y - ny) * ndx > 0 else BACK
+
+    def locate(self, x, y):
+        # descend to the subsector containing the point
+        node = self.ROOT
+        nodes = self.__nodes
+        while not node & NF_SUBSECTOR:
+            nx, ny, ndx, ndy, front, back = nodes[node]
+            node = front if (x - nx) * ndy - (y - ny) * ndx > 0 else back
+        return node & ~NF_SUBSECTOR
+
+    def path_to(self, x, y):
+        # the (node, side) pairs visited on the way down to the point
+        rv = []
+        node = self.ROOT
+        nodes = self.__nodes
+        while not node & NF_SUBSECTOR:
+            nx, ny, ndx, ndy, front, back = nodes[node]
+            side = FRONT if (x - nx) * ndy - (y - ny) * ndx > 0 else BACK
+            rv.append((node, side))
+            node = front if side == FRONT else back
+        return rv
+
+    def front_to_back(self, x, y, visible=None, done=None, visit=None):
+        # every subsector in strict front to back order from the point, streamed
+        # so the caller can draw as it goes. visible is an optional
+        # visible(node, side) test on the child bbox, children that fail it are
+        # skipped. done is an optional "screen is full" check made after each
+        # subsector has been handed out, the walk ends as soon as it's true.
+        # visit is an optional visit(node) call for everything taken off the
+        # stack, nodes and subsectors alike
+        nodes = self.__nodes
+        stack = [ self.ROOT ]
+        while stack:
+            node = stack.pop()
+            if visit is not None:
+                visit(node)
+            if node & NF_SUBSECTOR:
+                yield node & ~NF_SUBSECTOR
+                if done is not None and done():
+                    return
+                continue
+            nx, ny, ndx, ndy, front, back = nodes[node]
+            if (x - nx) * ndy - (y - ny) * ndx > 0:
+                near, far, far_side = front, back, BACK
+            else:
+                near, far, far_side = back, front, FRONT
+            # push the far side first so the near side comes off the stack first
+            if visible is None or visible(node, far_side):
+                stack.append(far)
+            stack.append(near)
+
+    def locate_many(self, xs, ys):
+        # vectorized locate, every point descends one level per pass so this
+        # is depth numpy steps no matter how many points there are
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        node = np.full(xs.shape, self.ROOT, dtype=np.int64)
+        active = (node & NF_SUBSECTOR) == 0
+        while active.any():
+            n = node[active]
+            part = self.PARTITIONS[n]
+            cross = (xs[active] - part[:, 0]) * part[:, 3] - (ys[active] - part[:, 1]) * part[:, 2]
+            node[active] = np.where(cross > 0, self.CHILDREN[n, FRONT], self.CHILDREN[n, BACK])
+            active = (node & NF_SUBSECTOR) == 0
+        return node & ~NF_SUBSECTOR
+
+    def leaf_region(self, path):
+        # the convex region of the subsector at the end of path (a path_to()
+        # result) as a polygon, and the partition half-planes that actually
+        # bound it. planes that don't touch the region are dropped
+        bounds = self.bounds()
+        if bounds is None:
+            return [], []
+        top, bottom, left, right = bounds
+        poly = [ (left, bottom), (left, top), (right, top), (right, bottom) ]
+        nodes = self.__nodes
+        for node, side in path:
+            nx, ny, ndx, ndy, _, _ = nodes[node]
+            poly = _clip_polygon(poly, nx, ny, ndx, ndy, side)
+            if not poly:
+                break
+        planes = []
+        for node, side in path:
+            nx, ny, ndx, ndy, _, _ = nodes[node]
+            crosses = [ (x - nx) * ndy - (y - ny) * ndx for x, y in poly ]
+            if side == FRONT and min(crosses, default=0) <= 1e-6 or side == BACK and max(crosses, default=0) >= -1e-6:
+                planes.append((nx, ny, ndx, ndy, side))
+        return poly, planes
+
+    def locate_with_planes(self, x, y):
+        # locate, plus the half-planes bounding the subsector found. the planes
+        # are worked out the first time a subsector is reached and kept
+        path = self.path_to(x, y)
+        if not path:
+            return self.ROOT & ~NF_SUBSECTOR, ()
+        node, side = path[-1]
+        ss = self.__nodes[node][4 + side] & ~NF_SUBSECTOR
+        planes = self.__planes.get(ss)
+        if planes is None:
+            planes = self.__planes[ss] = tuple(self.leaf_region(path)[1])
+        return ss, planes
+
+    def bounds(self):
+        # top, bottom, left, right of everything under the root
+        if self.ROOT & NF_SUBSECTOR:
+            return None
+        top, bottom, left, right = [ self.BBOXES[self.ROOT, :, n] for n in range(4) ]
+        return int(top.max()), int(bottom.min()), int(left.min()), int(right.max())
+
+    def depth(self):
+        # deepest node to subsector path, measured in node tests
+        deepest = 0
+        stack = [ (self.ROOT, 0) ]
+        nodes = self.__nodes
+        while stack:
+            node, d = stack.pop()
+            if node & NF_SUBSECTOR:
+                deepest = max(deepest, d)
+                continue
+            stack.append((nodes[node][4], d + 1))
+            stack.append((nodes[node][5], d + 1))
+        return deepest
+
+    def leaf_polygons(self, count):
+        # leaf_region's polygon for every subsector in one walk, each partition
+        # clips the parents polygon once instead of once per leaf under it
+        polys = [ [] for _ in range(count) ]
+        bounds = self.bounds()
+        if bounds is None:
+            return polys
+        top, bottom, left, right = bounds
+        nodes = self.__nodes
+        stack = [ (self.ROOT, [ (left, bottom), (left, top), (right, top), (right, bottom) ]) ]
+        while stack:
+            node, poly = stack.pop()
+            if node & NF_SUBSECTOR:
+                if (node & ~NF_SUBSECTOR) < count:
+                    polys[node & ~NF_SUBSECTOR] = poly
+                continue
+            nx, ny, ndx, ndy, front, back = nodes[node]
+            stack.append((front, _clip_polygon(poly, nx, ny, ndx, ndy, FRONT) if poly else poly))
+            stack.append((back, _clip_polygon(poly, nx, ny, ndx, ndy, BACK) if poly else poly))
+        return polys
+
+    def subtree_leaves(self):
+        # the subsectors under each node as a compressed sparse row pair, node n
+        # covers LEAVES[OFFSETS[n]:OFFSETS[n + 1]]. built on first use
+        if self.__leaves is None:
+            nodes = self.__nodes
+            under = [ [] for _ in range(len(nodes)) ]
+            order = []
+            stack = [] if self.ROOT & NF_SUBSECTOR else [ self.ROOT ]
+            while stack:
+                node = stack.pop()
+                order.append(node)
+                stack.extend(child for child in nodes[node][4:6] if not child & NF_SUBSECTOR)
+            # reversed pre-order has every child ahead of its parent
+            for node in reversed(order):
+                leaves = under[node]
+                for child in nodes[node][4:6]:
+                    if child & NF_SUBSECTOR:
+                        leaves.append(child & ~NF_SUBSECTOR)
+                    else:
+                        leaves.extend(under[child])
+            offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+            np.cumsum([ len(leaves) for leaves in under ], out=offsets[1:])
+            flat = [ leaf for leaves in under for leaf in leaves ]
+            self.__leaves = offsets, np.array(flat, dtype=np.int64)
+        return self.__leaves
+
+def _clip_polygon(poly, nx, ny, ndx, ndy, side):
+    # keep the part of a convex polygon on one side of a partition line
+    def inside(x, y):
+        cross = (x - nx) * ndy - (y - ny) * ndx
+        return cross > 0 if side == FRONT else cross <= 0
+    rv = []
+    for i, (x1, y1) in enumerate(poly):
+        x2, y2 = poly[(i + 1) % len(poly)]
+        in1, in2 = inside(x1, y1), inside(x2, y2)
+        if in1:
+            rv.append((x1, y1))
+        if in1 != in2:
+            c1 = (x1 - nx) * ndy - (y1 - ny) * ndx
+            c2 = (x2 - nx) * ndy - (y2 - ny) * ndx
+            t = c1 / (c1 - c2)
+            rv.append((x1 + (x2 - x1) * t, y1 + (y2 - y1) * t))
+    return rv
+
+class point_locator:
+    # point -> (subsector, sector) for one caller. the last subsectors
+    # bounding half-planes are kept so a point that hasn't left it (most
+    # player and monster moves) is answered with a handful of cross products
+    # instead of a descent from the root
+    __slots__ = [ 'BSP', 'SECTORS', 'hits', 'misses', '__subsector', '__planes', '__box' ]
+
+    def __init__(self, bsp, ssector_sectors):
+        self.BSP = bsp
+        self.SECTORS = ssector_sectors
+        self.hits = 0
+        self.misses = 0
+        self.__subsector = None
+        self.__planes = ()
+        # outside the maps bounds the planes don't tell the whole story, those
+        # points always take the long way
+        self.__box = bsp.bounds()
+
+    def __contains(self, x, y):
+        box = self.__box
+        if box is None or not (box[2] <= x <= box[3] and box[1] <= y <= box[0]):
+            return False
+        for nx, ny, ndx, ndy, side in self.__planes:
+            if ((x - nx) * ndy - (y - ny) * ndx > 0) != (side == FRONT):
+                return False
+        return True
+
+    def locate(self, x, y):
+        if self.__subsector is not None and self.__contains(x, y):
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.__subsector, self.__planes = self.BSP.locate_with_planes(x, y)
+        return self.__subsector, int(self.SECTORS[self.__subsector])
+
+    def reset(self):
+        self.__subsector = None
+
+class reject_table:
+    # the REJECT lump as the packed sectors x sectors bit matrix it is on disk.
+    # bit (a * n + b), counting from the low bit of each byte, is set when
+    # nothing in sector b can possibly be seen from sector a
+    __slots__ = [ 'BITS', 'NUM_SECTORS', '__columns' ]
+
+    def __init__(self, data, num_sectors):
+        n = num_sectors
+        needed = (n * n + 7) // 8
+        bits = np.frombuffer(data, dtype=np.uint8, count=min(len(data), needed))
+        if len(bits) < needed:
+            # short lumps are common (some node builders write a zero length
+            # one), the missing part reads as "can see" so nothing gets culled
+            bits = np.concatenate([ bits, np.zeros(needed - len(bits), dtype=np.uint8) ])
+        # anything past the end of an oversized lump is ignored
+        self.BITS = bits
+        self.NUM_SECTORS = n
+        self.__columns = np.arange(n, dtype=np.int64)
+
+    def __reduce__(self):
+        return (reject_table, (self.BITS, self.NUM_SECTORS))
+
+    def __str__(self):
+        return f'reject_table({self.NUM_SECTORS} sectors)'
+
+    def can_see(self, sector_a, sector_b):
+        idx = sector_a * self.NUM_SECTORS + sector_b
+        return not (self.BITS[idx >> 3] >> (idx & 7)) & 1
+
+    def visible_from(self, sector):
+        # bool array over every sector, True where it may be visible from sector
+        idx = sector * self.NUM_SECTORS + self.__columns
+        return ((self.BITS[idx >> 3] >> (idx & 7)) & 1) == 0
+
+    def visible_sectors(self, sector):
+        return np.flatnonzero(self.visible_from(sector))
+
+class pvs_table:
+    # potentially visible sets, one np.packbits row per subsector. bit b of row
+    # a is set when something in subsector b may be seen from somewhere in
+    # subsector a. baked offline by pvs.py, rows are symmetric
+    __slots__ = [ 'BITS', 'NUM_SUBSECTORS' ]
+
+    def __init__(self, bits, num_subsectors):
+        self.BITS = bits
+        self.NUM_SUBSECTORS = num_subsectors
+
+    def __reduce__(self):
+        return (pvs_table, (self.BITS, self.NUM_SUBSECTORS))
+
+    def __str__(self):
+        return f'pvs_table({self.NUM_SUBSECTORS} subsectors)'
+
+    def can_see(self, ssector_a, ssector_b):
+        return bool((self.BITS[ssector_a, ssector_b >> 3] >> (7 - (ssector_b & 7))) & 1)
+
+    def visible_from(self, ssector):
+        # bool array over every subsector, True where it may be visible
+        return np.unpackbits(self.BITS[ssector], count=self.NUM_SUBSECTORS).astype(bool)
+
+    def visible_subsectors(self, ssector):
+        return np.flatnonzero(self.visible_from(ssector))
+
+    def density(self):
+        # fraction of subsector pairs that can see each other
+        n = self.NUM_SUBSECTORS
+        return int(np.unpackbits(self.BITS).sum()) / (n * n) if n else 0.0
+
+    def bsp_visibility(self, bsp, ssector):
+        # (nodes, 2) bool indexed [node][side] like view_frustum.bsp_visibility,
+        # True where the child holds anything visible from ssector
+        row = self.visible_from(ssector)
+        offsets, leaves = bsp.subtree_leaves()
+        if len(leaves) == 0:
+            return np.zeros((len(bsp), 2), dtype=bool)
+        under = np.logical_or.reduceat(row[leaves], np.minimum(offsets[:-1], len(leaves) - 1))
+        under &= offsets[1:] > offsets[:-1]
+        children = bsp.CHILDREN
+        leaf = (children & NF_SUBSECTOR) != 0
+        index = children & ~NF_SUBSECTOR
+        return np.where(leaf, row[np.where(leaf, index, 0)], under[np.where(leaf, 0, index)])
+
+# BLOCKMAP cells are 128 map units square
+BLOCK_SHIFT = 7
+BLOCK_SIZE = 1 << BLOCK_SHIFT
+
+class block_map:
+    # the BLOCKMAP as a compressed sparse row index. the linedefs in block
+    # (col, row) are LINEDEFS[OFFSETS[b]:OFFSETS[b + 1]] with b = row * COLUMNS + col
+    __slots__ = [ 'ORIGIN_X', 'ORIGIN_Y', 'COLUMNS', 'ROWS', 'OFFSETS', 'LINEDEFS' ]
+
+    def __init__(self, data):
+        words = np.frombuffer(data, dtype='<u2', count=len(data) // 2)
+        if len(words) < 4:
+            self.ORIGIN_X = self.ORIGIN_Y = self.COLUMNS = self.ROWS = 0
+            self.OFFSETS = np.zeros(1, dtype=np.int64)
+            self.LINEDEFS = np.zeros(0, dtype=np.int32)
+            return
+        self.ORIGIN_X, self.ORIGIN_Y = int(words[:2].view('<i2')[0]), int(words[:2].view('<i2')[1])
+        self.COLUMNS, self.ROWS = int(words[2]), int(words[3])
+        nblocks = min(self.COLUMNS * self.ROWS, len(words) - 4)
+        offsets = words[4:4 + nblocks].astype(np.int64)
+        starts = np.minimum(offsets, len(words) - 1)
+        # every list closes with 0xFFFF. vanilla lists also open with a 0
+        # marker, which vanilla P_BlockLinesIterator doesn't skip (it checks
+        # linedef 0 in every block) while Boom does. this index drops the
+        # marker on purpose so linedef 0 only turns up in its own blocks. some
+        # node builders leave the marker out, and then a 0 at the front is
+        # linedef 0. the lump uses the marker when every list it points into
+        # starts with one, which an empty list (0xFFFF alone) rules out
+        # straight away. a linedef 0 kept by mistake is only a spare
+        # candidate, one dropped by mistake would be missed
+        inside = starts[offsets < len(words)]
+        if len(inside) and (words[inside] == 0).all():
+            starts += 1
+        terminators = np.flatnonzero(words == 0xFFFF)
+        after = np.searchsorted(terminators, starts)
+        ends = np.append(terminators, len(words))[after]
+        # a list that starts past the end of a cut off lump is empty
+        counts = np.where(offsets < len(words), np.maximum(ends - starts, 0), 0)
+        self.OFFSETS = np.concatenate([ [0], np.cumsum(counts) ])
+        # one gather for every list at once
+        idx = np.repeat(starts - self.OFFSETS[:-1], counts) + np.arange(self.OFFSETS[-1])
+        self.LINEDEFS = words[idx].astype(np.int32)
+        if nblocks < self.COLUMNS * self.ROWS:
+            # truncated lump, the blocks we never got are empty
+            self.OFFSETS = np.concatenate([ self.OFFSETS, np.full(self.COLUMNS * self.ROWS - nblocks, self.OFFSETS[-1]) ])
+
+    @classmethod
+    def from_tables(cls, origin_x, origin_y, columns, rows, offsets, linedefs):
+        bm = cls.__new__(cls)
+        bm.ORIGIN_X, bm.ORIGIN_Y, bm.COLUMNS, bm.ROWS = origin_x, origin_y, columns, rows
+        bm.OFFSETS, bm.LINEDEFS = offsets, linedefs
+        return bm
+
+    @classmethod
+    def from_boxes(cls, boxes):
+        # a blockmap built from linedef boxes (top, bottom, left, right) for maps
+        # that don't ship one. a line goes in every block its box touches, which
+        # is a few more than the lump would list for diagonals but never fewer
+        boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+        if len(boxes) == 0:
+            return cls.from_tables(0, 0, 0, 0, np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32))
+        origin_x, origin_y = int(boxes[:, 2].min()), int(boxes[:, 1].min())
+        c1, c2 = (boxes[:, 2] - origin_x) >> BLOCK_SHIFT, (boxes[:, 3] - origin_x) >> BLOCK_SHIFT
+        r1, r2 = (boxes[:, 1] - origin_y) >> BLOCK_SHIFT, (boxes[:, 0] - origin_y) >> BLOCK_SHIFT
+        columns, rows = int(c2.max()) + 1, int(r2.max()) + 1
+        # every (line, block) pair at once: each line covers a width x height run
+        width, height = c2 - c1 + 1, r2 - r1 + 1
+        counts = width * height
+        line = np.repeat(np.arange(len(boxes)), counts)
+        n = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        block = (r1[line] + n // width[line]) * columns + c1[line] + n % width[line]
+        order = np.argsort(block, kind='stable')
+        offsets = np.concatenate([ [ 0 ], np.cumsum(np.bincount(block, minlength=columns * rows)) ])
+        return cls.from_tables(origin_x, origin_y, columns, rows, offsets, line[order].astype(np.int32))
+
+    def __reduce__(self):
+        return (block_map.from_tables, (self.ORIGIN_X, self.ORIGIN_Y, self.COLUMNS, self.ROWS, self.OFFSETS, self.LINEDEFS))
+
+    def __str__(self):
+        return f'block_map({self.COLUMNS}x{self.ROWS} at ({self.ORIGIN_X}, {self.ORIGIN_Y}), {len(self.LINEDEFS)} entries)'
+
+    def block_at(self, x, y):
+        # (col, row) of the block holding the point or None when it's off the map
+        col = int((x - self.ORIGIN_X) // BLOCK_SIZE)
+        row = int((y - self.ORIGIN_Y) // BLOCK_SIZE)
+        if 0 <= col < self.COLUMNS and 0 <= row < self.ROWS:
+            return col, row
+        return None
+
+    def linedefs_in_block(self, col, row):
+        b = row * self.COLUMNS + col
+        return self.LINEDEFS[self.OFFSETS[b]:self.OFFSETS[b + 1]]
+
+    def linedefs_at(self, x, y):
+        block = self.block_at(x, y)
+        return self.LINEDEFS[:0] if block is None else self.linedefs_in_block(*block)
+
+    def linedefs_in_box(self, x1, y1, x2, y2):
+        # every linedef listed in a block the box touches, each one once
+        c1 = max(int((min(x1, x2) - self.ORIGIN_X) // BLOCK_SIZE), 0)
+        c2 = min(int((max(x1, x2) - self.ORIGIN_X) // BLOCK_SIZE), self.COLUMNS - 1)
+        r1 = max(int((min(y1, y2) - self.ORIGIN_Y) // BLOCK_SIZE), 0)
+        r2 = min(int((max(y1, y2) - self.ORIGIN_Y) // BLOCK_SIZE), self.ROWS - 1)
+        if c1 > c2 or r1 > r2:
+            return self.LINEDEFS[:0]
+        rows = np.arange(r1, r2 + 1) * self.COLUMNS
+        blocks = (rows[:, None] + np.arange(c1, c2 + 1)[None, :]).ravel()
+        starts, ends = self.OFFSETS[blocks], self.OFFSETS[blocks + 1]
+        counts = ends - starts
+        idx = np.repeat(starts - np.concatenate([ [0], np.cumsum(counts)[:-1] ]), counts) + np.arange(counts.sum())
+        return np.unique(self.LINEDEFS[idx])
+
+    def blocks_along_segment(self, x1, y1, x2, y2):
+        # (col, row) of each block the segment passes through in order from the
+        # start, a plain grid DDA
+        fx, fy = (x1 - self.ORIGIN_X) / BLOCK_SIZE, (y1 - self.ORIGIN_Y) / BLOCK_SIZE
+        tx, ty = (x2 - self.ORIGIN_X) / BLOCK_SIZE, (y2 - self.ORIGIN_Y) / BLOCK_SIZE
+        col, row = int(fx // 1), int(fy // 1)
+        end_col, end_row = int(tx // 1), int(ty // 1)
+        dx, dy = tx - fx, ty - fy
+        step_c = 1 if dx > 0 else -1
+        step_r = 1 if dy > 0 else -1
+        # parametric distance to the next vertical/horizontal grid line and
+        # between successive ones
+        inf = float('inf')
+        next_c = ((col + (step_c > 0)) - fx) / dx if dx != 0 else inf
+        next_r = ((row + (step_r > 0)) - fy) / dy if dy != 0 else inf
+        delta_c = abs(1 / dx) if dx != 0 else inf
+        delta_r = abs(1 / dy) if dy != 0 else inf
+        steps = abs(end_col - col) + abs(end_row - row)
+        for _ in range(steps + 1):
+            if 0 <= col < self.COLUMNS and 0 <= row < self.ROWS:
+                yield col, row
+            if next_c < next_r:
+                col += step_c
+                next_c += delta_c
+            else:
+                row += step_r
+                next_r += delta_r
+
+    def linedefs_along_segment(self, x1, y1, x2, y2):
+        # linedefs from the blocks the segment crosses, in the order they're
+        # first met walking from the start, each one once. this is the
+        # candidate list for a hitscan or a sight check
+        seen = {}
+        for col, row in self.blocks_along_segment(x1, y1, x2, y2):
+            for ld in self.linedefs_in_block(col, row).tolist():
+                seen.setdefault(ld, None)
+        return np.fromiter(seen, dtype=np.int32, count=len(seen))
+
+class map_geometry:
+    # everything the renderer and tools would otherwise work out from the raw
+    # lumps over and over, computed once for the whole map. every table is a
+    # flat array indexed by seg, linedef, sector or subsector number
+    #   SEG_LENGTH       (segs,) length in map units
+    #   SEG_NORMAL       (segs, 2) unit normal pointing out of the front side
+    #   SEG_ANGLE        (segs,) 32 bit BAM, the lumps 16 bit angle widened
+    #   SEG_FRONT/BACK   (segs,) sector on the facing side and behind it, -1 for none
+    #   LINEDEF_BBOX     (linedefs, 4) top, bottom, left, right
+    #   LINEDEF_TWO_SIDED (linedefs,) has a sidedef on both sides
+    #   SECTOR_OFFSETS / SECTOR_LINEDEFS  the linedefs touching sector s are
+    #                    SECTOR_LINEDEFS[SECTOR_OFFSETS[s]:SECTOR_OFFSETS[s + 1]]
+    #   SECTOR_BBOX      (sectors, 4) top, bottom, left, right, zeros for a sector with no lines
+    #   SSECTOR_RANGES   (subsectors, 2) first seg and one past the last
+    __slots__ = [ 'SEG_LENGTH', 'SEG_NORMAL', 'SEG_ANGLE', 'SEG_FRONT', 'SEG_BACK', 'LINEDEF_BBOX', 'LINEDEF_TWO_SIDED',
+                  'SECTOR_OFFSETS', 'SECTOR_LINEDEFS', 'SECTOR_BBOX', 'SSECTOR_RANGES' ]
+
+    def __init__(self, vertexes, linedefs, sidedefs, segs, ssectors, num_sectors):
+        def sector_of(sides):
+            sides = sides.astype(np.int64)
+            ok = (sides >= 0) & (sides < len(sidedefs))
+            rv = np.full(len(sides), -1, dtype=np.int32)
+            rv[ok] = sidedefs['sector'][sides[ok]]
+            return rv
+
+        # segs
+        vx, vy = vertexes['x'].astype(np.float64), vertexes['y'].astype(np.float64)
+        dx = vx[segs['end']] - vx[segs['start']]
+        dy = vy[segs['end']] - vy[segs['start']]
+        self.SEG_LENGTH = np.hypot(dx, dy)
+        length = np.where(self.SEG_LENGTH > 0, self.SEG_LENGTH, 1)
+        # the front is on the right of start -> end
+        self.SEG_NORMAL = np.stack([ dy / length, -dx / length ], axis=1)
+        self.SEG_ANGLE = bams16_to_bams(segs['angle'])
+        ld = segs['linedef'].astype(np.int64)
+        ok = ld < len(linedefs)
+        ld, forward = ld[ok], segs['direction'][ok] == 0
+        front_side = np.full(len(segs), -1, dtype=np.int64)
+        back_side = np.full(len(segs), -1, dtype=np.int64)
+        front_side[ok] = np.where(forward, linedefs['front'][ld], linedefs['back'][ld])
+        back_side[ok] = np.where(forward, linedefs['back'][ld], linedefs['front'][ld])
+        self.SEG_FRONT = sector_of(front_side)
+        self.SEG_BACK = sector_of(back_side)
+
+        # linedefs
+        x1, x2 = vertexes['x'][linedefs['start']].astype(np.int32), vertexes['x'][linedefs['end']].astype(np.int32)
+        y1, y2 = vertexes['y'][linedefs['start']].astype(np.int32), vertexes['y'][linedefs['end']].astype(np.int32)
+        self.LINEDEF_BBOX = np.stack([ np.maximum(y1, y2), np.minimum(y1, y2), np.minimum(x1, x2), np.maximum(x1, x2) ], axis=1)
+        front_sector = sector_of(linedefs['front'])
+        back_sector = sector_of(linedefs['back'])
+        self.LINEDEF_TWO_SIDED = (front_sector >= 0) & (back_sector >= 0)
+
+        # sectors, a linedef belongs to the sector on each of its sides (once
+        # when both sides are the same sector)
+        ids = np.arange(len(linedefs), dtype=np.int32)
+        sector = np.concatenate([ front_sector, np.where(back_sector != front_sector, back_sector, -1) ])
+        line = np.concatenate([ ids, ids ])
+        keep = (sector >= 0) & (sector < num_sectors)
+        sector, line = sector[keep], line[keep]
+        order = np.lexsort((line, sector))
+        self.SECTOR_LINEDEFS = line[order]
+        self.SECTOR_OFFSETS = np.concatenate([ [ 0 ], np.cumsum(np.bincount(sector, minlength=num_sectors)) ]).astype(np.int32)
+        bbox = np.empty((num_sectors, 4), dtype=np.int32)
+        bbox[:, 0::3] = np.iinfo(np.int32).min
+        bbox[:, 1:3] = np.iinfo(np.int32).max
+        boxes = self.LINEDEF_BBOX[line]
+        np.maximum.at(bbox[:, 0], sector, boxes[:, 0])
+        np.minimum.at(bbox[:, 1], sector, boxes[:, 1])
+        np.minimum.at(bbox[:, 2], sector, boxes[:, 2])
+        np.maximum.at(bbox[:, 3], sector, boxes[:, 3])
+        bbox[np.diff(self.SECTOR_OFFSETS) == 0] = 0
+        self.SECTOR_BBOX = bbox
+
+        # subsectors
+        first = ssectors['first'].astype(np.int32)
+        self.SSECTOR_RANGES = np.stack([ np.minimum(first, len(segs)), np.minimum(first + ssectors['count'], len(segs)) ], axis=1)
+
+    @classmethod
+    def from_tables(cls, tables):
+        geometry = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(geometry, name, tables[name])
+        return geometry
+
+    def tables(self):
+        return { name: getattr(self, name) for name in self.__slots__ }
+
+    def __reduce__(self):
+        return (map_geometry.from_tables, (self.tables(),))
+
+    def __str__(self):
+        return f'map_geometry({len(self.SEG_LENGTH)} segs, {len(self.LINEDEF_BBOX)} linedefs, {len(self.SECTOR_BBOX)} sectors)'
+
+    def sector_linedefs(self, sector):
+        return self.SECTOR_LINEDEFS[self.SECTOR_OFFSETS[sector]:self.SECTOR_OFFSETS[sector + 1]]
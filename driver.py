@@ -1,21 +1,146 @@
 import pygame as pg
+import os
+import time
 from pygame.math import Vector2 as vec2
 from constants import *
 from wadfile import WADFile
 from renderer import DoomMapRenderer
+from player import player, WALK_SPEED, RUN_SPEED, TURN_SPEED
+from game_loop import tic_clock, loop_stats
+from map_cache import map_cache
+from pvs import load_pvs
 pg.init()
 screen = pg.display.set_mode(WIN_RES)
 
 wad = WADFile('DOOM.WAD')
-map = wad.load_map('E1M1')
-renderer = DoomMapRenderer(screen, map)
+# MAP_CACHE_DIR=somewhere turns on the preprocessed map cache
+cache_dir = os.environ.get('MAP_CACHE_DIR')
+map = wad.load_map('E1M1', cache=map_cache(cache_dir) if cache_dir else None)
+# a PVS baked with pvs.py sits next to the WAD, without one nothing changes
+renderer = DoomMapRenderer(screen, map, load_pvs(wad, 'E1M1'))
 
+ZOOM_STEP = 1.25
+PAN_STEP = 64
+PAN_KEYS = { pg.K_LEFT: (PAN_STEP, 0), pg.K_RIGHT: (-PAN_STEP, 0), pg.K_UP: (0, PAN_STEP), pg.K_DOWN: (0, -PAN_STEP) }
+# held keys that drive the player, read once a tic
+MOVE_KEYS = { pg.K_w, pg.K_s, pg.K_a, pg.K_d, pg.K_q, pg.K_e, pg.K_LSHIFT, pg.K_RSHIFT }
+INPUT_EVENTS = { pg.KEYDOWN, pg.KEYUP, pg.MOUSEWHEEL, pg.MOUSEBUTTONDOWN, pg.MOUSEMOTION }
+# FRAME_CAP=60 caps the frame rate with pygame's clock, the default is to
+# draw as often as there's something new to draw
+FRAME_CAP = int(os.environ.get('FRAME_CAP', '0'))
+
+def tic_command(held):
+    # (forward, side, turn) for one tic from the keys held down
+    speed = RUN_SPEED if held & { pg.K_LSHIFT, pg.K_RSHIFT } else WALK_SPEED
+    forward = speed * ((pg.K_w in held) - (pg.K_s in held))
+    side = speed * ((pg.K_e in held) - (pg.K_q in held))
+    turn = TURN_SPEED * ((pg.K_a in held) - (pg.K_d in held))
+    return forward, side, turn
+
+def lerp_angle(a, b, t):
+    # the short way round
+    return (a + ((b - a + 180) % 360 - 180) * t) % 360
+
+# the simulated player moves a tic at a time, the renderers copy is put
+# between its last two positions each frame
+sim = player(map)
+last_pos, last_angle = vec2(sim.POS), sim.ANGLE
+drawn = None
+held = set()
+clock = pg.time.Clock()
+tics = tic_clock(time.perf_counter())
+loop = loop_stats()
+# an event that woke the idle wait, handled with the next batch
+woken = []
+redraw = True
 quit = False
-dotcolor = pg.Color(255, 255, 255, 255)
 while not quit:
-    screen.fill('black')
-    renderer.render()
-    for e in pg.event.get():
+    events = woken + pg.event.get()
+    woken = []
+    for e in events:
+        if e.type in INPUT_EVENTS and not (e.type == pg.MOUSEMOTION and not e.buttons[0]):
+            # anything that isn't a movement key shows up on the next frame
+            loop.input(time.perf_counter(), getattr(e, 'key', None) not in MOVE_KEYS)
+            redraw = True
         if e.type == pg.QUIT:
             quit = True
-    pg.display.flip()
\ No newline at end of file
+        elif e.type == pg.KEYDOWN and e.key in MOVE_KEYS:
+            held.add(e.key)
+        elif e.type == pg.KEYUP:
+            held.discard(e.key)
+        elif e.type == pg.KEYDOWN and e.key == pg.K_TAB:
+            # first-person view <-> map
+            renderer.toggle_mode()
+        elif e.type == pg.KEYDOWN and e.key == pg.K_F2:
+            # frame stats collection, on its own so it can run without the
+            # overlay drawing into the frames being measured
+            if renderer.stats is None:
+                renderer.enable_stats()
+            else:
+                renderer.disable_stats()
+        elif e.type == pg.KEYDOWN and e.key == pg.K_F3:
+            # frame stats overlay, there's nothing to show without collection
+            # so turning it on starts that too. turning it off leaves
+            # collection running
+            stats = renderer.enable_stats()
+            stats.overlay = not stats.overlay
+        elif e.type == pg.KEYDOWN and e.key == pg.K_F4 and renderer.stats is not None:
+            renderer.stats.export_json('frame_stats.json')
+            renderer.stats.export_csv('frame_stats.csv')
+        # automap camera: wheel or +/- zoom, drag or arrows pan, F follows the
+        # player, R turns the map with them and 0 fits the whole map again
+        elif e.type == pg.MOUSEWHEEL:
+            renderer.camera.zoom(ZOOM_STEP ** e.y, *pg.mouse.get_pos())
+        elif e.type == pg.MOUSEMOTION and e.buttons[0]:
+            renderer.camera.pan(*e.rel)
+        elif e.type == pg.KEYDOWN and e.key in (pg.K_EQUALS, pg.K_KP_PLUS):
+            renderer.camera.zoom(ZOOM_STEP)
+        elif e.type == pg.KEYDOWN and e.key in (pg.K_MINUS, pg.K_KP_MINUS):
+            renderer.camera.zoom(1 / ZOOM_STEP)
+        elif e.type == pg.KEYDOWN and e.key in PAN_KEYS:
+            renderer.camera.pan(*PAN_KEYS[e.key])
+        elif e.type == pg.KEYDOWN and e.key == pg.K_f:
+            renderer.camera.follow = not renderer.camera.follow
+        elif e.type == pg.KEYDOWN and e.key == pg.K_r:
+            renderer.camera.rotate = not renderer.camera.rotate
+        elif e.type == pg.KEYDOWN and e.key == pg.K_0:
+            renderer.camera.fit(map.get_map_bounds())
+        elif e.type == pg.KEYDOWN and e.key == pg.K_F5:
+            print(loop.report() + f'\ndropped tics {tics.dropped}')
+
+    # fixed rate simulation, however many tics are due
+    now = time.perf_counter()
+    for lateness in tics.run(now):
+        loop.tic(lateness)
+        last_pos, last_angle = vec2(sim.POS), sim.ANGLE
+        sim.think(*tic_command(held))
+
+    # the view sits between the last two tics, when it hasn't moved and
+    # nothing else happened there's nothing new to draw
+    alpha = tics.fraction(now)
+    view = (last_pos.lerp(sim.POS, alpha), lerp_angle(last_angle, sim.ANGLE, alpha))
+    if view != drawn:
+        redraw = True
+    if not redraw:
+        loop.idle += 1
+        # sleep until the next tic unless some input turns up first
+        e = pg.event.wait(max(1, int(tics.until_next(time.perf_counter()) * 1000)))
+        if e.type != pg.NOEVENT:
+            woken.append(e)
+        continue
+    redraw = False
+    drawn = view
+    renderer.__player__.POS, renderer.__player__.ANGLE = view
+    # the renderer hands back only the rects that changed this frame
+    dirty = renderer.render()
+    if renderer.stats is not None:
+        start = time.perf_counter()
+        pg.display.update(dirty)
+        renderer.stats.record_flip((time.perf_counter() - start) * 1000)
+    else:
+        pg.display.update(dirty)
+    loop.presented(time.perf_counter())
+    if FRAME_CAP:
+        clock.tick(FRAME_CAP)
+
+print(loop.report() + f'\ndropped tics {tics.dropped}')
@@ -0,0 +1,84 @@
+import csv
+import json
+import time
+from collections import deque
+import pygame as pg
+
+# per-frame counters for the renderer. nothing here runs unless a renderer has
+# stats switched on, the hot paths only check for None once per frame
+STAT_FIELDS = ( 'frame_ms', 'walk_ms', 'draw_ms', 'flip_ms', 'nodes_visited', 'bboxes_tested', 'bboxes_culled',
+                'subsectors', 'segs', 'draw_calls' )
+VIEW_FIELDS = ( 'map', 'x', 'y', 'angle' )
+
+OVERLAY_COLOR = pg.Color(255, 255, 0)
+OVERLAY_BACKGROUND = pg.Color(0, 0, 0)
+
+class frame_stats:
+    __slots__ = [ 'history', 'current', 'overlay', 'map_name', '__font', '__start' ]
+
+    def __init__(self, history=600, map_name=''):
+        # a rolling window of the last history frames
+        self.history = deque(maxlen=history)
+        self.current = None
+        self.overlay = False
+        self.map_name = map_name
+        self.__font = None
+        self.__start = 0
+
+    def begin_frame(self, x=0, y=0, angle=0):
+        self.current = dict.fromkeys(STAT_FIELDS, 0)
+        self.current.update({ 'map': self.map_name, 'x': float(x), 'y': float(y), 'angle': float(angle) })
+        self.__start = time.perf_counter()
+
+    def end_frame(self):
+        self.current['frame_ms'] = (time.perf_counter() - self.__start) * 1000
+        self.history.append(self.current)
+
+    def add(self, field, value):
+        self.current[field] += value
+
+    def record_flip(self, ms):
+        # the display update happens after the frame was handed over, so it
+        # lands on the frame that was just finished
+        if self.history:
+            self.history[-1]['flip_ms'] = ms
+
+    def last(self):
+        return self.history[-1] if self.history else None
+
+    def summary(self):
+        # mean of every counter over the window
+        if not self.history:
+            return {}
+        return { f: sum(frame[f] for frame in self.history) / len(self.history) for f in STAT_FIELDS }
+
+    def export_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({ 'frames': list(self.history), 'summary': self.summary() }, f, indent=1)
+
+    def export_csv(self, filename):
+        with open(filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=VIEW_FIELDS + STAT_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.history)
+
+    def draw_overlay(self, surface, pos=(8, 8)):
+        # text block with the last frame and the window averages, returns the
+        # rect it covered so it can go on the dirty list
+        frame = self.last()
+        if frame is None:
+            return None
+        if self.__font is None:
+            self.__font = pg.font.Font(None, 20)
+        avg = self.summary()
+        lines = [ f'{f:<14} {frame[f]:>9.2f} {avg[f]:>9.2f}' if f.endswith('_ms') else f'{f:<14} {frame[f]:>9d} {avg[f]:>9.1f}'
+                  for f in STAT_FIELDS ]
+        rendered = [ self.__font.render(line, True, OVERLAY_COLOR, OVERLAY_BACKGROUND) for line in lines ]
+        width = max(r.get_width() for r in rendered)
+        height = sum(r.get_height() for r in rendered)
+        rect = pg.Rect(pos, (width, height))
+        y = pos[1]
+        for r in rendered:
+            surface.blit(r, (pos[0], y))
+            y += r.get_height()
+        return rect
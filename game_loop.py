@@ -0,0 +1,106 @@
+from collections import deque
+
+# timing for the main loop. the game runs in fixed 35 Hz tics like the engine,
+# rendering happens as often as the display allows and draws the player
+# somewhere between the last two tics. tic_clock says how many tics are due and
+# how far into the next one we are, loop_stats keeps what's needed to tune the
+# loop on a given machine:
+#   tic jitter        how late each tic ran against its ideal time
+#   input latency     from pulling an input event off the queue to the first
+#                     display update that shows its effect
+#
+#   tics = tic_clock(time.perf_counter())
+#   for lateness in tics.run(now):
+#       ...one tic of simulation...
+#   alpha = tics.fraction(now)
+
+TICRATE = 35
+TIC_SECONDS = 1 / TICRATE
+# after a stall (window drag, breakpoint) at most this many tics are run back
+# to back, the rest are dropped rather than fast forwarding through them
+MAX_CATCHUP = 8
+
+class tic_clock:
+    __slots__ = [ 'START', 'tics', 'dropped' ]
+
+    def __init__(self, now):
+        self.START = now
+        self.tics = 0
+        self.dropped = 0
+
+    def scheduled(self, tic):
+        # when tic should ideally run
+        return self.START + tic * TIC_SECONDS
+
+    def run(self, now):
+        # lateness in seconds of every tic due by now, one per tic to simulate
+        due = int((now - self.START) / TIC_SECONDS) + 1 - self.tics
+        if due > MAX_CATCHUP:
+            self.dropped += due - MAX_CATCHUP
+            self.tics += due - MAX_CATCHUP
+            due = MAX_CATCHUP
+        late = []
+        for _ in range(max(due, 0)):
+            late.append(now - self.scheduled(self.tics))
+            self.tics += 1
+        return late
+
+    def fraction(self, now):
+        # how far between the last tic run and the next one now is, 0..1
+        return min(max((now - self.scheduled(self.tics - 1)) / TIC_SECONDS, 0.0), 1.0)
+
+    def until_next(self, now):
+        return max(self.scheduled(self.tics) - now, 0.0)
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * p), len(ordered) - 1)] if ordered else 0.0
+
+class loop_stats:
+    # rolling windows of tic lateness and input latency, both in ms
+    __slots__ = [ 'jitter', 'latency', 'frames', 'idle', '__waiting', '__answered' ]
+
+    def __init__(self, history=1024):
+        self.jitter = deque(maxlen=history)
+        self.latency = deque(maxlen=history)
+        self.frames = 0
+        self.idle = 0
+        # the oldest input nothing has reacted to yet, and the oldest one a
+        # tic (or the camera) has reacted to but isn't on screen yet
+        self.__waiting = None
+        self.__answered = None
+
+    def input(self, when, immediate=False):
+        # immediate inputs (camera moves, mode switches) show up on the next
+        # frame, the rest wait for the next tic to pick them up
+        if immediate:
+            self.__answered = when if self.__answered is None else min(self.__answered, when)
+        elif self.__waiting is None:
+            self.__waiting = when
+
+    def tic(self, lateness):
+        self.jitter.append(lateness * 1000)
+        if self.__waiting is not None:
+            self.__answered = self.__waiting if self.__answered is None else min(self.__answered, self.__waiting)
+            self.__waiting = None
+
+    def presented(self, when):
+        # a frame just went to the display
+        self.frames += 1
+        if self.__answered is not None:
+            self.latency.append((when - self.__answered) * 1000)
+            self.__answered = None
+
+    def summary(self):
+        rv = { 'frames': self.frames, 'idle_frames': self.idle }
+        for name, values in (('jitter', self.jitter), ('latency', self.latency)):
+            rv[f'{name}_mean_ms'] = sum(values) / len(values) if values else 0.0
+            rv[f'{name}_p99_ms'] = _percentile(values, 0.99)
+            rv[f'{name}_max_ms'] = max(values, default=0.0)
+        return rv
+
+    def report(self):
+        s = self.summary()
+        return (f'frames {s["frames"]}, idle {s["idle_frames"]}\n'
+                f'tic jitter      mean {s["jitter_mean_ms"]:6.2f} ms  p99 {s["jitter_p99_ms"]:6.2f} ms  max {s["jitter_max_ms"]:6.2f} ms\n'
+                f'input latency   mean {s["latency_mean_ms"]:6.2f} ms  p99 {s["latency_p99_ms"]:6.2f} ms  max {s["latency_max_ms"]:6.2f} ms')
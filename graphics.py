@@ -0,0 +1,252 @@
+import struct
+from collections import OrderedDict
+import numpy as np
+from data_readers import name_from_bytes, iter_records
+
+# the graphics lumps of a loaded WAD, decoded into NumPy arrays the first time
+# something asks for them. nothing is read at open time: PLAYPAL, COLORMAP,
+# PNAMES and the TEXTURE1/2 definitions are parsed on first use, pictures are
+# decoded one at a time and kept in a bounded LRU cache.
+#
+#   gfx = WADGraphics(wad)
+#   gfx.texture('STARTAN3').PIXELS      (width, height) palette indices, [x, y]
+#   gfx.flat('FLOOR4_8')                (64, 64) palette indices, [y, x]
+#   gfx.preload(map)
+#
+# pictures are indexed [x, y] so each column is contiguous, the same layout as
+# the wall renderers framebuffer. flats stay in their on-disk row order since
+# they're drawn a span at a time
+
+PATCH_HEADER = struct.Struct('<hhhh')
+TEXTURE_RECORD = struct.Struct('<8sihhih')
+MAPPATCH_RECORD = struct.Struct('<hhhhh')
+FLAT_SIZE = 64
+NO_TEXTURE = '-'
+
+class picture:
+    # a decoded patch or composite texture, MASK is False where the picture is
+    # see-through
+    __slots__ = [ 'PIXELS', 'MASK', 'LEFT', 'TOP' ]
+
+    def __init__(self, pixels, mask, left=0, top=0):
+        self.PIXELS = pixels
+        self.MASK = mask
+        self.LEFT = left
+        self.TOP = top
+
+    def __str__(self):
+        return f'picture({self.PIXELS.shape[0]}x{self.PIXELS.shape[1]})'
+
+    @property
+    def nbytes(self):
+        return self.PIXELS.nbytes + self.MASK.nbytes
+
+class texture_def:
+    # one entry of TEXTURE1/2, patches are (x, y, patch name)
+    __slots__ = [ 'name', 'width', 'height', 'masked', 'patches' ]
+
+    def __init__(self, name, width, height, masked, patches):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.masked = masked
+        self.patches = patches
+
+def decode_patch(data):
+    # the column/post picture format: a header, one offset per column and each
+    # column a run of posts (top delta, length, pad, pixels, pad) ending in 0xFF
+    width, height, left, top = PATCH_HEADER.unpack_from(data, 0)
+    pixels = np.zeros((width, height), dtype=np.uint8)
+    mask = np.zeros((width, height), dtype=bool)
+    raw = np.frombuffer(data, dtype=np.uint8)
+    offsets = np.frombuffer(data, dtype='<u4', count=width, offset=PATCH_HEADER.size).tolist()
+    size = len(raw)
+    for x, pos in enumerate(offsets):
+        while pos < size and raw[pos] != 0xFF:
+            row, length = int(raw[pos]), int(raw[pos + 1])
+            end = min(row + length, height)
+            if end > row:
+                pixels[x, row:end] = raw[pos + 3:pos + 3 + end - row]
+                mask[x, row:end] = True
+            pos += length + 4
+    return picture(pixels, mask, left, top)
+
+def parse_textures(data, pnames):
+    # name -> texture_def for a TEXTURE1/TEXTURE2 lump
+    rv = {}
+    count = struct.unpack_from('<i', data, 0)[0]
+    for (offset,) in iter_records(struct.Struct('<i'), data[4:4 + count * 4]):
+        name, masked, width, height, _, patch_count = TEXTURE_RECORD.unpack_from(data, offset)
+        start = offset + TEXTURE_RECORD.size
+        patches = []
+        for x, y, patch, _, _ in iter_records(MAPPATCH_RECORD, data[start:start + patch_count * MAPPATCH_RECORD.size]):
+            if 0 <= patch < len(pnames):
+                patches.append((x, y, pnames[patch]))
+        name = name_from_bytes(name).upper()
+        rv[name] = texture_def(name, width, height, masked != 0, patches)
+    return rv
+
+class WADGraphics:
+    __slots__ = [ 'wad', 'cache_bytes', 'cached_bytes', 'hits', 'misses', '__cache', '__missing', '__playpal', '__colormap',
+                  '__pnames', '__textures' ]
+
+    def __init__(self, wad, cache_bytes=32 << 20):
+        self.wad = wad
+        # the cache is bounded by the size of what it holds, not the count
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.__cache = OrderedDict()
+        # names the WAD doesn't have, so asking again doesn't search again.
+        # they take no room so they're kept outside the LRU
+        self.__missing = set()
+        self.__playpal = None
+        self.__colormap = None
+        self.__pnames = None
+        self.__textures = None
+
+    @property
+    def PLAYPAL(self):
+        # (palettes, 256, 3) RGB, palette 0 is the normal one
+        if self.__playpal is None:
+            data = self.wad.get_lump_named('PLAYPAL')
+            count = 0 if data is None else len(data) // 768
+            self.__playpal = np.frombuffer(data if count else b'', dtype=np.uint8, count=count * 768).reshape(count, 256, 3)
+        return self.__playpal
+
+    @property
+    def COLORMAP(self):
+        # (maps, 256) palette index remaps from full bright (0) to dark
+        if self.__colormap is None:
+            data = self.wad.get_lump_named('COLORMAP')
+            count = 0 if data is None else len(data) // 256
+            self.__colormap = np.frombuffer(data if count else b'', dtype=np.uint8, count=count * 256).reshape(count, 256)
+        return self.__colormap
+
+    @property
+    def PNAMES(self):
+        if self.__pnames is None:
+            data = self.wad.get_lump_named('PNAMES')
+            if data is None:
+                self.__pnames = []
+            else:
+                count = struct.unpack_from('<i', data, 0)[0]
+                self.__pnames = [ name_from_bytes(bytes(data[4 + n * 8:12 + n * 8])).upper() for n in range(count) ]
+        return self.__pnames
+
+    def palette(self, index=0):
+        # a palette as (r, g, b) tuples, what pygame.Surface.set_palette takes
+        return [ tuple(c) for c in self.PLAYPAL[index].tolist() ]
+
+    def texture_defs(self):
+        # every composite texture definition, TEXTURE2 entries override TEXTURE1
+        if self.__textures is None:
+            self.__textures = {}
+            for lump in ('TEXTURE1', 'TEXTURE2'):
+                data = self.wad.get_lump_named(lump)
+                if data is not None:
+                    self.__textures.update(parse_textures(data, self.PNAMES))
+        return self.__textures
+
+    def patch(self, name):
+        return self.__get('patch', name.upper(), self.__decode_patch)
+
+    def flat(self, name):
+        return self.__get('flat', name.upper(), self.__decode_flat)
+
+    def texture(self, name):
+        return self.__get('texture', name.upper(), self.__compose_texture)
+
+    def clear(self):
+        # also needed after WADFile.add_pwad, which can fill in missing names
+        self.__cache.clear()
+        self.__missing.clear()
+        self.cached_bytes = 0
+
+    def preload(self, map):
+        # decode every wall texture and flat the map uses so the first frames
+        # don't stall on them, returns how many were decoded. names the WAD
+        # doesn't have are looked for once and not counted
+        walls, flats = map_graphics(map)
+        before, missing = self.misses, len(self.__missing)
+        for name in walls:
+            self.texture(name)
+        for name in flats:
+            self.flat(name)
+        return (self.misses - before) - (len(self.__missing) - missing)
+
+    def __get(self, kind, name, decode):
+        key = (kind, name)
+        value = self.__cache.get(key)
+        if value is not None:
+            self.hits += 1
+            self.__cache.move_to_end(key)
+            return value
+        if key in self.__missing:
+            self.hits += 1
+            return None
+        self.misses += 1
+        value = decode(name)
+        if value is None:
+            self.__missing.add(key)
+            return None
+        self.__cache[key] = value
+        self.cached_bytes += value.nbytes
+        # drop the least recently used, but never whatever was just asked for
+        while self.cached_bytes > self.cache_bytes and len(self.__cache) > 1:
+            _, old = self.__cache.popitem(last=False)
+            self.cached_bytes -= old.nbytes
+        return value
+
+    def __decode_patch(self, name):
+        # patches should be between P_START and P_END but plenty of PWADs don't
+        # bother, so fall back to the global index
+        entry = self.wad.LUMPS.get_entry_named(name, 'P') or self.wad.LUMPS.get_entry_named(name)
+        if entry is None:
+            return None
+        return decode_patch(self.wad.lump(entry))
+
+    def __decode_flat(self, name):
+        entry = self.wad.LUMPS.get_entry_named(name, 'F')
+        if entry is None or entry.size < FLAT_SIZE * FLAT_SIZE:
+            return None
+        return np.frombuffer(self.wad.lump(entry), dtype=np.uint8, count=FLAT_SIZE * FLAT_SIZE).reshape(FLAT_SIZE, FLAT_SIZE)
+
+    def __compose_texture(self, name):
+        # the patches drawn over each other at their offsets, clipped to the
+        # texture. patches are decoded straight from the lumps here rather than
+        # through the cache so building a texture doesn't evict anything
+        tex = self.texture_defs().get(name)
+        if tex is None:
+            return None
+        pixels = np.zeros((tex.width, tex.height), dtype=np.uint8)
+        mask = np.zeros((tex.width, tex.height), dtype=bool)
+        for x, y, patch_name in tex.patches:
+            key = ('patch', patch_name)
+            patch = self.__cache.get(key) or self.__decode_patch(patch_name)
+            if patch is None:
+                continue
+            w, h = patch.PIXELS.shape
+            x1, y1 = max(x, 0), max(y, 0)
+            x2, y2 = min(x + w, tex.width), min(y + h, tex.height)
+            if x1 >= x2 or y1 >= y2:
+                continue
+            src = (slice(x1 - x, x2 - x), slice(y1 - y, y2 - y))
+            opaque = patch.MASK[src]
+            np.copyto(pixels[x1:x2, y1:y2], patch.PIXELS[src], where=opaque)
+            mask[x1:x2, y1:y2] |= opaque
+        return picture(pixels, mask)
+
+def map_graphics(map):
+    # (wall texture names, flat names) a map references, '-' left out
+    sidedefs = map.SIDEDEFS.array
+    sectors = map.SECTORS.array
+    def names(*columns):
+        found = set()
+        for column in columns:
+            found.update(name_from_bytes(raw).upper() for raw in np.unique(column).tolist())
+        found.discard(NO_TEXTURE)
+        found.discard('')
+        return sorted(found)
+    return names(sidedefs['upper'], sidedefs['lower'], sidedefs['middle']), names(sectors['floor_tex'], sectors['ceiling_tex'])
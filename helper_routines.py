@@ -1,10 +1,38 @@
 import math
+import numpy as np
+
+# binary angles. a full turn is 2^32 so angles wrap for free with a mask, the
+# WAD stores the top 16 bits of one (BAM16). the fine tables cut the circle into
+# FINEANGLES steps and are indexed with the top bits of a BAM like Doom does
+ANG45 = 0x20000000
+ANG90 = 0x40000000
+ANG180 = 0x80000000
+ANG270 = 0xC0000000
+ANGLE_MASK = 0xFFFFFFFF
+
+FINEANGLES = 8192
+FINEMASK = FINEANGLES - 1
+ANGLETOFINESHIFT = 19
+
+# sine over a turn and a quarter so cosine is the same table a quarter on
+FINESINE = np.sin((np.arange(FINEANGLES * 5 // 4) + 0.5) * (2 * math.pi / FINEANGLES))
+FINECOSINE = FINESINE[FINEANGLES // 4:]
+# tangent over half a turn starting at -90, it repeats after that
+FINETANGENT = np.tan((np.arange(FINEANGLES // 2) - FINEANGLES // 4 + 0.5) * (2 * math.pi / FINEANGLES))
+
+# atan of slope / SLOPERANGE for the 0..45 degree octant, as BAM
+SLOPERANGE = 2048
+TANTOANGLE = np.round(np.arctan(np.arange(SLOPERANGE + 1) / SLOPERANGE) * (ANG180 / math.pi)).astype(np.int64)
+_FINESINE = FINESINE.tolist()
+_FINECOSINE = FINECOSINE.tolist()
+_FINETANGENT = FINETANGENT.tolist()
+_TANTOANGLE = TANTOANGLE.tolist()
 
 def deg_to_bam16(deg):
-    return math.floor((deg/24)*4369)
+    return int(round(deg * 65536 / 360))
 
 def bam16_to_deg(bam):
-    return math.floor((bam/4369)*24)
+    return bam * 360 / 65536
 
 def deg_to_rad(deg):
     return deg * (math.pi/180)
@@ -13,10 +41,90 @@ def rad_to_deg(rad):
     return rad / (math.pi/180)
 
 def bam16_to_rad(bam):
-    return deg_to_rad(bam16_to_deg(bam))
+    return bam * (math.pi / 32768)
 
 def rad_to_bam16(rad):
-    return deg_to_bam16(rad_to_deg(rad))
+    return int(round(rad * 32768 / math.pi))
+
+def bam16_to_bam(bam):
+    return (bam << 16) & ANGLE_MASK
+
+def bam_to_bam16(bam):
+    return ((bam + 0x8000) >> 16) & 0xFFFF
+
+def deg_to_bam(deg):
+    return int(round(deg * (ANG180 / 180))) & ANGLE_MASK
+
+def bam_to_deg(bam):
+    return (bam & ANGLE_MASK) * (180 / ANG180)
+
+def rad_to_bam(rad):
+    return int(round(rad * (ANG180 / math.pi))) & ANGLE_MASK
+
+def bam_to_rad(bam):
+    return (bam & ANGLE_MASK) * (math.pi / ANG180)
+
+def degs_to_bams(degs):
+    # vectorized deg_to_bam, int64 so sums of angles don't overflow before masking
+    return np.round(np.asarray(degs, dtype=np.float64) * (ANG180 / 180)).astype(np.int64) & ANGLE_MASK
+
+def bams_to_degs(bams):
+    return (np.asarray(bams, dtype=np.int64) & ANGLE_MASK) * (180 / ANG180)
+
+def bams16_to_bams(bams):
+    # vectorized bam16_to_bam, signed or unsigned lump angles alike
+    return (np.asarray(bams, dtype=np.int64) << 16) & ANGLE_MASK
+
+def bams_to_bams16(bams):
+    # vectorized bam_to_bam16 as the int16 the lumps store
+    return (((np.asarray(bams, dtype=np.int64) + 0x8000) >> 16) & 0xFFFF).astype(np.uint16).view(np.int16)
+
+def fine_sine(bam):
+    return _FINESINE[(bam & ANGLE_MASK) >> ANGLETOFINESHIFT]
+
+def fine_cosine(bam):
+    return _FINECOSINE[(bam & ANGLE_MASK) >> ANGLETOFINESHIFT]
+
+def fine_tangent(bam):
+    return _FINETANGENT[((bam + ANG90) & ANGLE_MASK) >> ANGLETOFINESHIFT & (FINEANGLES // 2 - 1)]
+
+def fine_sines(bams):
+    return FINESINE[(np.asarray(bams, dtype=np.int64) & ANGLE_MASK) >> ANGLETOFINESHIFT]
+
+def fine_cosines(bams):
+    return FINECOSINE[(np.asarray(bams, dtype=np.int64) & ANGLE_MASK) >> ANGLETOFINESHIFT]
+
+def fine_tangents(bams):
+    return FINETANGENT[((np.asarray(bams, dtype=np.int64) + ANG90) & ANGLE_MASK) >> ANGLETOFINESHIFT & (FINEANGLES // 2 - 1)]
+
+def point_to_angle(dx, dy):
+    # R_PointToAngle: the BAM of the vector (dx, dy), folded into the first
+    # octant for the TANTOANGLE lookup and unfolded again
+    ax, ay = abs(dx), abs(dy)
+    if ax > ay:
+        a = _TANTOANGLE[int(ay * SLOPERANGE / ax)]
+    elif ay:
+        a = ANG90 - _TANTOANGLE[int(ax * SLOPERANGE / ay)]
+    else:
+        return 0
+    if dy >= 0:
+        return a if dx >= 0 else ANG180 - a
+    return (ANG180 + a if dx < 0 else -a) & ANGLE_MASK
+
+def points_to_angles(dxs, dys):
+    # vectorized point_to_angle, one BAM per vector
+    dxs = np.asarray(dxs, dtype=np.float64)
+    dys = np.asarray(dys, dtype=np.float64)
+    ax, ay = np.abs(dxs), np.abs(dys)
+    shallow = ax > ay
+    big = np.where(shallow, ax, ay)
+    small = np.where(shallow, ay, ax)
+    slope = (small * SLOPERANGE / np.where(big > 0, big, 1)).astype(np.int64)
+    a = TANTOANGLE[slope]
+    a = np.where(shallow, a, ANG90 - a)
+    a = np.where(dys >= 0, np.where(dxs >= 0, a, ANG180 - a), np.where(dxs < 0, ANG180 + a, -a))
+    a[big == 0] = 0
+    return a & ANGLE_MASK
 
 def dot_product(vec1, vec2):
-    return (vec1[0]*vec2[0]+vec1[1]*vec2[1])
\ No newline at end of file
+    return (vec1[0]*vec2[0]+vec1[1]*vec2[1])
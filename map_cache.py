@@ -0,0 +1,142 @@
+import os
+import json
+import mmap
+import struct
+import hashlib
+import numpy as np
+from wadfile import WADMap
+from datatypes import flat_bsp, reject_table, block_map, map_geometry
+
+# an opt-in on-disk cache of fully decoded maps. each map is one file: a small
+# JSON header followed by every array it needs (lumps, BSP tables, REJECT,
+# BLOCKMAP, derived data) laid out raw and 16 byte aligned, so a warm start is
+# one mmap and a set of np.frombuffer views with no parsing at all.
+#
+#   cache = map_cache('.mapcache')
+#   map = wad.load_map('E1M1', cache=cache)
+#
+# files are keyed on a hash of the maps lump contents, the map name and
+# FORMAT_VERSION. anything that doesn't match is rebuilt and rewritten.
+
+FORMAT_VERSION = 4
+MAGIC = b'WMCACHE\0'
+PREFIX = struct.Struct('<8sI')
+ALIGN = 16
+
+def map_key(wad, mapname):
+    # hash of the lumps the map is actually built from, PWAD overrides included
+    h = hashlib.sha1()
+    h.update(mapname.encode('ascii'))
+    for entry in wad.LUMPS.map_entries(mapname):
+        h.update(entry.name.encode('ascii'))
+        h.update(struct.pack('<i', entry.size))
+        h.update(wad.lump(entry))
+    return f'{h.hexdigest()}:{mapname}:{FORMAT_VERSION}'
+
+def _map_arrays(m):
+    # everything that goes in the file, by name
+    bsp = m.BSP
+    arrays = m.arrays()
+    arrays.update({
+        'REJECT': m.REJECT.BITS, 'SSECTOR_SECTORS': m.SSECTOR_SECTORS,
+        'BSP_PARTITIONS': bsp.PARTITIONS, 'BSP_CHILDREN': bsp.CHILDREN, 'BSP_BBOXES': bsp.BBOXES, 'BSP_CORNERS': bsp.CORNERS
+    })
+    if m.BLOCKMAP is not None:
+        arrays['BLOCKMAP_OFFSETS'] = m.BLOCKMAP.OFFSETS
+        arrays['BLOCKMAP_LINEDEFS'] = m.BLOCKMAP.LINEDEFS
+    arrays.update({ f'GEOMETRY_{name}': table for name, table in m.GEOMETRY.tables().items() })
+    return arrays
+
+def write_map(filename, key, m):
+    arrays = _map_arrays(m)
+    header = { 'key': key, 'map': m.name, 'version': FORMAT_VERSION, 'bounds': list(m.get_map_bounds()),
+               'bsp_root': m.BSP.ROOT, 'reject_sectors': m.REJECT.NUM_SECTORS, 'arrays': {} }
+    if m.BLOCKMAP is not None:
+        bm = m.BLOCKMAP
+        header['blockmap'] = [ bm.ORIGIN_X, bm.ORIGIN_Y, bm.COLUMNS, bm.ROWS ]
+    # the array offsets depend on the header size and the header holds the
+    # offsets, so lay the arrays out relative to the data start first
+    offset = 0
+    for name, a in arrays.items():
+        a = np.ascontiguousarray(a)
+        arrays[name] = a
+        header['arrays'][name] = { 'dtype': a.dtype.descr if a.dtype.names else a.dtype.str, 'shape': list(a.shape),
+                                   'offset': offset }
+        offset += -(-a.nbytes // ALIGN) * ALIGN
+    raw_header = json.dumps(header).encode('utf-8')
+    data_start = -(-(PREFIX.size + len(raw_header)) // ALIGN) * ALIGN
+    tmp = f'{filename}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(PREFIX.pack(MAGIC, len(raw_header)))
+        f.write(raw_header)
+        f.write(bytes(data_start - PREFIX.size - len(raw_header)))
+        for name, a in arrays.items():
+            f.write(a.tobytes())
+            f.write(bytes(-(-a.nbytes // ALIGN) * ALIGN - a.nbytes))
+    # readers never see a half written file
+    os.replace(tmp, filename)
+
+def _dtype(descr):
+    return np.dtype([ tuple(field) for field in descr ]) if isinstance(descr, list) else np.dtype(descr)
+
+def read_map(filename, key):
+    # the cached map or None when the file is missing, stale or broken
+    try:
+        with open(filename, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        magic, header_len = PREFIX.unpack_from(mm, 0)
+        if magic != MAGIC:
+            return None
+        header = json.loads(mm[PREFIX.size:PREFIX.size + header_len])
+        if header.get('version') != FORMAT_VERSION or header.get('key') != key:
+            return None
+        data_start = -(-(PREFIX.size + header_len) // ALIGN) * ALIGN
+        arrays = {}
+        for name, info in header['arrays'].items():
+            dtype = _dtype(info['dtype'])
+            count = int(np.prod(info['shape'], dtype=np.int64))
+            arrays[name] = np.frombuffer(mm, dtype=dtype, count=count,
+                                         offset=data_start + info['offset']).reshape(info['shape'])
+    except (struct.error, ValueError, KeyError, TypeError):
+        return None
+    bsp = flat_bsp.from_tables(arrays['BSP_PARTITIONS'], arrays['BSP_CHILDREN'], arrays['BSP_BBOXES'],
+                               arrays['BSP_CORNERS'], header['bsp_root'])
+    reject = reject_table(arrays['REJECT'], header['reject_sectors'])
+    blockmap = None
+    if 'blockmap' in header:
+        blockmap = block_map.from_tables(*header['blockmap'], arrays['BLOCKMAP_OFFSETS'], arrays['BLOCKMAP_LINEDEFS'])
+    geometry = map_geometry.from_tables({ name[9:]: table for name, table in arrays.items() if name.startswith('GEOMETRY_') })
+    return WADMap.from_arrays(header['map'], arrays, bsp, reject, blockmap, arrays['SSECTOR_SECTORS'],
+                              tuple(header['bounds']), geometry)
+
+class map_cache:
+    __slots__ = [ 'directory', 'hits', 'misses' ]
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, wad, mapname):
+        base = os.path.splitext(os.path.basename(wad.NAME))[0]
+        return os.path.join(self.directory, f'{base}-{mapname}.wmc')
+
+    def load(self, wad, mapname):
+        if wad.LUMPS.map_entries(mapname) is None:
+            print(f'Map {mapname} not found in WAD File {wad.NAME}')
+            return None
+        key = map_key(wad, mapname)
+        filename = self.path(wad, mapname)
+        m = read_map(filename, key)
+        if m is not None:
+            self.hits += 1
+            return m
+        # cold or stale, parse it the long way and leave a copy for next time
+        self.misses += 1
+        m = wad.load_map(mapname)
+        os.makedirs(self.directory, exist_ok=True)
+        write_map(filename, key, m)
+        return m
@@ -0,0 +1,315 @@
+import numpy as np
+from datatypes import SEG_DTYPE, SSECTOR_DTYPE, NODE_DTYPE, VERTEX_DTYPE, NF_SUBSECTOR, FRONT, BACK, flat_bsp
+from helper_routines import points_to_angles, bams_to_bams16
+
+# rebuilds SEGS, SSECTORS and NODES from VERTEXES, LINEDEFS and SIDEDEFS for
+# maps that ship without nodes, with broken ones or with badly unbalanced ones.
+#
+#   vertexes, segs, ssectors, nodes = build_nodes(map.VERTEXES.array, map.LINEDEFS.array, map.SIDEDEFS.array)
+#   map.rebuild_nodes(split_weight=4)
+#   python nodebuilder.py DOOM.WAD E1M1 E1M2 --split-weight 4
+#
+# it's the classic recursive builder: every sidedef becomes a seg, then each
+# set of segs is cut by the line of one of its own segs until what's left is
+# convex. a candidate line costs split_weight for every seg it would split
+# plus the difference in size of the two halves, so a low split_weight gives
+# a shallower, better balanced tree and a high one fewer extra segs. every
+# candidate is scored against every seg in one NumPy pass
+
+SPLIT_WEIGHT = 8
+CANDIDATES = 64
+# distance from a partition line that counts as on it, in map units
+EPSILON = 0.01
+
+def initial_segs(vertexes, linedefs):
+    # one seg per sidedef as (x1, y1, x2, y2, linedef, direction, offset)
+    x = vertexes['x'].astype(np.float64)
+    y = vertexes['y'].astype(np.float64)
+    start, end = linedefs['start'].astype(np.int64), linedefs['end'].astype(np.int64)
+    ids = np.arange(len(linedefs), dtype=np.float64)
+    has_length = (x[start] != x[end]) | (y[start] != y[end])
+    front = has_length & (linedefs['front'] >= 0)
+    back = has_length & (linedefs['back'] >= 0)
+    zeros = np.zeros(len(linedefs))
+    ones = np.ones(len(linedefs))
+    fronts = np.stack([ x[start], y[start], x[end], y[end], ids, zeros, zeros ], axis=1)[front]
+    backs = np.stack([ x[end], y[end], x[start], y[start], ids, ones, zeros ], axis=1)[back]
+    return np.concatenate([ fronts, backs ])
+
+def fit_partition(seg):
+    # NODES stores the partition as int16 x, y, dx, dy. a seg longer than that
+    # gets its direction halved until it fits, the line itself doesn't move
+    x, y, x2, y2 = (int(v) for v in seg[:4])
+    dx, dy = x2 - x, y2 - y
+    while not (-32768 <= dx <= 32767 and -32768 <= dy <= 32767):
+        dx, dy = dx // 2, dy // 2
+    return x, y, dx, dy
+
+def classify(segs, partitions):
+    # signed distances of both ends of every seg from every partition,
+    # (candidates, segs) each. positive is the front (right hand) side
+    px, py, pdx, pdy = [ partitions[:, n:n + 1] for n in range(4) ]
+    length = np.hypot(pdx, pdy)
+    d1 = ((segs[:, 0] - px) * pdy - (segs[:, 1] - py) * pdx) / length
+    d2 = ((segs[:, 2] - px) * pdy - (segs[:, 3] - py) * pdx) / length
+    return d1, d2
+
+def sides(segs, partitions):
+    # (front, back, split) masks of shape (candidates, segs). segs lying on
+    # the line go in front when they run the same way as it and behind when
+    # they don't
+    d1, d2 = classify(segs, partitions)
+    on1, on2 = np.abs(d1) < EPSILON, np.abs(d2) < EPSILON
+    collinear = on1 & on2
+    same_way = ((segs[:, 2] - segs[:, 0]) * partitions[:, 2:3] + (segs[:, 3] - segs[:, 1]) * partitions[:, 3:4]) > 0
+    front = np.where(collinear, same_way, ((d1 > 0) | on1) & ((d2 > 0) | on2))
+    back = np.where(collinear, ~same_way, ((d1 < 0) | on1) & ((d2 < 0) | on2))
+    split = ~front & ~back
+    return front, back, split
+
+def is_convex(segs, chunk=256):
+    # nothing behind any seg's own line, checked a block of lines at a time
+    for n in range(0, len(segs), chunk):
+        lines = segs[n:n + chunk]
+        partitions = np.stack([ lines[:, 0], lines[:, 1], lines[:, 2] - lines[:, 0], lines[:, 3] - lines[:, 1] ], axis=1)
+        _, back, split = sides(segs, partitions)
+        if (back | split).any():
+            return False
+    return True
+
+def split_segs(segs, partition, split):
+    # cut the straddling segs where they cross the partition, the new point is
+    # rounded to the map grid like any other vertex. returns (front, back)
+    # pieces, anything that rounds down to nothing is dropped
+    cut = segs[split]
+    d1, d2 = classify(cut, np.array([ partition ], dtype=np.float64))
+    d1, d2 = d1[0], d2[0]
+    t = d1 / (d1 - d2)
+    ix = np.round(cut[:, 0] + t * (cut[:, 2] - cut[:, 0]))
+    iy = np.round(cut[:, 1] + t * (cut[:, 3] - cut[:, 1]))
+    first = cut.copy()
+    first[:, 2], first[:, 3] = ix, iy
+    second = cut.copy()
+    second[:, 0], second[:, 1] = ix, iy
+    second[:, 6] += np.hypot(ix - cut[:, 0], iy - cut[:, 1])
+    first_front = d1 > 0
+    front = np.concatenate([ first[first_front], second[~first_front] ])
+    back = np.concatenate([ first[~first_front], second[first_front] ])
+    keep = lambda s: s[(s[:, 0] != s[:, 2]) | (s[:, 1] != s[:, 3])]
+    return keep(front), keep(back)
+
+def seg_box(segs):
+    # top, bottom, left, right
+    ys = np.concatenate([ segs[:, 1], segs[:, 3] ])
+    xs = np.concatenate([ segs[:, 0], segs[:, 2] ])
+    return int(ys.max()), int(ys.min()), int(xs.min()), int(xs.max())
+
+class node_builder:
+    __slots__ = [ 'split_weight', 'candidates', 'segs', 'ssectors', 'nodes', 'splits', '__count' ]
+
+    def __init__(self, split_weight=SPLIT_WEIGHT, candidates=CANDIDATES):
+        self.split_weight = split_weight
+        # how many seg lines are scored at each node, sets over this size are
+        # sampled evenly rather than scoring every line
+        self.candidates = candidates
+        self.segs = []
+        self.ssectors = []
+        self.nodes = []
+        self.splits = 0
+        self.__count = 0
+
+    def build(self, segs):
+        # returns the root reference, the output collects in segs/ssectors/nodes
+        return self.__build(segs)
+
+    def __score(self, segs, lines):
+        partitions = np.array([ fit_partition(s) for s in lines ], dtype=np.float64)
+        front, back, split = sides(segs, partitions)
+        return partitions, front, back, split
+
+    def __pick(self, scored, strict):
+        # the cheapest usable line. strict lines have whole segs behind them,
+        # which guarantees both halves shrink
+        partitions, front, back, split = scored
+        splits = split.sum(axis=1)
+        fronts = front.sum(axis=1) + splits
+        backs = back.sum(axis=1) + splits
+        usable = (fronts > splits) & (backs > splits) if strict else (fronts > 0) & (backs > 0)
+        if not usable.any():
+            return None
+        cost = np.where(usable, splits * self.split_weight + np.abs(fronts - backs), np.inf)
+        best = int(np.argmin(cost))
+        return tuple(int(v) for v in partitions[best]), front[best], back[best], split[best]
+
+    def __choose(self, segs):
+        # the partition to divide segs with, or None when the set is already
+        # convex (or can't be divided)
+        n = len(segs)
+        sampled = n > self.candidates
+        picks = np.linspace(0, n - 1, self.candidates).astype(np.int64) if sampled else np.arange(n)
+        scored = self.__score(segs, segs[picks])
+        if sampled and not (scored[2] | scored[3]).any() and is_convex(segs):
+            return None
+        choice = self.__pick(scored, True)
+        if choice is None and sampled:
+            # the sample missed every useful line, score all of them
+            scored = self.__score(segs, segs)
+            choice = self.__pick(scored, True)
+        return choice if choice is not None else self.__pick(scored, False)
+
+    def __leaf(self, segs):
+        if len(self.ssectors) >= NF_SUBSECTOR:
+            raise ValueError('too many subsectors for the NODES format')
+        self.ssectors.append((len(segs), self.__count))
+        self.segs.append(segs)
+        self.__count += len(segs)
+        return NF_SUBSECTOR | (len(self.ssectors) - 1)
+
+    def __build(self, segs):
+        # an explicit work stack rather than recursion so a deep tree can't hit
+        # the interpreter's limit. refs collects each subtree's reference, a
+        # node goes on the stack under its two halves and is written once both
+        # are done, right before left, so the root still comes out last
+        refs = [ None ]
+        stack = [ (segs, 0) ]
+        while stack:
+            task = stack.pop()
+            if len(task) == 6:
+                partition, right_box, left_box, right, left, slot = task
+                if len(self.nodes) >= NF_SUBSECTOR:
+                    raise ValueError('too many nodes for the NODES format')
+                self.nodes.append(partition + (right_box, left_box, refs[right], refs[left]))
+                refs[slot] = len(self.nodes) - 1
+                continue
+            segs, slot = task
+            choice = self.__choose(segs)
+            if choice is None:
+                refs[slot] = self.__leaf(segs)
+                continue
+            partition, front, back, split = choice
+            cut_front, cut_back = split_segs(segs, partition, split)
+            front_segs = np.concatenate([ segs[front], cut_front ])
+            back_segs = np.concatenate([ segs[back], cut_back ])
+            if not (0 < len(front_segs) < len(segs) and 0 < len(back_segs) < len(segs)):
+                # a split-only line that didn't shrink both halves could go round
+                # forever, better a slightly concave leaf than no end to it
+                refs[slot] = self.__leaf(segs)
+                continue
+            self.splits += int(split.sum())
+            right, left = len(refs), len(refs) + 1
+            refs.extend((None, None))
+            stack.append((partition, seg_box(front_segs), seg_box(back_segs), right, left, slot))
+            stack.append((back_segs, left))
+            stack.append((front_segs, right))
+        return refs[0]
+
+def build_nodes(vertexes, linedefs, sidedefs=None, split_weight=SPLIT_WEIGHT, candidates=CANDIDATES):
+    # (VERTEXES, SEGS, SSECTORS, NODES) as structured arrays in the lump
+    # layouts. VERTEXES is the original vertexes plus any made by splits.
+    # sidedefs isn't needed for the geometry, it's taken so callers can hand
+    # over the map lumps as they are
+    segs = initial_segs(vertexes, linedefs)
+    builder = node_builder(split_weight, candidates)
+    if len(segs):
+        builder.build(segs)
+    segs = np.concatenate(builder.segs) if builder.segs else np.zeros((0, 7))
+
+    # vertexes, every original in its place (duplicates included) and one
+    # more per new split point. index is only for finding a point, where two
+    # originals share one the first of them is used
+    points = [ (int(x), int(y)) for x, y in vertexes[['x', 'y']].tolist() ]
+    index = {}
+    for n, p in enumerate(points):
+        index.setdefault(p, n)
+    def vertex(x, y):
+        v = index.get((x, y))
+        if v is None:
+            v = index[(x, y)] = len(points)
+            points.append((x, y))
+        return v
+    ends = segs[:, :4].astype(np.int64).tolist()
+    starts = [ vertex(x1, y1) for x1, y1, _, _ in ends ]
+    stops = [ vertex(x2, y2) for _, _, x2, y2 in ends ]
+    if len(points) > 0xFFFF or len(segs) > 0xFFFF:
+        raise ValueError('too many vertexes or segs for the map lump formats')
+    out_vertexes = np.zeros(len(points), dtype=VERTEX_DTYPE)
+    out_vertexes[:len(vertexes)] = vertexes
+    if len(points) > len(vertexes):
+        out_vertexes[len(vertexes):] = points[len(vertexes):]
+
+    out_segs = np.zeros(len(segs), dtype=SEG_DTYPE)
+    out_segs['start'] = starts
+    out_segs['end'] = stops
+    out_segs['angle'] = bams_to_bams16(points_to_angles(segs[:, 2] - segs[:, 0], segs[:, 3] - segs[:, 1]))
+    out_segs['linedef'] = segs[:, 4]
+    out_segs['direction'] = segs[:, 5]
+    out_segs['offset'] = np.round(segs[:, 6])
+
+    out_ssectors = np.array(builder.ssectors, dtype=np.int64).reshape(-1, 2)
+    ssectors = np.zeros(len(out_ssectors), dtype=SSECTOR_DTYPE)
+    ssectors['count'], ssectors['first'] = out_ssectors[:, 0], out_ssectors[:, 1]
+
+    nodes = np.zeros(len(builder.nodes), dtype=NODE_DTYPE)
+    for n, (x, y, dx, dy, right_box, left_box, right, left) in enumerate(builder.nodes):
+        nodes[n] = (x, y, dx, dy, right_box, left_box, right, left)
+    return out_vertexes, out_segs, ssectors, nodes
+
+def traversal_cost(bsp, xs, ys):
+    # nodes visited locating each point, the per-frame price of a point
+    # location or of reaching the players leaf in a walk
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    node = np.full(xs.shape, bsp.ROOT, dtype=np.int64)
+    steps = np.zeros(xs.shape, dtype=np.int64)
+    active = (node & NF_SUBSECTOR) == 0
+    while active.any():
+        n = node[active]
+        part = bsp.PARTITIONS[n]
+        cross = (xs[active] - part[:, 0]) * part[:, 3] - (ys[active] - part[:, 1]) * part[:, 2]
+        node[active] = np.where(cross > 0, bsp.CHILDREN[n, FRONT], bsp.CHILDREN[n, BACK])
+        steps[active] += 1
+        active = (node & NF_SUBSECTOR) == 0
+    return steps
+
+def bsp_report(bsp, num_segs, num_sides, bounds, samples=64):
+    # depth, splits and average traversal cost over a samples x samples grid
+    # of points across the map. splits is how many more segs there are than
+    # sidedefs in use, which works the same for shipped and rebuilt nodes
+    x_min, x_max, y_min, y_max = bounds
+    xs, ys = np.meshgrid(np.linspace(x_min, x_max, samples), np.linspace(y_min, y_max, samples))
+    cost = traversal_cost(bsp, xs.ravel(), ys.ravel())
+    return {
+        'nodes': len(bsp), 'segs': num_segs, 'depth': bsp.depth(), 'splits': num_segs - num_sides,
+        'avg_cost': float(cost.mean()), 'max_cost': int(cost.max()) if len(cost) else 0
+    }
+
+def compare(map, split_weight=SPLIT_WEIGHT, candidates=CANDIDATES):
+    # (shipped, rebuilt) reports for a loaded map, the map itself is untouched
+    vertexes, linedefs = map.VERTEXES.array, map.LINEDEFS.array
+    sides = len(initial_segs(vertexes, linedefs))
+    bounds = map.get_map_bounds()
+    shipped = bsp_report(map.BSP, len(map.SEGS), sides, bounds)
+    _, segs, _, nodes = build_nodes(vertexes, linedefs, map.SIDEDEFS.array, split_weight, candidates)
+    rebuilt = bsp_report(flat_bsp(nodes), len(segs), sides, bounds)
+    return shipped, rebuilt
+
+if __name__ == '__main__':
+    import time
+    import argparse
+    from wadfile import WADFile
+    parser = argparse.ArgumentParser(description='rebuild BSP nodes and compare them to the shipped ones')
+    parser.add_argument('wad')
+    parser.add_argument('maps', nargs='*', help='default is every map in the WAD')
+    parser.add_argument('--split-weight', type=float, default=SPLIT_WEIGHT, help='cost of a split against a seg of imbalance')
+    parser.add_argument('--candidates', type=int, default=CANDIDATES, help='partition lines scored per node')
+    args = parser.parse_args()
+    with WADFile(args.wad) as wad:
+        print(f'{"":<8}{"":<9}{"nodes":>7}{"segs":>7}{"depth":>7}{"splits":>8}{"avg cost":>10}{"max cost":>10}')
+        for name in args.maps or wad.map_markers():
+            m = wad.load_map(name)
+            start = time.perf_counter()
+            shipped, rebuilt = compare(m, args.split_weight, args.candidates)
+            took = time.perf_counter() - start
+            for label, r in (('shipped', shipped), ('rebuilt', rebuilt)):
+                print(f'{name:<8}{label:<9}{r["nodes"]:>7}{r["segs"]:>7}{r["depth"]:>7}{r["splits"]:>8}{r["avg_cost"]:>10.2f}{r["max_cost"]:>10}')
+            print(f'{"":<8}built in {took * 1000:.0f} ms')
@@ -1,5 +1,11 @@
 from pygame.math import Vector2 as vec2
 import math
+from helper_routines import deg_to_bam, fine_sine, fine_cosine
+
+# per tic movement, in map units and degrees
+WALK_SPEED = 8
+RUN_SPEED = 16
+TURN_SPEED = 5
 
 class player:
     __slots__ = [ 'POS', 'ANGLE' ]
@@ -12,4 +18,16 @@ class player:
     def __str__(self):
         return f"""
     POSITION: {self.POS}
-    ANGLE: {self.ANGLE}"""
\ No newline at end of file
+    ANGLE: {self.ANGLE}"""
+
+    def think(self, forward, side, turn):
+        # one tic of movement. forward and side are map units (side is to the
+        # right), turn is degrees counter-clockwise. no clipping against the
+        # map, this is a viewer. returns True when the player moved at all
+        if not (forward or side or turn):
+            return False
+        self.ANGLE = (self.ANGLE + turn) % 360
+        bam = deg_to_bam(self.ANGLE)
+        cos_a, sin_a = fine_cosine(bam), fine_sine(bam)
+        self.POS = vec2(self.POS.x + forward * cos_a + side * sin_a, self.POS.y + forward * sin_a - side * cos_a)
+        return True
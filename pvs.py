@@ -0,0 +1,229 @@
+import os
+import json
+import zlib
+import struct
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from datatypes import FRONT, pvs_table, _clip_polygon
+from map_cache import map_key
+
+# offline potentially visible sets. every subsector gets a spread of sample
+# points (its corners and points along its edges pulled in a little, and its
+# centre) and subsector b is potentially visible from a when any sight line
+# between their samples gets past every one-sided linedef. two-sided lines
+# never block since doors and lifts move. sector pairs REJECT rules out are
+# never tested.
+#
+#   pvs = bake_pvs(map, workers=4)
+#   write_pvs(pvs_path(wad, 'E1M1'), map_key(wad, 'E1M1'), pvs)
+#   pvs = load_pvs(wad, 'E1M1')         None when there's no sidecar or it's stale
+#
+# sampling makes this a close estimate rather than a proof, a gap narrower
+# than the sample spacing can be missed. the result is a sidecar file next to
+# the WAD holding the packed bit rows zlib compressed, keyed on the same lump
+# hash the map cache uses
+
+PVS_VERSION = 1
+MAGIC = b'WMPVS\0\0\0'
+PREFIX = struct.Struct('<8sI')
+# how far samples are pulled in from the subsector edges, so sight lines don't
+# start on the walls they're meant to be stopped by
+INSET = 2.0
+# the furthest apart two samples along a subsector edge can be
+SPACING = 64
+# (rays x walls) cells worked on at once
+CHUNK = 1 << 20
+
+def subsector_samples(map):
+    # (points, offsets), the samples of subsector s are
+    # points[offsets[s]:offsets[s + 1]]
+    count = len(map.SSECTORS)
+    polys = map.BSP.leaf_polygons(count)
+    verts = map.VERTEXES.array
+    segs = map.SEGS.array
+    xs, ys = verts['x'].astype(np.float64), verts['y'].astype(np.float64)
+    starts, ends = segs['start'], segs['end']
+    ranges = map.GEOMETRY.SSECTOR_RANGES.tolist()
+    points = []
+    offsets = [ 0 ]
+    for ss, (first, end) in enumerate(ranges):
+        lines = [ (xs[a], ys[a], xs[b], ys[b]) for a, b in zip(starts[first:end].tolist(), ends[first:end].tolist()) ]
+        # the region the BSP gives a leaf runs out to the partition lines, the
+        # subsector proper is on the right of all of its segs as well
+        poly = polys[ss]
+        for x1, y1, x2, y2 in lines:
+            if len(poly) < 3:
+                break
+            poly = _clip_polygon(poly, x1, y1, x2 - x1, y2 - y1, FRONT)
+        if len(poly) < 3:
+            poly = [ p for x1, y1, x2, y2 in lines for p in ((x1, y1), (x2, y2)) ]
+        if not poly:
+            offsets.append(len(points))
+            continue
+        corners = np.array(poly, dtype=np.float64)
+        centre = corners.mean(axis=0)
+        # every corner, then points along each edge no more than SPACING apart
+        edge = [ corners ]
+        for p, q in zip(corners, np.roll(corners, -1, axis=0)):
+            steps = int(np.hypot(*(q - p)) // SPACING) + 1
+            if steps > 1:
+                edge.append(p + (q - p) * (np.arange(1, steps) / steps)[:, None])
+        edge = np.concatenate(edge)
+        towards = centre - edge
+        dist = np.hypot(towards[:, 0], towards[:, 1])
+        edge += towards * np.minimum(1.0, INSET / np.where(dist > 0, dist, 1))[:, None]
+        points.extend(edge.tolist())
+        points.append(centre.tolist())
+        offsets.append(len(points))
+    return np.array(points, dtype=np.float64).reshape(-1, 2), np.array(offsets, dtype=np.int64)
+
+def blocking_walls(map):
+    # x1, y1, x2, y2 of every one-sided linedef
+    verts = map.VERTEXES.array
+    lines = map.LINEDEFS.array[~map.GEOMETRY.LINEDEF_TWO_SIDED]
+    xs, ys = verts['x'].astype(np.float64), verts['y'].astype(np.float64)
+    return np.stack([ xs[lines['start']], ys[lines['start']], xs[lines['end']], ys[lines['end']] ], axis=1)
+
+class pvs_baker:
+    # everything the bake needs, read only. one is pickled to each pool worker
+    # when it starts, the tasks themselves are just lists of subsectors
+    __slots__ = [ 'POINTS', 'OFFSETS', 'OWNERS', 'WALLS', 'SECTORS', 'REJECT' ]
+
+    def __init__(self, map):
+        points, self.OFFSETS = subsector_samples(map)
+        self.POINTS = points.astype(np.float32)
+        self.OWNERS = np.repeat(np.arange(len(self.OFFSETS) - 1), np.diff(self.OFFSETS))
+        self.WALLS = blocking_walls(map).astype(np.float32)
+        self.SECTORS = np.asarray(map.SSECTOR_SECTORS, dtype=np.int64)
+        self.REJECT = map.REJECT
+
+    def clear_sight(self, x, y, targets):
+        # bool per target point, True when the segment to it crosses no wall.
+        # only a proper crossing blocks, touching a wall end doesn't, so sight
+        # lines that graze a corner get through. signs are all that matter so
+        # float32 is plenty for map coordinates
+        wx1, wy1, wx2, wy2 = self.WALLS.T
+        ex, ey = wx2 - wx1, wy2 - wy1
+        near = ex * (y - wy1) - ey * (x - wx1)
+        # walls the source is on the line of can't block anything
+        wx1, wy1, wx2, wy2, ex, ey, near = [ v[near != 0] for v in (wx1, wy1, wx2, wy2, ex, ey, near) ]
+        near_side = np.signbit(near)
+        blocked = np.zeros(len(targets), dtype=bool)
+        step = max(1, CHUNK // max(len(wx1), 1))
+        for lo in range(0, len(targets), step):
+            tx = targets[lo:lo + step, 0:1]
+            ty = targets[lo:lo + step, 1:2]
+            far = ex * (ty - wy1) - ey * (tx - wx1)
+            crossed = (np.signbit(far) != near_side) & (far != 0)
+            rx, ry = tx - x, ty - y
+            a = rx * (wy1 - y) - ry * (wx1 - x)
+            b = rx * (wy2 - y) - ry * (wx2 - x)
+            crossed &= (np.signbit(a) != np.signbit(b)) & (a != 0) & (b != 0)
+            blocked[lo:lo + step] = crossed.any(axis=1)
+        return ~blocked
+
+    def rows(self, subsectors):
+        # (subsectors, rows) with a packed PVS row for each one asked for. sight
+        # lines work both ways so only higher numbered subsectors are tested,
+        # bake_pvs fills in the rest from the transpose
+        count = len(self.OFFSETS) - 1
+        rows = np.zeros((len(subsectors), count), dtype=bool)
+        sectors = self.SECTORS
+        for i, ss in enumerate(subsectors):
+            row = rows[i]
+            row[ss] = True
+            # REJECT is already a conservative sector to sector answer
+            if len(sectors) == count and 0 <= sectors[ss] < self.REJECT.NUM_SECTORS:
+                candidates = self.REJECT.visible_from(sectors[ss])[np.clip(sectors, 0, None)] | (sectors < 0)
+            else:
+                candidates = np.ones(count, dtype=bool)
+            for x, y in self.POINTS[self.OFFSETS[ss]:self.OFFSETS[ss + 1]].tolist():
+                # only points in subsectors that haven't been seen yet
+                pending = np.flatnonzero(candidates[self.OWNERS] & ~row[self.OWNERS] & (self.OWNERS > ss))
+                if len(pending) == 0:
+                    break
+                row[self.OWNERS[pending[self.clear_sight(x, y, self.POINTS[pending])]]] = True
+        return list(subsectors), np.packbits(rows, axis=1)
+
+# one baker per pool worker, set up when the worker starts
+_worker_baker = None
+
+def _start_worker(baker):
+    global _worker_baker
+    _worker_baker = baker
+
+def _bake_worker_rows(subsectors):
+    return _worker_baker.rows(subsectors)
+
+def bake_pvs(map, workers=None, shards_per_worker=4):
+    # the PVS of every subsector in map. subsectors are dealt out round robin
+    # so big open areas don't all land on one worker
+    baker = pvs_baker(map)
+    count = len(baker.OFFSETS) - 1
+    rows = np.zeros((count, count), dtype=bool)
+    if workers == 1 or count < 2:
+        results = [ baker.rows(range(count)) ]
+    else:
+        workers = workers or os.cpu_count() or 1
+        shards = min(count, workers * shards_per_worker)
+        with ProcessPoolExecutor(workers, initializer=_start_worker, initargs=(baker,)) as pool:
+            results = list(pool.map(_bake_worker_rows, [ list(range(n, count, shards)) for n in range(shards) ]))
+    for subsectors, packed in results:
+        rows[subsectors] = np.unpackbits(packed, axis=1, count=count).astype(bool)
+    rows |= rows.T
+    return pvs_table(np.packbits(rows, axis=1), count)
+
+def pvs_path(wad, mapname):
+    # the sidecar sits next to the WAD
+    return f'{os.path.splitext(wad.NAME)[0]}-{mapname}.pvs'
+
+def write_pvs(filename, key, pvs):
+    header = json.dumps({ 'key': key, 'version': PVS_VERSION, 'subsectors': pvs.NUM_SUBSECTORS,
+                          'shape': list(pvs.BITS.shape) }).encode('utf-8')
+    tmp = f'{filename}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(PREFIX.pack(MAGIC, len(header)))
+        f.write(header)
+        f.write(zlib.compress(np.ascontiguousarray(pvs.BITS).tobytes(), 9))
+    os.replace(tmp, filename)
+
+def read_pvs(filename, key):
+    # the baked table, or None when the file is missing, stale or broken
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read()
+        magic, header_len = PREFIX.unpack_from(data, 0)
+        if magic != MAGIC:
+            return None
+        header = json.loads(data[PREFIX.size:PREFIX.size + header_len])
+        if header.get('version') != PVS_VERSION or header.get('key') != key:
+            return None
+        bits = np.frombuffer(zlib.decompress(data[PREFIX.size + header_len:]), dtype=np.uint8).reshape(header['shape'])
+        return pvs_table(bits, header['subsectors'])
+    except (OSError, struct.error, ValueError, KeyError, TypeError, zlib.error):
+        return None
+
+def load_pvs(wad, mapname, filename=None):
+    if wad.LUMPS.map_entries(mapname) is None:
+        return None
+    return read_pvs(filename or pvs_path(wad, mapname), map_key(wad, mapname))
+
+if __name__ == '__main__':
+    import time
+    import argparse
+    from wadfile import WADFile
+    parser = argparse.ArgumentParser(description='bake potentially visible sets into sidecar files next to the WAD')
+    parser.add_argument('wad')
+    parser.add_argument('maps', nargs='*', help='default is every map in the WAD')
+    parser.add_argument('--workers', type=int, default=None, help='bake processes, default is one per CPU')
+    args = parser.parse_args()
+    with WADFile(args.wad) as wad:
+        print(f'{"":<8}{"subsectors":>11}{"visible":>9}{"bytes":>9}{"seconds":>9}')
+        for name in args.maps or wad.map_markers():
+            m = wad.load_map(name)
+            start = time.perf_counter()
+            pvs = bake_pvs(m, args.workers)
+            took = time.perf_counter() - start
+            filename = pvs_path(wad, name)
+            write_pvs(filename, map_key(wad, name), pvs)
+            print(f'{name:<8}{pvs.NUM_SUBSECTORS:>11}{pvs.density():>9.1%}{os.path.getsize(filename):>9}{took:>9.2f}')
@@ -5,177 +5,285 @@ from player import player
 import numpy as np
 import math
 from helper_routines import *
+from culling import view_frustum
+from frame_stats import frame_stats
+from wall_renderer import wall_renderer, PALETTE
+from automap import automap_camera, automap_lines
+import time
 import json
 
+LINEDEF_COLOR = pg.Color(128,128,128,128)
+SEG_COLOR = pg.Color(57,255,20,255)
+PLAYER_COLOR = pg.Color('orange')
+BACKGROUND_COLOR = pg.Color('black')
+
+# what render() draws: the top-down map or the first-person view
+MAP_MODE = 'map'
+VIEW_MODE = 'view'
+
 class DoomMapRenderer:
-    def __init__(self, screen, map):
+    def __init__(self, screen, map, pvs=None):
         self.__map__ = map
         self.__screen__ = screen
         self.__player__ = player(map)
         self.x_min, self.x_max, self.y_min, self.y_max = map.get_map_bounds()
-        self.vertexes = [vec2(self.remap_x(v.x), self.remap_y(v.y)) for v in map.VERTEXES]
-
-    def remap_x(self, n, out_min=30, out_max=WIDTH-30):
-        return int((max(self.x_min, min(n, self.x_max)) - self.x_min) * (
-                out_max - out_min) / (self.x_max - self.x_min) + out_min)
-
-    def remap_y(self, n, out_min=30, out_max=HEIGHT-30):
-        return int(HEIGHT - (max(self.y_min, min(n, self.y_max)) - self.y_min) * (
-                out_max - out_min) / (self.y_max - self.y_min) - out_min)
-
-    def __position_on_backside_of_node(self, node, pos):
-        if node.TYPE != 0:
-            raise Exception("SSECTOR handed to __position_on_backside_of_node!")
-        px = pos.x
-        py = pos.y
-        d = node.DATA
-        nx = d.SPLITTER_START.x
-        ny = d.SPLITTER_START.y
-        n = vec2(px - nx, py - ny)
-        return (n.x * d.SPLITTER_DIFF.y - n.y * d.SPLITTER_DIFF.x) <= 0
-
-    def __bbox_in_fov(self, box, player):
-        # setup fast-access data bits...
-        px, py = player.POS
-        facing = player.ANGLE
-        left, top, right, bottom = box[0].x, box[0].y, box[1].x, box[1].y
-
-        # the following are just to stop issues with getting wrapping of values wrong
-        # when building lists to check visibility
-        a, b = vec2(left, bottom), vec2(left, top)
-        c, d = vec2(right, top), vec2(right, bottom)
-        sides = ()
-        # get the right sets of things to check based on player position
-        if px < left:
-            if py > top:
-                sides = (b, a), (c, b)
-            elif py < bottom:
-                sides = (b, a), (a, d)
-            else:
-                sides = (b, a),
-        elif px > right: 
-            if py > top: 
-                sides = (c, b), (d, c)
-            elif py < bottom:
-                sides = (a, d), (d, c)
-            else:
-                sides = (d, c),
-        else:
-            if py > top:
-                sides = (c, b),
-            elif py < bottom:
-                sides = (a, d),
-            else:
+        # where the map sits on screen, starts with all of it in view
+        self.camera = automap_camera(*screen.get_size())
+        self.camera.fit(map.get_map_bounds())
+        self.__lines = automap_lines(map)
+        # seg -> (start, end) vertex coordinates, each subsectors first seg and
+        # seg count, and whether a seg carries straight on into the next one
+        # in the same subsector. none depend on the view so they're built once
+        segs = map.SEGS.array
+        verts = map.VERTEXES.array
+        self.__seg_ends = np.stack([ np.stack([ verts['x'][segs['start']], verts['y'][segs['start']] ], axis=-1),
+                                     np.stack([ verts['x'][segs['end']], verts['y'][segs['end']] ], axis=-1) ], axis=1)
+        ranges = map.GEOMETRY.SSECTOR_RANGES.astype(np.int64)
+        self.__ssector_first = ranges[:, 0]
+        self.__ssector_counts = ranges[:, 1] - ranges[:, 0]
+        self.__seg_joins = np.zeros(len(segs), dtype=bool)
+        self.__seg_joins[:-1] = segs['end'][:-1] == segs['start'][1:]
+        self.__seg_joins[ranges[self.__ssector_counts > 0, 1] - 1] = False
+        # the linedefs on screen are drawn into their own surface whenever the
+        # camera moves, each frame restores the areas the overlay dirtied last
+        # time from it
+        self.__static_layer = None
+        self.__static_key = None
+        self.__last_overlay = []
+        self.lines_drawn = 0
+        self.__build_view()
+        self.__full_redraw = True
+        # per-frame instrumentation, None means off and costs a handful of
+        # checks per frame
+        self.stats = None
+        # the first-person view and its native resolution surfaces, only set
+        # up the first time VIEW_MODE is used
+        self.mode = MAP_MODE
+        self.__walls = None
+        self.__native = None
+        self.__native_rgb = None
+        # a baked pvs_table, when there is one the walk also skips anything
+        # not in the players subsectors PVS. that only changes when the
+        # player crosses into another subsector so it's kept until then
+        self.pvs = pvs
+        self.__pvs_subsector = None
+        self.__pvs_visible = None
+
+    def set_mode(self, mode):
+        if mode != self.mode:
+            self.mode = mode
+            self.__full_redraw = True
+
+    def toggle_mode(self):
+        self.set_mode(VIEW_MODE if self.mode == MAP_MODE else MAP_MODE)
+
+    def enable_stats(self, history=600):
+        if self.stats is None:
+            self.stats = frame_stats(history, self.__map__.name)
+        return self.stats
+
+    def disable_stats(self):
+        self.stats = None
+        self.invalidate()
+
+    def invalidate(self):
+        # call after anything that moves the map on screen other than the
+        # camera, which is checked every frame
+        self.__static_key = None
+
+    def __view_key(self):
+        return (self.__screen__.get_size(), self.camera.key())
+
+    def __build_view(self):
+        # the static linedef layer: only the linedefs the blockmap says can be
+        # in the viewport are transformed, in one go, and drawn
+        screen = self.__screen__
+        self.camera.resize(*screen.get_size())
+        lines = self.__lines.in_view(self.camera)
+        ends = self.__lines.screen_lines(self.camera, lines).tolist()
+        layer = pg.Surface(screen.get_size()).convert(screen)
+        layer.fill(BACKGROUND_COLOR)
+        for start, end in ends:
+            pg.draw.line(layer, LINEDEF_COLOR, start, end, 2)
+        self.__static_layer = layer
+        self.__static_key = self.__view_key()
+        self.lines_drawn = len(ends)
+
+    def __walk_tree(self, bsp, player_object, screen_full=None):
+        # yields subsectors front to back, near side first and the far side only
+        # when its bbox is in the players FOV. screen_full lets whoever is
+        # consuming the walk stop it once every column has been covered
+        stats = self.stats
+        if stats is not None:
+            # the walk is timed in its own steps, whatever the consumer does
+            # between subsectors is left out
+            clock = time.perf_counter
+            began = clock()
+        # every child box is tested against the view frustum in one batch up front
+        frustum = view_frustum(player_object.POS.x, player_object.POS.y, player_object.ANGLE)
+        visible = frustum.bsp_visibility(bsp)
+        if self.pvs is not None:
+            visible &= self.__pvs_visibility(bsp, player_object.POS.x, player_object.POS.y)
+        visible = visible.tolist()
+        if stats is None:
+            yield from bsp.front_to_back(player_object.POS.x, player_object.POS.y, lambda node, side: visible[node][side], screen_full)
+            return
+        counts = stats.current
+        def visit(node):
+            counts['nodes_visited'] += 1
+        def in_fov(node, side):
+            counts['bboxes_tested'] += 1
+            if visible[node][side]:
                 return True
+            counts['bboxes_culled'] += 1
+            return False
+        for ssector in bsp.front_to_back(player_object.POS.x, player_object.POS.y, in_fov, screen_full, visit):
+            counts['walk_ms'] += (clock() - began) * 1000
+            yield ssector
+            began = clock()
+        counts['walk_ms'] += (clock() - began) * 1000
+
+    def __pvs_visibility(self, bsp, x, y):
+        ssector = bsp.locate(x, y)
+        if ssector != self.__pvs_subsector:
+            self.__pvs_subsector = ssector
+            self.__pvs_visible = self.pvs.bsp_visibility(bsp, ssector)
+        return self.__pvs_visible
+
+    @staticmethod
+    def __ranks(counts):
+        # 0, 1, .. counts[i] - 1 for every i, back to back
+        ends = np.cumsum(counts)
+        return np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - counts, counts)
 
-        # quick math shite for checking if we've got visibility
-        for vect1, vect2 in sides:
-            a1 = self.__point_at(vect1)   # get a viewing angle from the player to the first vertex
-            a2 = self.__point_at(vect2)   # get a viewing angle from the player to the second vertex
-
-            sp = (a1 - a2) % 360          # normalize the difference in the resulting angles
-
-            a1 -= player.ANGLE            # subtract the players facing angle from the angle pointing towards
-                                          # the first vertex from the player, this should normalize a chunk...
-            check_v = (a1 + H_FOV) % 360  # add half the FOV back in, mod-360 to hold it to a valid range
-            if check_v > FOV:             # we might be outside the players FOV
-                if check_v > sp + FOV:    # if true we're definitely outside the players FOV for this pair, lets check the next...
-                    continue
-            return True                   # we're in the players FOV
-        
-        return False                      # definitively, no chance, for the player to see this
-
-    def __point_at(self, vertex):
-        delta = vertex - self.__player__.POS
-        return math.degrees(math.atan2(delta.y, delta.x))
-
-    def __walk_tree(self, current_node, player_object):
-        ssectors = { 'RIGHT': [], 'LEFT': [] }
-        if current_node.TYPE == 1:
-            raise Exception('SSECTOR passed to __walk_tree')
-        if self.__position_on_backside_of_node(current_node, player_object.POS):
-            if current_node.LEFT.TYPE == 0:
-                wres = self.__walk_tree(current_node.LEFT, player_object)
-                for side, values in wres.items():
-                    for v in values:
-                        ssectors[side].append(v)
-                if self.__bbox_in_fov(current_node.DATA.RIGHT_BBOX, player_object):
-                    if current_node.RIGHT.TYPE == 0:
-                        for side, values in self.__walk_tree(current_node.RIGHT, player_object).items():
-                            if len(values) <= 0:
-                                continue
-                            for v in values:
-                                ssectors[side].append(v)
-                    else:
-                        ssectors['RIGHT'].append(current_node.RIGHT.DATA)
-            else:
-                ssectors['LEFT'].append(current_node.LEFT.DATA)
-        else:
-            if current_node.RIGHT.TYPE == 0:
-                wres = self.__walk_tree(current_node.RIGHT, player_object)
-                for side, values in wres.items():
-                    for v in values:
-                        ssectors[side].append(v)
-                if self.__bbox_in_fov(current_node.DATA.LEFT_BBOX, player_object):
-                    if current_node.LEFT.TYPE == 0:
-                        for side, values in self.__walk_tree(current_node.LEFT, player_object).items():
-                            if len(values) <= 0:
-                                continue
-                            for v in values:
-                                ssectors[side].append(v)
-            else:
-                ssectors['RIGHT'].append(current_node.RIGHT.DATA)
-        return ssectors
-    
     def __build_draw_list(self):
         # walk the BSP tree, using the players position and view angle to determine if a given nodes bounding box is within the players FOV.
-        # if it is, traverse down it to get the sub-sectors and add them to a drawing list
-        ssectors = self.__walk_tree(self.__map__.NODES.ROOT, self.__player__)
-        seg_list = []
-        for ssc in ssectors['LEFT']:
-            subsect = self.__map__.SSECTORS[ssc]
-            for c in range(0,subsect[0]):
-                seg_list.append(self.__map__.SEGS[c+subsect[1]])
-            # draw left-side subsectors
-        for ssc in ssectors['RIGHT']:
-            subsect = self.__map__.SSECTORS[ssc]
-            for c in range(0,subsect[0]):
-                seg_list.append(self.__map__.SEGS[c+subsect[1]])
-            # draw right-side subsectors
-        draw_list = []
-        for seg in seg_list:
-            sv = self.__map__.VERTEXES[seg[0]]
-            ev = self.__map__.VERTEXES[seg[1]]
-            msv = vec2(self.remap_x(sv.x), self.remap_y(sv.y))
-            mev = vec2(self.remap_x(ev.x), self.remap_y(ev.y))
-            draw_list.append({'START': msv, 'END': mev})
-        return draw_list
+        # if it is, the subsectors segs go on the draw list, gathered in one go
+        stats = self.stats
+        ssectors = np.fromiter(self.__walk_tree(self.__map__.BSP, self.__player__), dtype=np.int64)
+        counts = self.__ssector_counts[ssectors]
+        if stats is not None:
+            stats.add('subsectors', len(ssectors))
+        return np.repeat(self.__ssector_first[ssectors], counts) + self.__ranks(counts)
     
     def __render_bsp_path_to_player(self):
-        cnode = self.__map__.NODES.ROOT
-        #self.__walk_or_render_subsectors(cnode)
-        segs_to_draw = self.__build_draw_list()
-        for seg in segs_to_draw:
-            pg.draw.line(self.__screen__, pg.Color(57,255,20,255), seg['START'], seg['END'] )
+        segs = self.__build_draw_list()
+        if len(segs) == 0:
+            return []
+        screen = self.__screen__
+        draw_lines = pg.draw.lines
+        stats = self.stats
+        if stats is not None:
+            began = time.perf_counter()
+        # every seg on the draw list to screen space at once
+        ends = self.__seg_ends[segs]
+        points = self.camera.to_screen(ends[..., 0], ends[..., 1])
+        # segs that carry on from the one before are drawn as one polyline: a
+        # chains points are the start of each of its segs and the end of the
+        # last, laid out back to back in one array
+        joined = self.__seg_joins[segs[:-1]]
+        last = np.append(np.flatnonzero(~joined), len(segs) - 1)
+        chain = np.arange(len(last))
+        vertices = np.empty((len(segs) + len(last), 2), dtype=np.int32)
+        vertices[np.arange(len(segs)) + np.repeat(chain, np.diff(last, prepend=-1))] = points[:, 0]
+        vertices[last + chain + 1] = points[last, 1]
+        bounds = np.concatenate([ [ 0 ], last + chain + 2 ]).tolist()
+        vertices = vertices.tolist()
+        for n in range(len(last)):
+            draw_lines(screen, SEG_COLOR, False, vertices[bounds[n]:bounds[n + 1]])
+        if stats is not None:
+            stats.add('draw_ms', (time.perf_counter() - began) * 1000)
+            stats.add('segs', len(segs))
+            stats.add('draw_calls', len(last))
+        # one dirty rect for the lot, clipped to the screen
+        x1, y1 = points.reshape(-1, 2).min(axis=0).tolist()
+        x2, y2 = points.reshape(-1, 2).max(axis=0).tolist()
+        rect = pg.Rect(x1, y1, x2 - x1 + 1, y2 - y1 + 1).clip(screen.get_rect())
+        return [ rect ] if rect.width and rect.height else []
 
     def render(self):
-        for line in self.__map__.LINEDEFS:
-            lstart = self.vertexes[line[0]]
-            lend = self.vertexes[line[1]]
-            pg.draw.line(self.__screen__, pg.Color(128,128,128,128), lstart, lend, 2)
+        # the renderer owns the whole screen, there's no need to clear it first.
+        # returns the rects that changed for pg.display.update()
+        screen = self.__screen__
+        stats = self.stats
+        if stats is not None:
+            stats.begin_frame(self.__player__.POS.x, self.__player__.POS.y, self.__player__.ANGLE)
+        if self.mode == VIEW_MODE:
+            return self.__render_view()
+        self.camera.track(self.__player__.POS.x, self.__player__.POS.y, self.__player__.ANGLE)
+        if self.__static_key != self.__view_key():
+            self.__build_view()
+            self.__full_redraw = True
+        if self.__full_redraw:
+            self.__full_redraw = False
+            screen.blit(self.__static_layer, (0, 0))
+            dirty = [ screen.get_rect() ]
+        else:
+            # put back whatever the last overlay drew over
+            for rect in self.__last_overlay:
+                screen.blit(self.__static_layer, rect, rect)
+            dirty = list(self.__last_overlay)
+        overlay = self.__render_overlay()
+        if stats is not None:
+            # the blits putting the static layer back plus the player and FOV lines
+            stats.add('draw_calls', len(dirty) + 3)
+            stats.end_frame()
+            if stats.overlay:
+                rect = stats.draw_overlay(screen)
+                if rect is not None:
+                    overlay.append(rect)
+        self.__last_overlay = overlay
+        return dirty + overlay
+
+    def __render_view(self):
+        # the walls go into a DOOM_RES framebuffer, which is converted and
+        # scaled up to the window in one go so the cost doesn't depend on the
+        # window size
+        screen = self.__screen__
+        stats = self.stats
+        if self.__walls is None:
+            self.__walls = wall_renderer(self.__map__)
+            self.__native = pg.Surface(DOOM_RES, 0, 8)
+            self.__native.set_palette(PALETTE)
+            self.__native_rgb = pg.Surface(DOOM_RES).convert(screen)
+        walls = self.__walls
+        player = self.__player__
+        if stats is not None:
+            began = time.perf_counter()
+        walk = self.__walk_tree(self.__map__.BSP, player, walls.screen_full)
+        framebuffer = walls.render(walk, player.POS.x, player.POS.y, player.ANGLE)
+        pg.surfarray.blit_array(self.__native, framebuffer)
+        self.__native_rgb.blit(self.__native, (0, 0))
+        pg.transform.scale(self.__native_rgb, screen.get_size(), screen)
+        dirty = [ screen.get_rect() ]
+        if stats is not None:
+            # the walk runs inside walls.render, its own steps were timed as
+            # it went and the rest is drawing
+            stats.add('draw_ms', (time.perf_counter() - began) * 1000 - stats.current['walk_ms'])
+            stats.add('subsectors', walls.subsectors)
+            stats.add('segs', walls.segs)
+            # the column fills plus the conversion and the scale
+            stats.add('draw_calls', walls.fills + 2)
+            stats.end_frame()
+            if stats.overlay:
+                stats.draw_overlay(screen)
+        return dirty
+
+    def __render_overlay(self):
         # Carmack has the Doom engine using 90 where the math would use 0...
-        player_x = self.remap_x(self.__player__.POS.x)
-        player_y = self.remap_y(self.__player__.POS.y)
+        camera = self.camera
+        player_x, player_y = camera.to_screen_point(self.__player__.POS.x, self.__player__.POS.y)
         facing_angle_corrected = -self.__player__.ANGLE + 90
-        # instead of using the deg_to_rad from helper_routines, use the Python standard library version
-        # for some reason the deg_to_rad() results in the inverse result...
-        side_1_s = math.sin(math.radians(facing_angle_corrected - H_FOV))
-        side_1_c = math.cos(math.radians(facing_angle_corrected - H_FOV))
-        side_2_s = math.sin(math.radians(facing_angle_corrected + H_FOV))
-        side_2_c = math.cos(math.radians(facing_angle_corrected + H_FOV))
-        fov_ex_1, fov_ey_1 = self.remap_x(self.__player__.POS.x + HEIGHT * side_1_s), self.remap_y(self.__player__.POS.y + HEIGHT * side_1_c)
-        fov_ex_2, fov_ey_2 = self.remap_x(self.__player__.POS.x + HEIGHT * side_2_s), self.remap_y(self.__player__.POS.y + HEIGHT * side_2_c)
-        pg.draw.line(self.__screen__, pg.Color('orange'), (player_x, player_y), (fov_ex_1, fov_ey_1), 2)
-        pg.draw.line(self.__screen__, pg.Color('orange'), (player_x, player_y), (fov_ex_2, fov_ey_2), 2)
-        pg.draw.circle(self.__screen__, pg.Color('orange'), (player_x, player_y), 2)
-        self.__render_bsp_path_to_player()
+        # both cone edges as BAMs, then table lookups instead of sin/cos calls
+        side_1 = deg_to_bam(facing_angle_corrected - H_FOV)
+        side_2 = deg_to_bam(facing_angle_corrected + H_FOV)
+        side_1_s, side_1_c = fine_sine(side_1), fine_cosine(side_1)
+        side_2_s, side_2_c = fine_sine(side_2), fine_cosine(side_2)
+        fov_ex_1, fov_ey_1 = camera.to_screen_point(self.__player__.POS.x + HEIGHT * side_1_s, self.__player__.POS.y + HEIGHT * side_1_c)
+        fov_ex_2, fov_ey_2 = camera.to_screen_point(self.__player__.POS.x + HEIGHT * side_2_s, self.__player__.POS.y + HEIGHT * side_2_c)
+        overlay = [
+            pg.draw.line(self.__screen__, PLAYER_COLOR, (player_x, player_y), (fov_ex_1, fov_ey_1), 2),
+            pg.draw.line(self.__screen__, PLAYER_COLOR, (player_x, player_y), (fov_ex_2, fov_ey_2), 2),
+            pg.draw.circle(self.__screen__, PLAYER_COLOR, (player_x, player_y), 2)
+        ]
+        return overlay + self.__render_bsp_path_to_player()
@@ -0,0 +1,244 @@
+import struct
+import random
+import math
+
+# builds synthetic PWADs out of a grid of rectangular rooms so the loader, BSP
+# and renderer can be exercised (and benchmarked) without the commercial IWAD.
+# every grid cell is its own sector and its own subsector, the NODES lump is
+# a set of axis-aligned splits along grid lines so the tree is always valid.
+
+LINE_BLOCKING = 0x0001
+LINE_TWOSIDED = 0x0004
+
+def _bam16(dx, dy):
+    return int(round(math.degrees(math.atan2(dy, dx)) * 65536 / 360)) & 0xFFFF
+
+def _name(s):
+    return s.encode('ascii')[:8].ljust(8, b'\0')
+
+def _signed(v):
+    return v - 0x10000 if v >= 0x8000 else v
+
+class synthetic_map:
+    # cols x rows rooms of cell x cell units. wall_chance is the odds of a
+    # shared edge being a solid wall instead of a two-sided line, detail splits
+    # every edge into that many linedefs (more vertexes and lines for the same
+    # tree) and balanced=False splits one row/column off at a time so the node
+    # tree gets as deep as the grid is wide
+    __slots__ = [ 'name', 'cols', 'rows', 'cell', 'detail', 'THINGS', 'LINEDEFS', 'SIDEDEFS', 'VERTEXES', 'SEGS',
+                  'SSECTORS', 'NODES', 'SECTORS', 'REJECT', 'BLOCKMAP', '__vertex_ids' ]
+
+    def __init__(self, name, cols=8, rows=8, cell=256, wall_chance=0.2, balanced=True, detail=1, seed=0):
+        if cols * cell > 32767 or rows * cell > 32767:
+            raise ValueError(f'{cols}x{rows} rooms of {cell} units is too big for 16 bit map coordinates')
+        self.name = name
+        self.cols = cols
+        self.rows = rows
+        self.cell = cell
+        self.detail = max(1, min(detail, cell))
+        rng = random.Random(seed)
+        self.__build_geometry(rng, wall_chance)
+        self.NODES = []
+        self.__split(0, cols, 0, rows, balanced)
+        self.REJECT = bytes((cols * rows * cols * rows + 7) // 8)
+        self.BLOCKMAP = self.__build_blockmap()
+
+    def __vertex(self, x, y):
+        v = self.__vertex_ids.get((x, y))
+        if v is None:
+            v = self.__vertex_ids[(x, y)] = len(self.VERTEXES)
+            self.VERTEXES.append((x, y))
+        return v
+
+    def __edge(self, x1, y1, x2, y2):
+        # the vertexes along an edge, split into detail pieces
+        k = self.detail
+        return [ self.__vertex(x1 + (x2 - x1) * n // k, y1 + (y2 - y1) * n // k) for n in range(k + 1) ]
+
+    def __cell(self, i, j):
+        return j * self.cols + i
+
+    def __build_geometry(self, rng, wall_chance):
+        cols, rows, cell = self.cols, self.rows, self.cell
+        self.VERTEXES = []
+        self.__vertex_ids = {}
+        for j in range(rows + 1):
+            for i in range(cols + 1):
+                self.__vertex(i * cell, j * cell)
+        self.SECTORS = []
+        for j in range(rows):
+            for i in range(cols):
+                floor = 8 * ((i * 7 + j * 3) % 4)
+                ceiling = 128 + 16 * ((i + j) % 3)
+                self.SECTORS.append((floor, ceiling, 'FLOOR4_8', 'CEIL3_5', 160 + 16 * ((i + j) % 4), 0, 0))
+        self.LINEDEFS = []
+        self.SIDEDEFS = []
+        # per cell, the (linedef, direction, start, end) of each side facing into it
+        sides = [ [] for _ in range(cols * rows) ]
+
+        def one_sided(points, c):
+            for v1, v2 in zip(points, points[1:]):
+                self.SIDEDEFS.append((0, 0, '-', '-', 'STARTAN3', c))
+                self.LINEDEFS.append((v1, v2, LINE_BLOCKING, 0, 0, len(self.SIDEDEFS) - 1, -1))
+                sides[c].append((len(self.LINEDEFS) - 1, 0, v1, v2))
+
+        def two_sided(points, front, back):
+            for v1, v2 in zip(points, points[1:]):
+                self.SIDEDEFS.append((0, 0, 'STARTAN3', 'STARTAN3', '-', front))
+                self.SIDEDEFS.append((0, 0, 'STARTAN3', 'STARTAN3', '-', back))
+                self.LINEDEFS.append((v1, v2, LINE_TWOSIDED, 0, 0, len(self.SIDEDEFS) - 2, len(self.SIDEDEFS) - 1))
+                sides[front].append((len(self.LINEDEFS) - 1, 0, v1, v2))
+                sides[back].append((len(self.LINEDEFS) - 1, 1, v2, v1))
+
+        # vertical edges run bottom to top, the right hand side is +x
+        for j in range(rows):
+            for i in range(cols + 1):
+                up = self.__edge(i * cell, j * cell, i * cell, (j + 1) * cell)
+                down = up[::-1]
+                if i == 0:
+                    one_sided(up, self.__cell(0, j))
+                elif i == cols:
+                    one_sided(down, self.__cell(i - 1, j))
+                elif rng.random() < wall_chance:
+                    one_sided(up, self.__cell(i, j))
+                    one_sided(down, self.__cell(i - 1, j))
+                else:
+                    two_sided(up, self.__cell(i, j), self.__cell(i - 1, j))
+        # horizontal edges run left to right, the right hand side is -y
+        for j in range(rows + 1):
+            for i in range(cols):
+                across = self.__edge(i * cell, j * cell, (i + 1) * cell, j * cell)
+                back = across[::-1]
+                if j == 0:
+                    one_sided(back, self.__cell(i, 0))
+                elif j == rows:
+                    one_sided(across, self.__cell(i, j - 1))
+                elif rng.random() < wall_chance:
+                    one_sided(across, self.__cell(i, j - 1))
+                    one_sided(back, self.__cell(i, j))
+                else:
+                    two_sided(across, self.__cell(i, j - 1), self.__cell(i, j))
+
+        self.SEGS = []
+        self.SSECTORS = []
+        for c in range(cols * rows):
+            self.SSECTORS.append((len(sides[c]), len(self.SEGS)))
+            for ld, direction, v1, v2 in sides[c]:
+                (x1, y1), (x2, y2) = self.VERTEXES[v1], self.VERTEXES[v2]
+                self.SEGS.append((v1, v2, _signed(_bam16(x2 - x1, y2 - y1)), ld, direction, 0))
+
+        self.THINGS = [ (cell // 2, cell // 2, 90, 1, 7) ]
+        for c in range(1, cols * rows, 3):
+            i, j = c % cols, c // cols
+            self.THINGS.append((i * cell + cell // 2, j * cell + cell // 2, 0, 2014, 7))
+
+    def __box(self, i0, i1, j0, j1):
+        # top, bottom, left, right
+        c = self.cell
+        return (j1 * c, j0 * c, i0 * c, i1 * c)
+
+    def __split(self, i0, i1, j0, j1, balanced):
+        # returns the child reference for the region, nodes are appended children-first
+        if i1 - i0 == 1 and j1 - j0 == 1:
+            return 0x8000 | self.__cell(i0, j0)
+        c = self.cell
+        if i1 - i0 >= j1 - j0:
+            im = (i0 + i1) // 2 if balanced else i0 + 1
+            right = self.__split(im, i1, j0, j1, balanced)
+            left = self.__split(i0, im, j0, j1, balanced)
+            line = (im * c, j0 * c, 0, (j1 - j0) * c)
+            rbox, lbox = self.__box(im, i1, j0, j1), self.__box(i0, im, j0, j1)
+        else:
+            jm = (j0 + j1) // 2 if balanced else j0 + 1
+            right = self.__split(i0, i1, j0, jm, balanced)
+            left = self.__split(i0, i1, jm, j1, balanced)
+            line = (i0 * c, jm * c, (i1 - i0) * c, 0)
+            rbox, lbox = self.__box(i0, i1, j0, jm), self.__box(i0, i1, jm, j1)
+        self.NODES.append(line + rbox + lbox + (right, left))
+        return len(self.NODES) - 1
+
+    def __build_blockmap(self):
+        x0, y0 = -8, -8
+        width, height = self.cols * self.cell, self.rows * self.cell
+        ncols, nrows = (width - x0) // 128 + 1, (height - y0) // 128 + 1
+        blocks = [ [] for _ in range(ncols * nrows) ]
+        for n, ld in enumerate(self.LINEDEFS):
+            (ax, ay), (bx, by) = self.VERTEXES[ld[0]], self.VERTEXES[ld[1]]
+            # every line is axis aligned so the bbox is exact
+            bx1, bx2 = (min(ax, bx) - x0) // 128, (max(ax, bx) - x0) // 128
+            by1, by2 = (min(ay, by) - y0) // 128, (max(ay, by) - y0) // 128
+            for row in range(by1, by2 + 1):
+                for col in range(bx1, bx2 + 1):
+                    blocks[row * ncols + col].append(n)
+        words = []
+        offsets = []
+        empty = None
+        base = 4 + ncols * nrows
+        for b in blocks:
+            if not b and empty is not None:
+                offsets.append(empty)
+                continue
+            offsets.append(base + len(words))
+            if not b:
+                empty = offsets[-1]
+            words.append(0)
+            words.extend(b)
+            words.append(0xFFFF)
+        if base + len(words) > 0xFFFF:
+            # too big for the vanilla format, ship an empty lump like old node builders did
+            return b''
+        header = struct.pack('<4h', x0, y0, ncols, nrows)
+        return header + struct.pack(f'<{len(offsets)}H', *offsets) + struct.pack(f'<{len(words)}H', *words)
+
+    def lumps(self):
+        yield self.name, b''
+        yield 'THINGS', b''.join(struct.pack('<5h', *t) for t in self.THINGS)
+        yield 'LINEDEFS', b''.join(struct.pack('<7h', *l) for l in self.LINEDEFS)
+        yield 'SIDEDEFS', b''.join(struct.pack('<2h8s8s8sh', s[0], s[1], _name(s[2]), _name(s[3]), _name(s[4]), s[5]) for s in self.SIDEDEFS)
+        yield 'VERTEXES', b''.join(struct.pack('<2h', *v) for v in self.VERTEXES)
+        yield 'SEGS', b''.join(struct.pack('<6h', *s) for s in self.SEGS)
+        yield 'SSECTORS', b''.join(struct.pack('<2h', *s) for s in self.SSECTORS)
+        yield 'NODES', b''.join(struct.pack('<12h2H', *n) for n in self.NODES)
+        yield 'SECTORS', b''.join(struct.pack('<2h8s8s3h', s[0], s[1], _name(s[2]), _name(s[3]), s[4], s[5], s[6]) for s in self.SECTORS)
+        yield 'REJECT', self.REJECT
+        yield 'BLOCKMAP', self.BLOCKMAP
+
+def write_wad(filename, maps, magic='PWAD'):
+    lumps = []
+    for m in maps:
+        lumps.extend(m.lumps())
+    data = bytearray(struct.pack('<4sii', magic.encode('ascii'), len(lumps), 0))
+    directory = []
+    for name, payload in lumps:
+        directory.append((len(data) if payload else 0, len(payload), name))
+        data.extend(payload)
+    struct.pack_into('<i', data, 8, len(data))
+    for offs, size, name in directory:
+        data.extend(struct.pack('<ii8s', offs, size, _name(name)))
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+def map_names(count, doom2=False):
+    if doom2:
+        return [ f'MAP{n:02d}' for n in range(1, count + 1) ]
+    return [ f'E{1 + n // 9}M{1 + n % 9}' for n in range(count) ]
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='write a synthetic PWAD of grid maps')
+    parser.add_argument('output', nargs='?', default='SYNTH.WAD')
+    parser.add_argument('--cols', type=int, default=8)
+    parser.add_argument('--rows', type=int, default=8)
+    parser.add_argument('--cell', type=int, default=256)
+    parser.add_argument('--detail', type=int, default=1, help='linedefs per room edge')
+    parser.add_argument('--walls', type=float, default=0.2, help='chance of a shared edge being solid')
+    parser.add_argument('--unbalanced', action='store_true', help='build a deep, unbalanced node tree')
+    parser.add_argument('--maps', type=int, default=1)
+    parser.add_argument('--doom2', action='store_true', help='MAPxx names instead of ExMy')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    maps = [ synthetic_map(name, args.cols, args.rows, args.cell, args.walls, not args.unbalanced, args.detail, args.seed + n)
+             for n, name in enumerate(map_names(args.maps, args.doom2)) ]
+    write_wad(args.output, maps)
+    m = maps[0]
+    print(f'{args.output}: {len(maps)} maps of {len(m.VERTEXES)} vertexes, {len(m.LINEDEFS)} linedefs, {len(m.SEGS)} segs, {len(m.NODES)} nodes')
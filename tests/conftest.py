@@ -0,0 +1,39 @@
+import os
+import sys
+import pytest
+
+# the renderer tests draw into a screen nobody looks at
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+# the modules sit at the top of the repo rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthwad import synthetic_map, write_wad
+from wadfile import WADFile
+
+@pytest.fixture
+def make_wad(tmp_path):
+    # make_wad(map, ...) writes the synthetic maps to a PWAD and opens it
+    opened = []
+    def make(*maps, name='TEST.WAD'):
+        filename = str(tmp_path / name)
+        write_wad(filename, maps)
+        wad = WADFile(filename)
+        opened.append(wad)
+        return wad
+    yield make
+    for wad in opened:
+        wad.close()
+
+@pytest.fixture
+def grid_map(make_wad):
+    # a small loaded grid map, 4x4 rooms with some solid walls between them
+    return make_wad(synthetic_map('E1M1', 4, 4, 256, wall_chance=0.3, seed=1)).load_map('E1M1')
+
+@pytest.fixture
+def screen():
+    import pygame as pg
+    from constants import WIN_RES
+    pg.init()
+    yield pg.display.set_mode(WIN_RES)
+    pg.quit()
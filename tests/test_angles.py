@@ -0,0 +1,52 @@
+import math
+import numpy as np
+from helper_routines import (ANG90, ANG180, ANGLE_MASK, bam16_to_bam, bam_to_bam16, bams16_to_bams, bams_to_bams16,
+                             deg_to_bam, degs_to_bams, fine_sine, fine_cosine, point_to_angle,
+                             points_to_angles)
+from wadfile import to_radians
+
+def test_bam16_round_trip():
+    lump = np.arange(-32768, 32768, 7, dtype=np.int64)
+    bams = bams16_to_bams(lump)
+    assert bams.tolist() == [ bam16_to_bam(a) for a in lump.tolist() ]
+    assert np.array_equal(bams_to_bams16(bams), lump.astype(np.int16))
+    assert [ bam_to_bam16(b) for b in bams.tolist() ] == (lump & 0xFFFF).tolist()
+
+def test_degrees():
+    degs = np.linspace(-720, 720, 97)
+    assert degs_to_bams(degs).tolist() == [ deg_to_bam(d) for d in degs.tolist() ]
+    assert deg_to_bam(90) == ANG90 and deg_to_bam(-180) == ANG180
+
+def test_points_to_angles():
+    rng = np.random.default_rng(0)
+    dx, dy = rng.integers(-4000, 4000, (2, 2000)).astype(np.float64)
+    bams = points_to_angles(dx, dy)
+    want = (np.arctan2(dy, dx) % (2 * math.pi)) * (ANG180 / math.pi)
+    # one TANTOANGLE step is well under a tenth of a degree
+    err = (bams - want + ANG180) % (ANGLE_MASK + 1) - ANG180
+    assert np.abs(err).max() < deg_to_bam(0.1)
+    assert points_to_angles([ 0 ], [ 0 ]).tolist() == [ 0 ]
+
+def test_scalar_matches_vector():
+    # a grid through the origin takes in both axes and the octant boundaries
+    # |dx| == |dy|, plus a few big and fractional vectors
+    steps = np.arange(-40, 41)
+    dx, dy = [ v.ravel().astype(np.float64) for v in np.meshgrid(steps, steps) ]
+    dx = np.concatenate([ dx, [ 30000, -30000, 0.5, -0.25, 1e-3 ] ])
+    dy = np.concatenate([ dy, [ 29999, 1, 0.5, 0.75, -1e-3 ] ])
+    assert [ point_to_angle(x, y) for x, y in zip(dx.tolist(), dy.tolist()) ] == points_to_angles(dx, dy).tolist()
+    assert point_to_angle(0, 0) == 0
+    assert point_to_angle(5, 0) == 0 and point_to_angle(0, 5) == ANG90
+    assert point_to_angle(-5, 0) == ANG180 and point_to_angle(0, -5) == ANG90 * 3
+    assert point_to_angle(7, 7) == ANG90 // 2 and point_to_angle(-7, -7) == ANG180 + ANG90 // 2
+
+def test_fine_tables():
+    for deg in (0, 30, 45, 90, 135, 200, 359):
+        bam = deg_to_bam(deg)
+        assert abs(fine_sine(bam) - math.sin(math.radians(deg))) < 1e-3
+        assert abs(fine_cosine(bam) - math.cos(math.radians(deg))) < 1e-3
+
+def test_lump_angles(grid_map):
+    segs = grid_map.SEGS.array
+    assert grid_map.GEOMETRY.SEG_ANGLE.tolist() == [ bam16_to_bam(a) for a in segs['angle'].tolist() ]
+    assert abs(to_radians(-16384) - 1.5 * math.pi) < 1e-9
@@ -0,0 +1,61 @@
+import numpy as np
+from automap import automap_camera, automap_lines, MAX_SCALE
+from synthwad import synthetic_map
+
+def test_round_trip():
+    camera = automap_camera(800, 600)
+    camera.fit((0, 1024, 0, 1024))
+    rng = np.random.default_rng(0)
+    for angle in (90, 0, 33.5, 200):
+        camera.rotate = True
+        camera.track(500, 500, angle)
+        for x, y in rng.uniform(-500, 1500, (20, 2)).tolist():
+            sx, sy = camera.to_screen_point(x, y)
+            assert camera.to_screen(x, y).tolist() == [ sx, sy ]
+            wx, wy = camera.to_world(sx, sy)
+            # back to within a pixel of where it started
+            assert abs(wx - x) <= 1 / camera.SCALE and abs(wy - y) <= 1 / camera.SCALE
+    # facing east with rotate on, east is the top of the screen
+    camera.track(500, 500, 0)
+    sx, sy = camera.to_screen_point(camera.CENTER_X + 100, camera.CENTER_Y)
+    assert sx == 400 and sy < 300
+
+def test_fit_and_zoom():
+    camera = automap_camera(800, 600)
+    camera.fit((-100, 900, 0, 500), margin=50)
+    corners = camera.to_screen([ -100, 900 ], [ 0, 500 ]).tolist()
+    # the width decides the scale, the height is centred
+    assert corners == [ [ 50, 475 ], [ 750, 125 ] ]
+    # the point under the mouse stays put
+    before = camera.to_world(123, 456)
+    camera.zoom(2, 123, 456)
+    assert np.allclose(camera.to_world(123, 456), before)
+    for _ in range(40):
+        camera.zoom(2)
+    assert camera.SCALE == MAX_SCALE
+    key = camera.key()
+    camera.pan(10, 0)
+    assert camera.key() != key and not camera.follow
+
+def test_lines_in_view(grid_map, make_wad):
+    lines = automap_lines(grid_map)
+    boxes = grid_map.GEOMETRY.LINEDEF_BBOX
+    rng = np.random.default_rng(3)
+    for _ in range(30):
+        x, y = rng.uniform(-100, 1100, 2)
+        w, h = rng.uniform(1, 600, 2)
+        top, bottom, left, right = y + h, y, x, x + w
+        found = lines.in_box(top, bottom, left, right)
+        brute = np.flatnonzero((boxes[:, 0] >= bottom) & (boxes[:, 1] <= top) & (boxes[:, 2] <= right) & (boxes[:, 3] >= left))
+        assert sorted(found.tolist()) == brute.tolist()
+        assert lines.queried >= len(found)
+    # without a BLOCKMAP lump one gets built from the linedef boxes
+    bare = make_wad(synthetic_map('E1M1', 4, 4, 256, wall_chance=0.3, seed=1), name='BARE.WAD').load_map('E1M1')
+    bare.BLOCKMAP = None
+    built = automap_lines(bare)
+    camera = automap_camera(640, 400)
+    camera.fit(bare.get_map_bounds())
+    camera.zoom(3, 100, 100)
+    assert sorted(built.in_view(camera).tolist()) == sorted(lines.in_view(camera).tolist())
+    ends = built.screen_lines(camera, np.arange(3))
+    assert ends.shape == (3, 2, 2)
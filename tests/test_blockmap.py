@@ -0,0 +1,104 @@
+import struct
+import numpy as np
+from datatypes import block_map, BLOCK_SIZE
+
+def blockmap_lump(origin, columns, rows, lists, marker=True, share_empty=True):
+    # a BLOCKMAP lump for per-block linedef lists, with or without the
+    # leading 0 on each list
+    words = []
+    offsets = []
+    empty = None
+    base = 4 + columns * rows
+    for lines in lists:
+        if not lines and share_empty and empty is not None:
+            offsets.append(empty)
+            continue
+        offsets.append(base + len(words))
+        if not lines:
+            empty = offsets[-1]
+        words.extend(([ 0 ] if marker else []) + list(lines) + [ 0xFFFF ])
+    return struct.pack('<4h', origin[0], origin[1], columns, rows) + struct.pack(f'<{len(offsets) + len(words)}H', *offsets, *words)
+
+def decoded(bm):
+    return [ bm.linedefs_in_block(b % bm.COLUMNS, b // bm.COLUMNS).tolist() for b in range(bm.COLUMNS * bm.ROWS) ]
+
+LISTS = [ [ 0, 3 ], [], [ 1 ], [ 0 ], [], [ 2, 0, 4 ] ]
+
+def test_vanilla_lists():
+    bm = block_map(blockmap_lump((-8, 16), 3, 2, LISTS))
+    assert (bm.ORIGIN_X, bm.ORIGIN_Y, bm.COLUMNS, bm.ROWS) == (-8, 16, 3, 2)
+    assert decoded(bm) == LISTS
+
+def test_lists_without_the_leading_zero():
+    for share_empty in (True, False):
+        bm = block_map(blockmap_lump((0, 0), 3, 2, LISTS, marker=False, share_empty=share_empty))
+        assert decoded(bm) == LISTS
+
+def test_no_marker_and_no_empty_blocks():
+    # every list happens to open with linedef 0 but one doesn't, so the lump
+    # can't be using the marker
+    lists = [ [ 0, 1 ], [ 0 ], [ 2, 0 ], [ 0, 5 ] ]
+    assert decoded(block_map(blockmap_lump((0, 0), 2, 2, lists, marker=False))) == lists
+
+def test_grid_map_lump(grid_map):
+    bm = grid_map.BLOCKMAP
+    assert bm.COLUMNS * bm.ROWS > 0
+    # every linedef shows up in the block under its midpoint
+    lines = grid_map.LINEDEFS.array
+    verts = grid_map.VERTEXES.array
+    mx = (verts['x'][lines['start']].astype(int) + verts['x'][lines['end']]) // 2
+    my = (verts['y'][lines['start']].astype(int) + verts['y'][lines['end']]) // 2
+    for n, (x, y) in enumerate(zip(mx.tolist(), my.tolist())):
+        assert n in bm.linedefs_at(x, y).tolist()
+
+def test_truncated_lump():
+    data = blockmap_lump((0, 0), 3, 2, LISTS)
+    # the offsets table cut off after three blocks, the rest are empty
+    bm = block_map(data[:8 + 3 * 2])
+    assert (bm.COLUMNS, bm.ROWS) == (3, 2)
+    assert all(lines == [] for lines in decoded(bm))
+    # the lists cut off part way, whatever can be read still decodes
+    bm = block_map(data[:-4])
+    assert decoded(bm)[:5] == LISTS[:5]
+    for size in (0, 2, 7):
+        bm = block_map(data[:size])
+        assert (bm.COLUMNS, bm.ROWS, len(bm.LINEDEFS)) == (0, 0, 0)
+        assert bm.linedefs_at(0, 0).tolist() == []
+
+def test_from_boxes_matches_queries():
+    # top, bottom, left, right
+    boxes = np.array([ (100, 0, 0, 0), (0, 0, 0, 300), (260, 130, 130, 260), (-40, -50, -60, -50) ])
+    bm = block_map.from_boxes(boxes)
+    assert bm.ORIGIN_X == -60 and bm.ORIGIN_Y == -50
+    for n, (top, bottom, left, right) in enumerate(boxes.tolist()):
+        for x, y in ((left, bottom), (right, top)):
+            assert n in bm.linedefs_at(x, y).tolist()
+    assert sorted(bm.linedefs_in_box(-100, -100, 400, 400).tolist()) == [ 0, 1, 2, 3 ]
+    assert bm.linedefs_in_box(1000, 1000, 2000, 2000).tolist() == []
+
+def test_blocks_along_segment():
+    bm = block_map.from_tables(0, 0, 8, 8, np.zeros(65, dtype=np.int64), np.zeros(0, dtype=np.int32))
+    rng = np.random.default_rng(4)
+    for x1, y1, x2, y2 in rng.uniform(1, 8 * BLOCK_SIZE - 1, (200, 4)).tolist():
+        blocks = list(bm.blocks_along_segment(x1, y1, x2, y2))
+        assert blocks[0] == bm.block_at(x1, y1)
+        assert blocks[-1] == bm.block_at(x2, y2)
+        # one block over or up at a time, never diagonally or twice
+        for (c1, r1), (c2, r2) in zip(blocks, blocks[1:]):
+            assert abs(c2 - c1) + abs(r2 - r1) == 1
+        assert len(set(blocks)) == len(blocks)
+        # every block a point on the segment lies in is there
+        for t in np.linspace(0, 1, 97).tolist():
+            assert bm.block_at(x1 + (x2 - x1) * t, y1 + (y2 - y1) * t) in blocks
+
+def test_linedefs_along_segment(grid_map):
+    bm = grid_map.BLOCKMAP
+    # across the bottom row of rooms, every vertical line crossed is listed
+    found = bm.linedefs_along_segment(10, 100, 1000, 100).tolist()
+    assert len(found) == len(set(found))
+    lines = grid_map.LINEDEFS.array
+    verts = grid_map.VERTEXES.array
+    x1, x2 = verts['x'][lines['start']], verts['x'][lines['end']]
+    y1, y2 = verts['y'][lines['start']], verts['y'][lines['end']]
+    crossed = np.flatnonzero((x1 == x2) & (x1 > 10) & (x1 < 1000) & (np.minimum(y1, y2) < 100) & (np.maximum(y1, y2) > 100))
+    assert len(crossed) and set(crossed.tolist()) <= set(found)
@@ -0,0 +1,88 @@
+import pickle
+import numpy as np
+import pytest
+from datatypes import NF_SUBSECTOR, FRONT, BACK
+from synthwad import synthetic_map
+
+@pytest.fixture(params=[ True, False ], ids=[ 'balanced', 'unbalanced' ])
+def rooms(request, make_wad):
+    # 6 x 3 rooms, room (i, j) is subsector and sector j * 6 + i
+    return make_wad(synthetic_map('E1M1', 6, 3, 128, balanced=request.param)).load_map('E1M1')
+
+def points(count=300, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(1, 6 * 128 - 1, count), rng.uniform(1, 3 * 128 - 1, count)
+
+def test_locate(rooms):
+    bsp = rooms.BSP
+    xs, ys = points()
+    cells = (ys // 128).astype(np.int64) * 6 + (xs // 128).astype(np.int64)
+    assert [ bsp.locate(x, y) for x, y in zip(xs.tolist(), ys.tolist()) ] == cells.tolist()
+    assert np.array_equal(bsp.locate_many(xs, ys), cells)
+    for x, y in zip(xs[:20].tolist(), ys[:20].tolist()):
+        path = bsp.path_to(x, y)
+        assert path[0][0] == bsp.ROOT
+        assert all(bsp.point_on_side(node, x, y) == side for node, side in path)
+
+def test_front_to_back_order(rooms):
+    bsp = rooms.BSP
+    offsets, leaves = bsp.subtree_leaves()
+    def under(child):
+        if child & NF_SUBSECTOR:
+            return [ child & ~NF_SUBSECTOR ]
+        return leaves[offsets[child]:offsets[child + 1]].tolist()
+    for x, y in zip(*[ v.tolist() for v in points(40, seed=1) ]):
+        order = list(bsp.front_to_back(x, y))
+        assert sorted(order) == list(range(len(rooms.SSECTORS)))
+        assert order[0] == bsp.locate(x, y)
+        position = { ss: n for n, ss in enumerate(order) }
+        # at every node everything on the players side comes first
+        for node in range(len(bsp)):
+            near = bsp.point_on_side(node, x, y)
+            near_leaves = [ position[ss] for ss in under(int(bsp.CHILDREN[node, near])) ]
+            far_leaves = [ position[ss] for ss in under(int(bsp.CHILDREN[node, 1 - near])) ]
+            assert max(near_leaves) < min(far_leaves)
+
+def test_front_to_back_callbacks(rooms):
+    bsp = rooms.BSP
+    x, y = 200, 150
+    # nothing on the far side of anything: only the players own subsector
+    asked = []
+    def never(node, side):
+        asked.append((node, side))
+        return False
+    assert list(bsp.front_to_back(x, y, never)) == [ bsp.locate(x, y) ]
+    assert [ node for node, _ in asked ] == [ node for node, _ in bsp.path_to(x, y) ]
+    assert all(side != bsp.point_on_side(node, x, y) for node, side in asked)
+    # done is checked after each subsector
+    handed = []
+    walk = bsp.front_to_back(x, y, done=lambda: len(handed) == 3)
+    for ss in walk:
+        handed.append(ss)
+    assert len(handed) == 3
+    visited = []
+    list(bsp.front_to_back(x, y, visit=visited.append))
+    assert len(visited) == len(bsp) + len(rooms.SSECTORS)
+
+def test_tree_matches_flat(rooms):
+    bsp = rooms.BSP
+    stack = [ rooms.NODES.ROOT ]
+    seen = 0
+    while stack:
+        node = stack.pop()
+        if node.TYPE == 1:
+            continue
+        seen += 1
+        assert node.RIGHT.ID == bsp.CHILDREN[node.ID, FRONT]
+        assert node.LEFT.ID == bsp.CHILDREN[node.ID, BACK]
+        stack.extend((node.LEFT, node.RIGHT))
+    assert seen == len(bsp)
+
+def test_depth_and_pickle(make_wad):
+    m = make_wad(synthetic_map('E1M1', 40, 1, 64, balanced=False)).load_map('E1M1')
+    bsp = m.BSP
+    assert bsp.depth() == 39
+    assert bsp.locate(40 * 64 - 1, 10) == 39
+    copy = pickle.loads(pickle.dumps(bsp))
+    assert copy.ROOT == bsp.ROOT and np.array_equal(copy.CORNERS, bsp.CORNERS)
+    assert list(copy.front_to_back(100, 10)) == list(bsp.front_to_back(100, 10))
@@ -0,0 +1,46 @@
+import numpy as np
+from culling import view_frustum
+
+def random_boxes(rng, count):
+    # top, bottom, left, right
+    x = rng.uniform(-1000, 1000, (count, 2))
+    y = rng.uniform(-1000, 1000, (count, 2))
+    return np.stack([ y.max(axis=1), y.min(axis=1), x.min(axis=1), x.max(axis=1) ], axis=1)
+
+def test_batch_matches_scalar():
+    rng = np.random.default_rng(0)
+    boxes = random_boxes(rng, 300)
+    for angle in (0, 37, 90, 180, 271.5):
+        frustum = view_frustum(rng.uniform(-200, 200), rng.uniform(-200, 200), angle)
+        batch = frustum.boxes_visible(boxes)
+        assert batch.tolist() == [ frustum.box_visible(*box) for box in boxes.tolist() ]
+
+def test_never_culls_a_visible_box():
+    # any box with a point in the wedge has to survive
+    rng = np.random.default_rng(1)
+    boxes = random_boxes(rng, 200)
+    grid = np.linspace(0, 1, 9)
+    for angle in rng.uniform(0, 360, 8).tolist():
+        frustum = view_frustum(0, 0, angle)
+        visible = frustum.boxes_visible(boxes)
+        for (top, bottom, left, right), kept in zip(boxes.tolist(), visible.tolist()):
+            inside = any(frustum.point_visible(left + (right - left) * u, bottom + (top - bottom) * v) for u in grid for v in grid)
+            assert kept or not inside
+
+def test_wedge():
+    frustum = view_frustum(0, 0, 90)
+    # looking north, 90 degree field of view
+    assert frustum.point_visible(0, 100)
+    assert frustum.point_visible(90, 100) and frustum.point_visible(-90, 100)
+    assert not frustum.point_visible(0, -100)
+    assert not frustum.point_visible(200, 100)
+    assert frustum.box_visible(110, 90, -10, 10)
+    assert not frustum.box_visible(-90, -110, -10, 10)
+    assert not frustum.box_visible(10, -10, 100, 120)
+
+def test_bsp_visibility(grid_map):
+    bsp = grid_map.BSP
+    frustum = view_frustum(300, 300, 45)
+    visible = frustum.bsp_visibility(bsp)
+    assert visible.shape == (len(bsp), 2)
+    assert np.array_equal(visible, frustum.boxes_visible(bsp.BBOXES))
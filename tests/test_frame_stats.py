@@ -0,0 +1,56 @@
+import csv
+import json
+from pygame.math import Vector2 as vec2
+from renderer import DoomMapRenderer, MAP_MODE, VIEW_MODE
+
+VIEWS = [ (128, 128, 45), (600, 300, 180), (900, 900, 270), (300, 700, 10) ]
+
+def render_views(renderer):
+    for x, y, angle in VIEWS:
+        renderer.__player__.POS, renderer.__player__.ANGLE = vec2(x, y), angle
+        renderer.render()
+    return list(renderer.stats.history)
+
+def test_map_mode_counts(grid_map, screen):
+    r = DoomMapRenderer(screen, grid_map)
+    r.enable_stats()
+    for frame in render_views(r):
+        # every far child box is tested once per internal node taken off the
+        # stack, the subsectors are taken off it too without a test
+        assert frame['nodes_visited'] == frame['bboxes_tested'] + frame['subsectors']
+        assert frame['bboxes_culled'] <= frame['bboxes_tested']
+        assert frame['walk_ms'] > 0
+        assert frame['walk_ms'] + frame['draw_ms'] <= frame['frame_ms']
+
+def test_view_mode_times_the_walk(grid_map, screen):
+    r = DoomMapRenderer(screen, grid_map)
+    r.set_mode(VIEW_MODE)
+    r.enable_stats()
+    for frame in render_views(r):
+        # the walk runs inside the wall renderer, its time is split out
+        assert frame['walk_ms'] > 0
+        assert frame['draw_ms'] > 0
+        assert frame['walk_ms'] + frame['draw_ms'] <= frame['frame_ms']
+        assert frame['nodes_visited'] > frame['bboxes_tested']
+
+def test_collection_without_overlay(grid_map, screen, tmp_path):
+    r = DoomMapRenderer(screen, grid_map)
+    stats = r.enable_stats()
+    assert not stats.overlay
+    frames = render_views(r)
+    assert len(frames) == len(VIEWS)
+    stats.export_json(tmp_path / 'stats.json')
+    stats.export_csv(tmp_path / 'stats.csv')
+    with open(tmp_path / 'stats.json') as f:
+        assert len(json.load(f)['frames']) == len(VIEWS)
+    with open(tmp_path / 'stats.csv') as f:
+        rows = list(csv.DictReader(f))
+    assert [ float(row['walk_ms']) for row in rows ] == [ frame['walk_ms'] for frame in frames ]
+
+def test_stats_off(grid_map, screen):
+    r = DoomMapRenderer(screen, grid_map)
+    assert r.mode == MAP_MODE and r.stats is None
+    r.render()
+    r.set_mode(VIEW_MODE)
+    r.render()
+    assert r.stats is None
@@ -0,0 +1,56 @@
+import math
+import pytest
+from game_loop import tic_clock, loop_stats, TIC_SECONDS, MAX_CATCHUP
+
+def test_tics_due():
+    clock = tic_clock(100.0)
+    # tic 0 is due straight away
+    assert clock.run(100.0) == [ 0.0 ]
+    assert clock.run(100.0) == []
+    # halfway through tic 2, tics 1 and 2 run late by 1.5 and 0.5 tics
+    late = clock.run(100.0 + 2.5 * TIC_SECONDS)
+    assert late == pytest.approx([ 1.5 * TIC_SECONDS, 0.5 * TIC_SECONDS ])
+    assert clock.tics == 3
+    assert clock.fraction(100.0 + 2.5 * TIC_SECONDS) == pytest.approx(0.5)
+    assert clock.until_next(100.0 + 2.5 * TIC_SECONDS) == pytest.approx(0.5 * TIC_SECONDS)
+    # clamped either side
+    assert clock.fraction(100.0) == 0.0 and clock.fraction(200.0) == 1.0
+
+def test_stall_drops_tics():
+    clock = tic_clock(0.0)
+    clock.run(0.0)
+    late = clock.run(100.5 * TIC_SECONDS)
+    assert len(late) == MAX_CATCHUP
+    assert clock.dropped == 100 - MAX_CATCHUP
+    assert clock.tics == 101
+    # the ones that do run are the most recent, the last one half a tic late
+    assert late[-1] == pytest.approx(0.5 * TIC_SECONDS)
+    assert clock.run(100.75 * TIC_SECONDS) == []
+
+def test_input_latency():
+    stats = loop_stats()
+    # a key waits for the next tic, then the next frame shows it
+    stats.input(1.000)
+    stats.presented(1.010)
+    stats.input(1.020)
+    stats.tic(0.002)
+    stats.presented(1.050)
+    # a camera move shows up on the next frame, no tic needed
+    stats.input(1.060, immediate=True)
+    stats.presented(1.070)
+    stats.presented(1.080)
+    assert list(stats.latency) == pytest.approx([ 50.0, 10.0 ])
+    summary = stats.summary()
+    assert summary['frames'] == 4
+    assert summary['latency_max_ms'] == pytest.approx(50.0)
+    assert summary['jitter_mean_ms'] == pytest.approx(2.0)
+    assert 'input latency' in stats.report()
+
+def test_history_is_bounded():
+    stats = loop_stats(history=10)
+    for n in range(100):
+        stats.tic(n / 1000)
+    assert len(stats.jitter) == 10
+    assert stats.summary()['jitter_max_ms'] == pytest.approx(99.0)
+    empty = loop_stats().summary()
+    assert empty['latency_p99_ms'] == 0.0 and not math.isnan(empty['jitter_mean_ms'])
@@ -0,0 +1,47 @@
+import math
+import pickle
+import numpy as np
+
+def test_seg_tables(grid_map):
+    geometry = grid_map.GEOMETRY
+    vertexes, linedefs, sidedefs = grid_map.VERTEXES.array, grid_map.LINEDEFS.array, grid_map.SIDEDEFS.array
+    for n, seg in enumerate(grid_map.SEGS.array.tolist()):
+        start, end, angle, linedef, direction, _ = seg
+        (x1, y1), (x2, y2) = vertexes[['x', 'y']][start].tolist(), vertexes[['x', 'y']][end].tolist()
+        length = math.hypot(x2 - x1, y2 - y1)
+        assert math.isclose(geometry.SEG_LENGTH[n], length)
+        # the normal points at the front, right of start -> end
+        nx, ny = geometry.SEG_NORMAL[n]
+        assert math.isclose(nx * (x2 - x1) + ny * (y2 - y1), 0, abs_tol=1e-9) and nx * (y2 - y1) - ny * (x2 - x1) > 0
+        assert geometry.SEG_ANGLE[n] == (angle & 0xffff) << 16
+        front, back = linedefs['front'][linedef], linedefs['back'][linedef]
+        if direction:
+            front, back = back, front
+        assert geometry.SEG_FRONT[n] == (sidedefs['sector'][front] if front >= 0 else -1)
+        assert geometry.SEG_BACK[n] == (sidedefs['sector'][back] if back >= 0 else -1)
+
+def test_sector_tables(grid_map):
+    geometry = grid_map.GEOMETRY
+    linedefs, sidedefs = grid_map.LINEDEFS.array, grid_map.SIDEDEFS.array
+    touching = { s: [] for s in range(len(grid_map.SECTORS)) }
+    for n, (front, back) in enumerate(zip(linedefs['front'].tolist(), linedefs['back'].tolist())):
+        sides = { sidedefs['sector'][side] for side in (front, back) if side >= 0 }
+        for sector in sides:
+            touching[int(sector)].append(n)
+        assert geometry.LINEDEF_TWO_SIDED[n] == (front >= 0 and back >= 0)
+    for sector, lines in touching.items():
+        assert geometry.sector_linedefs(sector).tolist() == lines
+        boxes = geometry.LINEDEF_BBOX[lines]
+        assert geometry.SECTOR_BBOX[sector].tolist() == [ boxes[:, 0].max(), boxes[:, 1].min(), boxes[:, 2].min(), boxes[:, 3].max() ]
+    # synthwad rooms are square, 256 on a side
+    i, j = 2, 1
+    assert geometry.SECTOR_BBOX[j * 4 + i].tolist() == [ 512, 256, 512, 768 ]
+    ranges = geometry.SSECTOR_RANGES
+    assert ranges[:, 0].tolist() == grid_map.SSECTORS.array['first'].tolist()
+    assert (ranges[:, 1] - ranges[:, 0]).tolist() == grid_map.SSECTORS.array['count'].tolist()
+
+def test_pickle(grid_map):
+    geometry = grid_map.GEOMETRY
+    copy = pickle.loads(pickle.dumps(geometry))
+    for name, table in geometry.tables().items():
+        assert np.array_equal(getattr(copy, name), table)
@@ -0,0 +1,115 @@
+import struct
+import numpy as np
+import pytest
+from graphics import WADGraphics, FLAT_SIZE
+from synthwad import synthetic_map
+
+class raw_lumps:
+    # anything write_wad can take, a list of (name, payload)
+    def __init__(self, *lumps):
+        self.LUMPS = lumps
+
+    def lumps(self):
+        return self.LUMPS
+
+def patch_lump(columns, height, left=0, top=0):
+    # columns is a list of posts per column, each post (top row, pixel bytes)
+    header = struct.pack('<hhhh', len(columns), height, left, top)
+    data = b''
+    offsets = []
+    for posts in columns:
+        offsets.append(len(header) + 4 * len(columns) + len(data))
+        for row, pixels in posts:
+            data += bytes([ row, len(pixels), 0 ]) + pixels + b'\0'
+        data += b'\xff'
+    return header + struct.pack(f'<{len(offsets)}I', *offsets) + data
+
+def solid_patch(width, height, colour):
+    return patch_lump([ [ (0, bytes([ colour ]) * height) ] for _ in range(width) ], height)
+
+def pnames_lump(*names):
+    return struct.pack('<i', len(names)) + b''.join(name.encode().ljust(8, b'\0') for name in names)
+
+def texture_lump(*textures):
+    # textures are (name, width, height, [ (x, y, patch number) ])
+    offsets, body = [], b''
+    start = 4 + 4 * len(textures)
+    for name, width, height, patches in textures:
+        offsets.append(start + len(body))
+        body += struct.pack('<8sihhih', name.encode(), 0, width, height, 0, len(patches))
+        body += b''.join(struct.pack('<hhhhh', x, y, patch, 1, 0) for x, y, patch in patches)
+    return struct.pack(f'<i{len(offsets)}i', len(offsets), *offsets) + body
+
+FLAT = bytes(range(256)) * 16
+
+@pytest.fixture
+def gfx(make_wad):
+    # A is solid 10s, B is 20s with rows 1 and 2 of every column left see-through
+    holed = patch_lump([ [ (0, bytes([ 20 ])), (3, bytes([ 20 ])) ] for _ in range(4) ], 4)
+    wad = make_wad(synthetic_map('E1M1', 2, 2, 128),
+                   raw_lumps(('PLAYPAL', bytes(range(256)) * 3 * 2), ('COLORMAP', bytes(256) * 34),
+                             ('PNAMES', pnames_lump('PATCHA', 'PATCHB', 'GONE')),
+                             ('TEXTURE1', texture_lump(('STARTAN3', 8, 4, [ (0, 0, 0), (-2, 0, 1), (6, 1, 0), (0, 0, 2) ]),
+                                                       ('TALL', 2, 64, [ (0, 0, 0) ]))),
+                             ('P_START', b''), ('PATCHA', solid_patch(4, 4, 10)), ('PATCHB', holed), ('PATCHC', solid_patch(4, 4, 30)),
+                             ('P_END', b''),
+                             ('F_START', b''), ('FLOOR4_8', FLAT), ('SHORT', FLAT[:100]), ('F_END', b'')))
+    return WADGraphics(wad)
+
+def test_palettes(gfx):
+    assert gfx.PLAYPAL.shape == (2, 256, 3)
+    assert gfx.COLORMAP.shape == (34, 256)
+    assert gfx.palette(1)[1] == (3, 4, 5)
+    assert gfx.PNAMES == [ 'PATCHA', 'PATCHB', 'GONE' ]
+
+def test_composition(gfx):
+    tex = gfx.texture('startan3')
+    # [x, y], one contiguous column per x
+    assert tex.PIXELS.shape == (8, 4) and tex.PIXELS[3].flags['C_CONTIGUOUS']
+    columns = tex.PIXELS.tolist()
+    # B over A at x -2: only its last two columns land, its holes show A
+    assert columns[0] == columns[1] == [ 20, 10, 10, 20 ]
+    assert columns[2] == columns[3] == [ 10, 10, 10, 10 ]
+    # nothing at 4 and 5, A again from 6 a row down and clipped at the edge
+    assert columns[4] == columns[5] == [ 0, 0, 0, 0 ]
+    assert columns[6] == columns[7] == [ 0, 10, 10, 10 ]
+    assert tex.MASK.tolist()[4] == [ False ] * 4 and tex.MASK.tolist()[6] == [ False, True, True, True ]
+    # a patch taller than the texture is cut off, the rest left see-through
+    assert gfx.texture('TALL').MASK[:, :4].all() and not gfx.texture('TALL').MASK[:, 4:].any()
+
+def test_flats(gfx):
+    flat = gfx.flat('FLOOR4_8')
+    assert flat.shape == (FLAT_SIZE, FLAT_SIZE)
+    # rows as they are on disk, [y, x]
+    assert flat[1, 3] == FLAT[FLAT_SIZE + 3]
+    assert gfx.flat('SHORT') is None
+
+def test_lru_eviction(gfx):
+    gfx.cache_bytes = 64
+    a, b = gfx.patch('PATCHA'), gfx.patch('PATCHB')
+    assert gfx.cached_bytes == a.nbytes + b.nbytes == 64
+    # A was used last, so B goes when C comes in
+    assert gfx.patch('PATCHA') is a
+    gfx.patch('PATCHC')
+    assert gfx.cached_bytes == 64
+    hits = gfx.hits
+    assert gfx.patch('PATCHA') is a and gfx.hits == hits + 1
+    misses = gfx.misses
+    assert gfx.patch('PATCHB') is not b and gfx.misses == misses + 1
+    # whatever was asked for last is kept even when it's over budget alone
+    gfx.flat('FLOOR4_8')
+    assert gfx.flat('FLOOR4_8').nbytes > gfx.cache_bytes
+    assert gfx.cached_bytes == FLAT_SIZE * FLAT_SIZE
+
+def test_missing_names_are_remembered(gfx, make_wad):
+    assert gfx.texture('NOPE') is None
+    misses = gfx.misses
+    assert gfx.texture('NOPE') is None and gfx.patch('GONE') is None
+    assert gfx.patch('GONE') is None
+    assert gfx.misses == misses + 1
+    m = gfx.wad.load_map('E1M1')
+    # STARTAN3 and FLOOR4_8 are there, CEIL3_5 isn't
+    assert gfx.preload(m) == 2
+    assert gfx.preload(m) == 0
+    gfx.clear()
+    assert gfx.cached_bytes == 0 and gfx.preload(m) == 2
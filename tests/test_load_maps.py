@@ -0,0 +1,28 @@
+import numpy as np
+from synthwad import synthetic_map
+
+def maps(make_wad):
+    return make_wad(synthetic_map('E1M1', 3, 2, 128, seed=1), synthetic_map('E1M2', 2, 2, 128, seed=2),
+                    synthetic_map('E1M3', 4, 1, 128, seed=3))
+
+def test_pool_matches_serial(make_wad):
+    wad = maps(make_wad)
+    serial = dict(wad.load_maps(workers=1))
+    pooled = dict(wad.load_maps(workers=2))
+    assert sorted(pooled) == sorted(serial) == [ 'E1M1', 'E1M2', 'E1M3' ]
+    for name, m in serial.items():
+        # the pooled maps come back pickled, out of the workers own mmap
+        copy = pooled[name]
+        for lump, array in m.arrays().items():
+            assert np.array_equal(copy.arrays()[lump], array)
+        assert np.array_equal(copy.BSP.CHILDREN, m.BSP.CHILDREN)
+        assert copy.get_map_bounds() == m.get_map_bounds()
+
+def test_summaries(make_wad):
+    wad = maps(make_wad)
+    serial = dict(wad.load_maps(workers=1, summary=True))
+    assert serial == dict(wad.load_maps(workers=2, summary=True))
+    assert serial['E1M3']['sectors'] == 4 and serial['E1M3']['map'] == 'E1M3'
+    # only the named maps, and a missing one comes back as None
+    assert dict(wad.load_maps([ 'E1M2' ], summary=True)) == { 'E1M2': serial['E1M2'] }
+    assert list(wad.load_maps([ 'E9M9' ])) == [ ('E9M9', None) ]
@@ -0,0 +1,28 @@
+import numpy as np
+
+def test_locate(grid_map):
+    rng = np.random.default_rng(2)
+    xs, ys = rng.uniform(0, 1024, 200), rng.uniform(0, 1024, 200)
+    rooms = (ys // 256).astype(np.int64) * 4 + (xs // 256).astype(np.int64)
+    subsectors, sectors = grid_map.locate_many(xs, ys)
+    # synthwad rooms are their own subsector and their own sector
+    assert np.array_equal(subsectors, rooms) and np.array_equal(sectors, rooms)
+    assert [ grid_map.locate(x, y) for x, y in zip(xs.tolist(), ys.tolist()) ] == list(zip(rooms.tolist(), rooms.tolist()))
+
+def test_locator_follows_a_walk(grid_map):
+    locator = grid_map.locator()
+    # small steps across the map, back and forth through rooms
+    t = np.linspace(0, 1, 400)
+    xs, ys = 10 + 1000 * t, 500 + 400 * np.sin(t * 9)
+    for x, y in zip(xs.tolist(), ys.tolist()):
+        assert locator.locate(x, y) == grid_map.locate(x, y)
+    # most steps stay in the same room
+    assert locator.hits > 3 * locator.misses
+    # off the map always takes the long way, and still agrees
+    misses = locator.misses
+    assert locator.locate(-50, -50) == grid_map.locate(-50, -50)
+    assert locator.locate(-51, -50) == grid_map.locate(-51, -50)
+    assert locator.misses == misses + 2
+    locator.reset()
+    locator.locate(100, 100)
+    assert locator.misses == misses + 3
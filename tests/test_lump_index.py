@@ -0,0 +1,48 @@
+from synthwad import synthetic_map, write_wad
+from wadfile import WADFile
+
+class raw_lumps:
+    # anything write_wad can take, a list of (name, payload)
+    def __init__(self, *lumps):
+        self.LUMPS = lumps
+
+    def lumps(self):
+        return self.LUMPS
+
+def test_lookup_and_markers(make_wad):
+    wad = make_wad(raw_lumps(('PLAYPAL', b'\1' * 4), ('COLORMAP', b'\2')), synthetic_map('E1M1', 2, 2, 128),
+                   synthetic_map('MAP07', 2, 2, 128), raw_lumps(('DEMO1', b'\3'), ('E1M9', b'')))
+    assert bytes(wad.get_lump_named('PLAYPAL')) == b'\1' * 4
+    # a marker without a THINGS lump after it isn't a map
+    assert wad.map_markers() == [ 'E1M1', 'MAP07' ]
+    names = [ e.name for e in wad.LUMPS.map_entries('E1M1') ]
+    assert names[0] == 'THINGS' and names[-1] == 'BLOCKMAP' and len(names) == 10
+    # a plain lookup of a map lump gets the last one in the WAD
+    assert wad.LUMPS.get_entry_named('THINGS') is wad.LUMPS.map_entries('MAP07')[0]
+
+def test_namespaces(make_wad):
+    wad = make_wad(raw_lumps(('S_START', b''), ('TROOA1', b'sprite'), ('S_END', b''),
+                             ('F_START', b''), ('F1_START', b''), ('FLOOR4_8', b'flat'), ('F1_END', b''), ('F_END', b''),
+                             ('TROOA1', b'outside')))
+    assert bytes(wad.get_lump_named('TROOA1', 'S')) == b'sprite'
+    assert bytes(wad.get_lump_named('TROOA1')) == b'outside'
+    # the numbered inner markers don't close the outer range
+    assert bytes(wad.get_lump_named('FLOOR4_8', 'F')) == b'flat'
+    assert wad.get_lump_named('FLOOR4_8', 'S') is None
+
+def test_pwad_layering(make_wad, tmp_path):
+    base = make_wad(raw_lumps(('PLAYPAL', b'base'), ('S_START', b''), ('TROOA1', b'base'), ('S_END', b'')),
+                    synthetic_map('E1M1', 3, 3, 128), synthetic_map('E1M2', 2, 2, 128), name='BASE.WAD')
+    patch = str(tmp_path / 'PATCH.WAD')
+    write_wad(patch, [ raw_lumps(('SS_START', b''), ('TROOA1', b'patch'), ('TROOB1', b'new'), ('SS_END', b'')),
+                       synthetic_map('E1M1', 2, 1, 128), raw_lumps(('PLAYPAL', b'patch')) ])
+    with WADFile(base.NAME, patch) as wad:
+        assert wad.PWADS == [ patch ]
+        assert bytes(wad.get_lump_named('PLAYPAL')) == b'patch'
+        # PWADs add to the IWADs namespaces with the doubled markers
+        assert bytes(wad.get_lump_named('TROOA1', 'S')) == b'patch'
+        assert bytes(wad.get_lump_named('TROOB1', 'S')) == b'new'
+        # whole maps are replaced, the ones the patch doesn't touch stay
+        assert len(wad.load_map('E1M1').SECTORS) == 2
+        assert len(wad.load_map('E1M2').SECTORS) == 4
+        assert wad.map_markers() == [ 'E1M1', 'E1M2' ]
@@ -0,0 +1,85 @@
+import os
+import numpy as np
+import map_cache as mc
+from map_cache import map_cache, map_key
+from synthwad import synthetic_map, write_wad
+from wadfile import WADFile
+
+def same_map(a, b):
+    assert a.name == b.name
+    assert a.get_map_bounds() == b.get_map_bounds()
+    arrays_a, arrays_b = a.arrays(), b.arrays()
+    assert arrays_a.keys() == arrays_b.keys()
+    for name in arrays_a:
+        assert np.array_equal(arrays_a[name], arrays_b[name]), name
+    assert a.BSP.ROOT == b.BSP.ROOT and np.array_equal(a.BSP.CORNERS, b.BSP.CORNERS)
+    assert a.REJECT.BITS.tobytes() == b.REJECT.BITS.tobytes()
+    assert np.array_equal(a.BLOCKMAP.OFFSETS, b.BLOCKMAP.OFFSETS) and np.array_equal(a.BLOCKMAP.LINEDEFS, b.BLOCKMAP.LINEDEFS)
+    for name, table in a.GEOMETRY.tables().items():
+        assert np.array_equal(table, b.GEOMETRY.tables()[name]), name
+    assert np.array_equal(a.SSECTOR_SECTORS, b.SSECTOR_SECTORS)
+
+def test_round_trip(make_wad, tmp_path):
+    wad = make_wad(synthetic_map('E1M1', 4, 3, 256, seed=3), synthetic_map('E1M2', 2, 2, 128))
+    cache = map_cache(str(tmp_path / 'cache'))
+    cold = wad.load_map('E1M1', cache=cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert os.path.exists(cache.path(wad, 'E1M1'))
+    warm = wad.load_map('E1M1', cache=cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+    same_map(cold, warm)
+    same_map(wad.load_map('E1M1'), warm)
+    assert warm.locate(300, 300) == cold.locate(300, 300)
+    # each map has its own file
+    wad.load_map('E1M2', cache=cache)
+    assert cache.misses == 2
+    assert wad.load_map('NOPE', cache=cache) is None
+
+def test_changed_lumps(make_wad, tmp_path):
+    cache = map_cache(str(tmp_path / 'cache'))
+    wad = make_wad(synthetic_map('E1M1', 3, 3, 128, seed=1))
+    key = map_key(wad, 'E1M1')
+    wad.load_map('E1M1', cache=cache)
+    wad.close()
+    # same file name, different walls
+    wad = make_wad(synthetic_map('E1M1', 3, 3, 128, seed=2, wall_chance=0.9))
+    assert map_key(wad, 'E1M1') != key
+    m = wad.load_map('E1M1', cache=cache)
+    assert (cache.hits, cache.misses) == (0, 2)
+    same_map(wad.load_map('E1M1'), m)
+    wad.load_map('E1M1', cache=cache)
+    assert cache.hits == 1
+
+def test_pwad_override(make_wad, tmp_path):
+    cache = map_cache(str(tmp_path / 'cache'))
+    wad = make_wad(synthetic_map('E1M1', 3, 3, 128))
+    wad.load_map('E1M1', cache=cache)
+    patch = str(tmp_path / 'PATCH.WAD')
+    write_wad(patch, [ synthetic_map('E1M1', 2, 2, 128) ])
+    with WADFile(wad.NAME, patch) as layered:
+        m = layered.load_map('E1M1', cache=cache)
+        assert cache.misses == 2
+        assert len(m.SECTORS) == 4
+
+def test_broken_and_stale_files(make_wad, tmp_path, monkeypatch):
+    cache = map_cache(str(tmp_path / 'cache'))
+    wad = make_wad(synthetic_map('E1M1', 3, 3, 128))
+    wad.load_map('E1M1', cache=cache)
+    filename = cache.path(wad, 'E1M1')
+    with open(filename, 'rb') as f:
+        good = f.read()
+    for broken in (b'', good[:10], b'NOTCACHE' + good[8:], good[:len(good) // 2]):
+        with open(filename, 'wb') as f:
+            f.write(broken)
+        misses = cache.misses
+        same_map(wad.load_map('E1M1'), wad.load_map('E1M1', cache=cache))
+        assert cache.misses == misses + 1
+    # a new format version makes every old file stale
+    hits = cache.hits
+    wad.load_map('E1M1', cache=cache)
+    assert cache.hits == hits + 1
+    monkeypatch.setattr(mc, 'FORMAT_VERSION', mc.FORMAT_VERSION + 1)
+    wad.load_map('E1M1', cache=cache)
+    assert cache.hits == hits + 1
+    wad.load_map('E1M1', cache=cache)
+    assert cache.hits == hits + 2
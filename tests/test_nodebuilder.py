@@ -0,0 +1,136 @@
+import sys
+import numpy as np
+from datatypes import NF_SUBSECTOR, flat_bsp
+from nodebuilder import build_nodes, initial_segs, node_builder
+from synthwad import synthetic_map
+
+def check_nodes(vertexes, linedefs, sidedefs, out):
+    out_vertexes, segs, ssectors, nodes = out
+    # the originals keep their indices
+    assert np.array_equal(out_vertexes[:len(vertexes)], vertexes)
+    # every seg runs along its linedef, in the direction its side faces
+    v = out_vertexes
+    lines = linedefs[segs['linedef']]
+    ax, ay = v['x'][lines['start']].astype(np.int64), v['y'][lines['start']].astype(np.int64)
+    bx, by = v['x'][lines['end']].astype(np.int64), v['y'][lines['end']].astype(np.int64)
+    for end in ('start', 'end'):
+        x, y = v['x'][segs[end]].astype(np.int64), v['y'][segs[end]].astype(np.int64)
+        assert np.all(np.abs((x - ax) * (by - ay) - (y - ay) * (bx - ax)) <= np.hypot(bx - ax, by - ay))
+    # the subsectors cover every seg once, in order
+    assert ssectors['first'][0] == 0
+    assert np.array_equal(ssectors['first'][1:], np.cumsum(ssectors['count'])[:-1])
+    assert ssectors['count'].sum() == len(segs)
+    # every subsector is reached exactly once from the root
+    bsp = flat_bsp(nodes)
+    leaves = []
+    stack = [ bsp.ROOT ]
+    while stack:
+        node = stack.pop()
+        if node & NF_SUBSECTOR:
+            leaves.append(node & ~NF_SUBSECTOR)
+        else:
+            stack.extend(int(c) for c in bsp.CHILDREN[node])
+    assert sorted(leaves) == list(range(len(ssectors)))
+    # and every seg lies on or in front of its own line, so leaves are convex
+    for first, count in ssectors[['first', 'count']].tolist():
+        s = segs[first:first + count]
+        x1, y1 = v['x'][s['start']].astype(np.int64), v['y'][s['start']].astype(np.int64)
+        x2, y2 = v['x'][s['end']].astype(np.int64), v['y'][s['end']].astype(np.int64)
+        for n in range(count):
+            side = (x1 - x1[n]) * (y2[n] - y1[n]) - (y1 - y1[n]) * (x2[n] - x1[n])
+            assert np.all(side >= -abs(x2[n] - x1[n]) - abs(y2[n] - y1[n]))
+
+def test_grid_map(grid_map):
+    vertexes, linedefs, sidedefs = grid_map.VERTEXES.array, grid_map.LINEDEFS.array, grid_map.SIDEDEFS.array
+    out = build_nodes(vertexes, linedefs, sidedefs)
+    check_nodes(vertexes, linedefs, sidedefs, out)
+    assert len(out[1]) >= len(initial_segs(vertexes, linedefs))
+
+def test_collinear_vertexes(make_wad):
+    # every room edge split in three, so each wall is a run of collinear lines
+    m = make_wad(synthetic_map('E1M1', 3, 3, 192, wall_chance=0.3, detail=3, seed=2)).load_map('E1M1')
+    vertexes, linedefs, sidedefs = m.VERTEXES.array, m.LINEDEFS.array, m.SIDEDEFS.array
+    out = build_nodes(vertexes, linedefs, sidedefs)
+    check_nodes(vertexes, linedefs, sidedefs, out)
+    # the grid lines are the natural partitions, nothing needs cutting
+    assert len(out[1]) == len(initial_segs(vertexes, linedefs))
+
+def test_duplicate_vertex(grid_map):
+    vertexes = np.concatenate([ grid_map.VERTEXES.array, grid_map.VERTEXES.array[:1] ])
+    linedefs = grid_map.LINEDEFS.array.copy()
+    # point one line at the copy of vertex 0
+    uses = np.flatnonzero(linedefs['start'] == 0)
+    linedefs['start'][uses[0]] = len(vertexes) - 1
+    out = build_nodes(vertexes, linedefs, grid_map.SIDEDEFS.array)
+    check_nodes(vertexes, linedefs, grid_map.SIDEDEFS.array, out)
+    assert len(out[0]) >= len(vertexes)
+
+def test_split_vertexes_are_new(grid_map):
+    # an off-grid diagonal wall forces splits, the points they make come after
+    # the originals (and after a duplicate) rather than on top of them
+    vertexes = np.concatenate([ grid_map.VERTEXES.array, np.array([ (1, 0), (100, 1023), (1, 0) ], dtype=grid_map.VERTEXES.array.dtype) ])
+    linedefs = np.concatenate([ grid_map.LINEDEFS.array, grid_map.LINEDEFS.array[:1] ])
+    n = len(vertexes)
+    linedefs['start'][-1], linedefs['end'][-1] = n - 3, n - 2
+    out_vertexes, segs, _, _ = out = build_nodes(vertexes, linedefs, grid_map.SIDEDEFS.array)
+    check_nodes(vertexes, linedefs, grid_map.SIDEDEFS.array, out)
+    assert len(out_vertexes) > n
+    added = { tuple(p) for p in out_vertexes[n:][['x', 'y']].tolist() }
+    assert len(added) == len(out_vertexes) - n
+
+def stack_depth():
+    frame, depth = sys._getframe(1), 0
+    while frame is not None:
+        frame, depth = frame.f_back, depth + 1
+    return depth
+
+def test_build_doesnt_recurse(make_wad, monkeypatch):
+    # every partition is chosen from the same stack depth however deep the
+    # tree gets, so a badly unbalanced map can't hit the recursion limit
+    m = make_wad(synthetic_map('E1M1', 64, 1, 64, wall_chance=0.0, balanced=False)).load_map('E1M1')
+    choose = node_builder._node_builder__choose
+    depths = []
+    def counted(self, segs):
+        depths.append(stack_depth())
+        return choose(self, segs)
+    monkeypatch.setattr(node_builder, '_node_builder__choose', counted)
+    out = build_nodes(m.VERTEXES.array, m.LINEDEFS.array, candidates=2)
+    check_nodes(m.VERTEXES.array, m.LINEDEFS.array, m.SIDEDEFS.array, out)
+    assert flat_bsp(out[3]).depth() >= 6
+    assert len(set(depths)) == 1
+
+class patched:
+    # a synthetic map with one of its lumps swapped for other bytes
+    def __init__(self, m, name, data):
+        self.MAP, self.NAME, self.DATA = m, name, data
+
+    def lumps(self):
+        return [ (name, self.DATA if name == self.NAME else data) for name, data in self.MAP.lumps() ]
+
+def corrupt(m, node, side, child):
+    nodes = bytearray(dict(m.lumps())['NODES'])
+    # right and left are the last two words of each 28 byte record
+    nodes[node * 28 + 24 + 2 * side:node * 28 + 26 + 2 * side] = child.to_bytes(2, 'little')
+    return patched(m, 'NODES', bytes(nodes))
+
+def test_broken_nodes_are_rebuilt(make_wad, capsys):
+    m = synthetic_map('E1M1', 4, 3, 128)
+    good = make_wad(m).load_map('E1M1')
+    root = len(good.BSP) - 1
+    assert good.BSP.is_valid(len(good.SSECTORS))
+    rng = np.random.default_rng(0)
+    xs, ys = rng.uniform(1, 4 * 128 - 1, 100), rng.uniform(1, 3 * 128 - 1, 100)
+    rooms = good.SSECTOR_SECTORS[good.BSP.locate_many(xs, ys)]
+    broken = {
+        'node out of range': corrupt(m, 0, 0, root + 5),
+        'subsector out of range': corrupt(m, 1, 1, NF_SUBSECTOR | len(good.SSECTORS)),
+        'cycle through the root': corrupt(m, 0, 1, root),
+        'two parents': corrupt(m, root, 0, int(good.BSP.CHILDREN[root, 1])),
+    }
+    for n, (why, lumps) in enumerate(broken.items()):
+        loaded = make_wad(lumps, name=f'BROKEN{n}.WAD').load_map('E1M1')
+        bsp = loaded.BSP
+        assert 'rebuilding' in capsys.readouterr().out, why
+        assert bsp.is_valid(len(loaded.SSECTORS)), why
+        assert np.array_equal(loaded.SSECTOR_SECTORS[bsp.locate_many(xs, ys)], rooms), why
+        assert sorted(bsp.front_to_back(200, 200)) == list(range(len(loaded.SSECTORS))), why
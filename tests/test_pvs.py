@@ -0,0 +1,85 @@
+import pickle
+import numpy as np
+from map_cache import map_key
+from pvs import bake_pvs, write_pvs, read_pvs, load_pvs, pvs_path, subsector_samples, blocking_walls
+from synthwad import synthetic_map
+from visibility import batch_visibility
+
+def matrix(pvs):
+    return np.unpackbits(pvs.BITS, axis=1, count=pvs.NUM_SUBSECTORS).astype(bool)
+
+def test_open_and_closed_rooms(make_wad):
+    # no walls inside: everything sees everything
+    open_map = make_wad(synthetic_map('E1M1', 3, 3, 256, wall_chance=0.0)).load_map('E1M1')
+    assert matrix(bake_pvs(open_map, workers=1)).all()
+    # walls everywhere: a room sees itself and the rooms on its diagonals,
+    # since a sight line that only touches wall ends at the corners isn't
+    # blocked
+    closed = make_wad(synthetic_map('E1M1', 3, 3, 256, wall_chance=1.0), name='CLOSED.WAD').load_map('E1M1')
+    rows = matrix(bake_pvs(closed, workers=1))
+    room = closed.SSECTOR_SECTORS
+    col, row = room % 3, room // 3
+    dc, dr = np.abs(col[:, None] - col[None, :]), np.abs(row[:, None] - row[None, :])
+    assert np.array_equal(rows, dc == dr)
+
+def test_bake(grid_map):
+    pvs = bake_pvs(grid_map, workers=1)
+    rows = matrix(pvs)
+    count = len(grid_map.SSECTORS)
+    assert rows.shape == (count, count)
+    assert rows.diagonal().all()
+    assert np.array_equal(rows, rows.T)
+    for ss in range(count):
+        assert pvs.visible_subsectors(ss).tolist() == np.flatnonzero(rows[ss]).tolist()
+        assert pvs.visible_from(ss).tolist() == rows[ss].tolist()
+    # the pool deals subsectors out differently but has to agree
+    assert np.array_equal(bake_pvs(grid_map, workers=2, shards_per_worker=3).BITS, pvs.BITS)
+
+def test_conservative(grid_map):
+    # whatever the wall clipping pass actually draws is in the PVS
+    pvs = bake_pvs(grid_map, workers=1)
+    rng = np.random.default_rng(8)
+    # kept a player radius away from the walls, closer than the near plane a
+    # wall gets clipped away and the pass sees past it
+    xs = rng.integers(0, 4, 150) * 256 + rng.uniform(16, 240, 150)
+    ys = rng.integers(0, 4, 150) * 256 + rng.uniform(16, 240, 150)
+    angles = rng.uniform(0, 360, 150)
+    drawn = batch_visibility(grid_map, xs, ys, angles, occlusion=True, workers=1)
+    here = grid_map.BSP.locate_many(xs, ys)
+    for i in range(len(xs)):
+        assert pvs.visible_from(here[i])[drawn.subsectors(i)].all()
+
+def test_samples(grid_map):
+    points, offsets = subsector_samples(grid_map)
+    assert len(offsets) == len(grid_map.SSECTORS) + 1
+    # every sample is inside its own subsector
+    owners = grid_map.BSP.locate_many(points[:, 0], points[:, 1])
+    assert np.array_equal(owners, np.repeat(np.arange(len(offsets) - 1), np.diff(offsets)))
+    walls = blocking_walls(grid_map)
+    assert len(walls) == int((~grid_map.GEOMETRY.LINEDEF_TWO_SIDED).sum())
+
+def test_sidecar(grid_map, make_wad, tmp_path):
+    pvs = bake_pvs(grid_map, workers=1)
+    filename = str(tmp_path / 'map.pvs')
+    write_pvs(filename, 'key', pvs)
+    loaded = read_pvs(filename, 'key')
+    assert loaded.NUM_SUBSECTORS == pvs.NUM_SUBSECTORS and np.array_equal(loaded.BITS, pvs.BITS)
+    # stale, missing and broken files read as no PVS
+    assert read_pvs(filename, 'other key') is None
+    assert read_pvs(str(tmp_path / 'missing.pvs'), 'key') is None
+    with open(filename, 'rb') as f:
+        data = f.read()
+    for broken in (b'', data[:12], b'X' + data[1:], data[:-5]):
+        with open(filename, 'wb') as f:
+            f.write(broken)
+        assert read_pvs(filename, 'key') is None
+    copy = pickle.loads(pickle.dumps(pvs))
+    assert np.array_equal(copy.BITS, pvs.BITS) and copy.can_see(0, 0)
+
+def test_load_next_to_the_wad(make_wad):
+    wad = make_wad(synthetic_map('E1M1', 3, 2, 256, wall_chance=0.5, seed=4))
+    assert load_pvs(wad, 'E1M1') is None
+    assert load_pvs(wad, 'E9M9') is None
+    pvs = bake_pvs(wad.load_map('E1M1'), workers=1)
+    write_pvs(pvs_path(wad, 'E1M1'), map_key(wad, 'E1M1'), pvs)
+    assert np.array_equal(load_pvs(wad, 'E1M1').BITS, pvs.BITS)
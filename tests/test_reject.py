@@ -0,0 +1,58 @@
+import pickle
+import random
+import numpy as np
+from datatypes import reject_table
+from synthwad import synthetic_map
+
+def reject_lump(n, hidden):
+    # the REJECT bytes for n sectors with (a, b) pairs that can't see each other
+    bits = np.zeros(n * n, dtype=np.uint8)
+    for a, b in hidden:
+        bits[a * n + b] = 1
+    return np.packbits(bits, bitorder='little').tobytes()
+
+def test_bits():
+    rng = random.Random(9)
+    n = 13
+    hidden = { (rng.randrange(n), rng.randrange(n)) for _ in range(60) }
+    reject = reject_table(reject_lump(n, hidden), n)
+    for a in range(n):
+        row = reject.visible_from(a)
+        for b in range(n):
+            assert reject.can_see(a, b) == ((a, b) not in hidden) == bool(row[b])
+        assert reject.visible_sectors(a).tolist() == np.flatnonzero(row).tolist()
+
+def test_short_lump():
+    # the missing part reads as "can see", so nothing is culled by mistake
+    n = 10
+    data = reject_lump(n, [ (0, 1), (9, 9), (5, 3) ])
+    for size in (0, 1, len(data) // 2, len(data) - 1):
+        reject = reject_table(data[:size], n)
+        assert len(reject.BITS) == len(data)
+        assert reject.can_see(9, 9)
+        assert reject.visible_from(9).all()
+        assert reject.can_see(0, 1) == (size == 0)
+
+def test_oversized_lump():
+    n = 6
+    data = reject_lump(n, [ (2, 4) ]) + b'\xff' * 16
+    reject = reject_table(data, n)
+    assert len(reject.BITS) == (n * n + 7) // 8
+    assert not reject.can_see(2, 4)
+    assert reject.visible_from(5).all()
+
+def test_pickle():
+    reject = reject_table(reject_lump(7, [ (1, 2), (6, 0) ]), 7)
+    copy = pickle.loads(pickle.dumps(reject))
+    assert copy.NUM_SECTORS == 7 and copy.BITS.tobytes() == reject.BITS.tobytes()
+    assert not copy.can_see(6, 0) and copy.can_see(0, 6)
+
+def test_map_reject(make_wad):
+    m = synthetic_map('E1M1', 3, 3, 128)
+    # synthwad writes an all-visible table, hide the far corners from each other
+    m.REJECT = reject_lump(9, [ (0, 8), (8, 0) ])
+    loaded = make_wad(m).load_map('E1M1')
+    assert loaded.REJECT.NUM_SECTORS == 9
+    assert not loaded.REJECT.can_see(0, 8) and loaded.REJECT.can_see(0, 7)
+    m.REJECT = b''
+    assert make_wad(m, name='EMPTY.WAD').load_map('E1M1').REJECT.visible_from(0).all()
@@ -0,0 +1,72 @@
+import numpy as np
+import pygame as pg
+from pygame.math import Vector2 as vec2
+from renderer import DoomMapRenderer
+
+def place(renderer, x, y, angle):
+    renderer.__player__.POS, renderer.__player__.ANGLE = vec2(x, y), angle
+
+def count_builds(monkeypatch):
+    builds = []
+    build = DoomMapRenderer._DoomMapRenderer__build_view
+    def counted(self):
+        builds.append(self.camera.key())
+        build(self)
+    monkeypatch.setattr(DoomMapRenderer, '_DoomMapRenderer__build_view', counted)
+    return builds
+
+def test_static_layer_follows_the_camera(grid_map, screen, monkeypatch):
+    builds = count_builds(monkeypatch)
+    r = DoomMapRenderer(screen, grid_map)
+    assert len(builds) == 1
+    # the player moving about doesn't move the map
+    for x in (100, 300, 500):
+        place(r, x, 200, 90)
+        r.render()
+    assert len(builds) == 1
+    r.camera.zoom(2)
+    r.render()
+    r.render()
+    assert len(builds) == 2
+    # following the player the camera moves with them, and only then
+    r.camera.follow = True
+    place(r, 600, 200, 90)
+    r.render()
+    r.render()
+    assert len(builds) == 3
+    r.invalidate()
+    r.render()
+    assert len(builds) == 4
+
+def test_dirty_rects_cover_the_changes(grid_map, screen):
+    r = DoomMapRenderer(screen, grid_map)
+    place(r, 128, 128, 45)
+    assert r.render()[0] == screen.get_rect()
+    for x, y, angle in ((140, 150, 60), (700, 300, 180), (900, 900, 270), (300, 700, 10)):
+        before = pg.surfarray.array2d(screen).copy()
+        place(r, x, y, angle)
+        dirty = r.render()
+        after = pg.surfarray.array2d(screen)
+        covered = np.zeros(after.shape, dtype=bool)
+        for rect in dirty:
+            covered[rect.left:rect.right, rect.top:rect.bottom] = True
+        # everything that changed is in a rect, the old overlay as well as the new
+        assert not ((after != before) & ~covered).any()
+        # and the screen is what a full redraw would give
+        fresh = DoomMapRenderer(screen.copy(), grid_map)
+        place(fresh, x, y, angle)
+        fresh.render()
+        assert np.array_equal(pg.surfarray.array2d(fresh.__screen__), after)
+
+def test_segs_drawn_in_chains(grid_map, screen):
+    r = DoomMapRenderer(screen, grid_map)
+    stats = r.enable_stats()
+    place(r, 600, 300, 180)
+    r.render()
+    frame = stats.history[-1]
+    # besides the segs a first frame is one blit of the static layer and the
+    # player and FOV lines. segs that join up end to end inside a subsector
+    # are drawn with one call, so there are fewer calls than segs but at least
+    # one per subsector
+    chains = frame['draw_calls'] - 4
+    assert frame['subsectors'] <= chains < frame['segs']
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from culling import view_frustum
+from pvs import bake_pvs
+from synthwad import synthetic_map
+from visibility import batch_visibility, visibility_query
+
+def walk(bsp, x, y, angle, pvs=None):
+    # what the renderer hands out for a viewpoint
+    visible = view_frustum(x, y, angle).bsp_visibility(bsp)
+    if pvs is not None:
+        visible &= pvs.bsp_visibility(bsp, bsp.locate(x, y))
+    visible = visible.tolist()
+    return sorted(bsp.front_to_back(x, y, lambda node, side: visible[node][side]))
+
+def viewpoints(m, count, seed=0):
+    rng = np.random.default_rng(seed)
+    x_min, x_max, y_min, y_max = m.get_map_bounds()
+    xs = rng.uniform(x_min, x_max, count)
+    ys = rng.uniform(y_min, y_max, count)
+    # some right on the grid lines the partitions run along
+    xs[::7] = np.round(xs[::7] / 128) * 128
+    ys[::5] = np.round(ys[::5] / 128) * 128
+    return xs, ys, rng.uniform(0, 360, count)
+
+@pytest.fixture(params=[ True, False ], ids=[ 'balanced', 'unbalanced' ])
+def walled_map(request, make_wad):
+    return make_wad(synthetic_map('E1M1', 5, 4, 256, wall_chance=0.4, balanced=request.param, seed=7)).load_map('E1M1')
+
+def test_batch_matches_walk(walled_map):
+    m = walled_map
+    xs, ys, angles = viewpoints(m, 200)
+    batch = batch_visibility(m, xs, ys, angles, workers=1)
+    assert len(batch) == 200 and batch.SEGS is None
+    for i in range(len(xs)):
+        assert batch.subsectors(i).tolist() == walk(m.BSP, xs[i], ys[i], angles[i])
+
+def test_batch_with_pvs(walled_map):
+    # the batch checks every subsector against the PVS, the walk only uses it
+    # to skip subtrees, so the batch is the walk less what the PVS rules out
+    m = walled_map
+    pvs = bake_pvs(m, workers=1)
+    xs, ys, angles = viewpoints(m, 120, seed=1)
+    batch = m.visibility(xs, ys, angles, pvs, workers=1)
+    for i in range(len(xs)):
+        here = m.BSP.locate(xs[i], ys[i])
+        walked = walk(m.BSP, xs[i], ys[i], angles[i], pvs)
+        assert batch.subsectors(i).tolist() == [ ss for ss in walked if pvs.can_see(here, ss) ]
+
+def test_occlusion(walled_map):
+    m = walled_map
+    xs, ys, angles = viewpoints(m, 60, seed=2)
+    plain = batch_visibility(m, xs, ys, angles, workers=1)
+    occluded = batch_visibility(m, xs, ys, angles, occlusion=True, workers=1)
+    ranges = m.GEOMETRY.SSECTOR_RANGES
+    for i in range(len(xs)):
+        seen = occluded.subsectors(i)
+        assert set(seen.tolist()) <= set(plain.subsectors(i).tolist())
+        # a subsector counts as seen when some seg of it made it on screen
+        owners = np.searchsorted(ranges[:, 1], occluded.segs(i), side='right')
+        assert sorted(set(owners.tolist())) == seen.tolist()
+    # inside a closed room there's always a wall in front
+    assert all(len(occluded.segs(i)) for i in range(len(xs)))
+
+def test_pool_matches_serial(grid_map):
+    xs, ys, angles = viewpoints(grid_map, 300, seed=3)
+    serial = batch_visibility(grid_map, xs, ys, angles, workers=1)
+    pooled = batch_visibility(grid_map, xs, ys, angles, workers=2, task_size=64)
+    assert np.array_equal(serial.SUBSECTORS, pooled.SUBSECTORS)
+    assert serial.viewpoints_per_second() > 0
+
+def test_bad_input(grid_map):
+    with pytest.raises(ValueError):
+        batch_visibility(grid_map, [ 0, 1 ], [ 0 ], [ 0, 0 ])
+    empty = batch_visibility(grid_map, [], [], [])
+    assert len(empty) == 0 and empty.SUBSECTORS.shape[1] == (len(grid_map.SSECTORS) + 7) // 8
+
+def test_query_chunks(grid_map):
+    # the level by level masks don't depend on how viewpoints are grouped
+    query = visibility_query(grid_map)
+    xs, ys, angles = viewpoints(grid_map, 50, seed=4)
+    whole = query.walk(xs, ys, angles)
+    parts = np.concatenate([ query.walk(xs[n:n + 7], ys[n:n + 7], angles[n:n + 7]) for n in range(0, 50, 7) ])
+    assert np.array_equal(whole, parts)
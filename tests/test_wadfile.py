@@ -0,0 +1,111 @@
+import struct
+import numpy as np
+import pytest
+from data_readers import name_from_bytes, iter_records
+from synthwad import synthetic_map, write_wad
+from wadfile import WADFile, WADMap
+
+def test_name_from_bytes():
+    assert name_from_bytes(b'E1M1\0\0\0\0') == 'E1M1'
+    assert name_from_bytes(b'STARTAN3') == 'STARTAN3'
+    # anything after the first NUL is left over from whatever was there before
+    assert name_from_bytes(b'SKY1\0AN3') == 'SKY1'
+
+def test_iter_records_drops_the_tail():
+    record = struct.Struct('<2h')
+    data = struct.pack('<5h', 1, 2, 3, 4, 5)
+    assert list(iter_records(record, memoryview(data))) == [ (1, 2), (3, 4) ]
+    assert list(iter_records(record, b'\1')) == []
+
+def test_lumps_are_views_of_the_file(make_wad, tmp_path):
+    m = synthetic_map('E1M1', 2, 2, 128)
+    wad = make_wad(m)
+    with open(tmp_path / 'TEST.WAD', 'rb') as f:
+        raw = f.read()
+    assert wad.HEADER.MAGIC == 'PWAD'
+    lumps = dict(m.lumps())
+    for entry in wad.DIRECTORY.lumps:
+        view = wad.lump(entry)
+        assert isinstance(view, memoryview)
+        assert bytes(view) == raw[entry.offset:entry.offset + entry.size] == lumps[entry.name]
+    assert wad.get_lump_named('NOTHERE') is None
+
+def test_map_lumps_decode(make_wad):
+    m = synthetic_map('E1M1', 3, 2, 128, seed=5)
+    loaded = make_wad(m).load_map('E1M1')
+    assert loaded.VERTEXES.array[['x', 'y']].tolist() == m.VERTEXES
+    assert [ tuple(t) for t in loaded.THINGS.array.tolist() ] == m.THINGS
+    assert [ tuple(s) for s in loaded.SSECTORS.array.tolist() ] == m.SSECTORS
+    # sidedef texture names come out as strings, NUL padding gone
+    assert [ tuple(loaded.SIDEDEFS[n]) for n in range(len(m.SIDEDEFS)) ] == m.SIDEDEFS
+
+class without:
+    # a synthetic map with some of its lumps left out
+    def __init__(self, m, *names):
+        self.MAP, self.NAMES = m, names
+
+    def lumps(self):
+        return [ (name, data) for name, data in self.MAP.lumps() if name not in self.NAMES ]
+
+def decoded(m, attr):
+    # a slot that's been filled, without going through __getattr__
+    try:
+        object.__getattribute__(m, attr)
+        return True
+    except AttributeError:
+        return False
+
+def test_lumps_decode_on_first_use(make_wad):
+    m = make_wad(synthetic_map('E1M1', 3, 2, 128)).load_map('E1M1')
+    lumps = [ 'THINGS', 'LINEDEFS', 'SIDEDEFS', 'VERTEXES', 'SEGS', 'SSECTORS', 'BSP', 'SECTORS', 'REJECT', 'BLOCKMAP' ]
+    assert not any(decoded(m, attr) for attr in lumps)
+    assert len(m.LINEDEFS) > 0
+    assert [ attr for attr in lumps if decoded(m, attr) ] == [ 'LINEDEFS' ]
+    # NODES fills both the raw records and the flat tree
+    m.BSP
+    assert decoded(m, 'NODE_ARRAY')
+    m.preload()
+    assert all(decoded(m, attr) for attr in lumps + [ 'SSECTOR_SECTORS', 'GEOMETRY' ])
+    with pytest.raises(AttributeError):
+        m.NOTALUMP
+
+def test_missing_lumps(make_wad):
+    m = synthetic_map('E1M1', 3, 2, 128)
+    full = make_wad(m).load_map('E1M1')
+    loaded = make_wad(without(m, 'REJECT', 'BLOCKMAP', 'SEGS', 'SSECTORS', 'NODES'), name='BARE.WAD').load_map('E1M1')
+    # no REJECT rejects nothing, no BLOCKMAP is None
+    assert loaded.REJECT.can_see(0, len(loaded.SECTORS) - 1)
+    assert loaded.BLOCKMAP is None
+    # no nodes get built from the linedefs
+    assert len(loaded.SSECTORS) > 0
+    xs, ys = np.array([ 10, 200, 370 ]), np.array([ 10, 200, 100 ])
+    assert np.array_equal(full.SSECTOR_SECTORS[full.BSP.locate_many(xs, ys)],
+                          loaded.SSECTOR_SECTORS[loaded.BSP.locate_many(xs, ys)])
+    bare = make_wad(without(m, 'SECTORS'), name='NOSECTORS.WAD').load_map('E1M1')
+    with pytest.raises(AttributeError):
+        bare.SECTORS
+
+def test_maps_outlive_the_wad(make_wad, tmp_path):
+    m = synthetic_map('E1M1', 3, 2, 128, seed=2)
+    still_open = make_wad(m).load_map('E1M1').preload()
+    filename = str(tmp_path / 'CLOSED.WAD')
+    write_wad(filename, [ m ])
+    with WADFile(filename) as wad:
+        loaded = wad.load_map('E1M1')
+        lines = loaded.LINEDEFS
+        entries = wad.LUMPS.map_entries('E1M1')
+    # whatever wasn't decoded before the WAD closed still is afterwards
+    assert loaded.LINEDEFS is lines
+    loaded.preload()
+    for lump, array in still_open.arrays().items():
+        assert np.array_equal(loaded.arrays()[lump], array)
+    assert np.array_equal(loaded.BSP.CHILDREN, still_open.BSP.CHILDREN)
+    assert loaded.REJECT.can_see(0, 1) == still_open.REJECT.can_see(0, 1)
+    # anything still reading from the file itself gets told it's closed
+    with pytest.raises(ValueError, match='closed'):
+        wad.get_lump_named('THINGS')
+    by_hand = WADMap('E1M1')
+    by_hand.load(wad, entries)
+    with pytest.raises(ValueError, match='closed'):
+        by_hand.SECTORS
+    wad.close()
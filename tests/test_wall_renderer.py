@@ -0,0 +1,90 @@
+import numpy as np
+from constants import DOOM_W, DOOM_H
+from synthwad import synthetic_map
+from wall_renderer import wall_renderer, project_seg, NEAR_Z, SOLID_LEFT, SOLID_RIGHT, VIEWHEIGHT
+
+def render(m, x, y, angle, early_out=True):
+    walls = wall_renderer(m)
+    walls.FRAMEBUFFER.fill(255)
+    walk = m.BSP.front_to_back(x, y, done=walls.screen_full if early_out else None)
+    return walls, walls.render(walk, x, y, angle)
+
+def test_closed_room_fills_the_screen(make_wad):
+    room = make_wad(synthetic_map('E1M1', 1, 1, 256)).load_map('E1M1')
+    for angle in (0, 45, 90, 200, 333):
+        walls, framebuffer = render(room, 100, 140, angle)
+        assert walls.screen_full()
+        # no pixel left as it was, and a wall in every one of the columns
+        assert not (framebuffer == 255).any()
+        assert (framebuffer < 128).any(axis=1).sum() == DOOM_W
+
+def test_screen_full_stops_the_walk(make_wad):
+    closed = make_wad(synthetic_map('E1M1', 3, 3, 256, wall_chance=1.0)).load_map('E1M1')
+    walls, framebuffer = render(closed, 384, 384, 30)
+    # the middle room is walled in, nothing past it is walked
+    assert walls.subsectors == 1
+    # facing north east, only the east and north walls are in view
+    assert walls.segs == 2
+    everything, all_walked = render(closed, 384, 384, 30, early_out=False)
+    assert everything.subsectors == 9
+    assert np.array_equal(framebuffer, all_walked)
+
+def test_solid_list_merging(grid_map):
+    walls = wall_renderer(grid_map)
+    clip = walls._wall_renderer__clip_solid
+    walls._wall_renderer__solid = [ SOLID_LEFT, SOLID_RIGHT ]
+    def solid():
+        return walls._wall_renderer__solid[1:-1]
+    assert clip(10, 20) == [ (10, 20) ] and solid() == [ (10, 20) ]
+    # touching spans join up
+    assert clip(21, 30) == [ (21, 30) ] and solid() == [ (10, 30) ]
+    # overlapping ones only draw the new part
+    assert clip(25, 40) == [ (31, 40) ] and solid() == [ (10, 40) ]
+    assert clip(50, 60) == [ (50, 60) ] and solid() == [ (10, 40), (50, 60) ]
+    assert clip(12, 38) == [] and solid() == [ (10, 40), (50, 60) ]
+    # filling the gap merges both sides
+    assert clip(35, 55) == [ (41, 49) ] and solid() == [ (10, 60) ]
+    assert not walls.screen_full()
+    assert clip(0, DOOM_W - 1) == [ (0, 9), (61, DOOM_W - 1) ]
+    assert walls.screen_full()
+
+def test_window_narrows_the_clip_arrays(grid_map):
+    walls = wall_renderer(grid_map)
+    ceiling_clip, floor_clip = walls._wall_renderer__ceiling_clip, walls._wall_renderer__floor_clip
+    ceiling_clip.fill(-1)
+    floor_clip.fill(DOOM_H)
+    project = walls._wall_renderer__project
+    draw_window = walls._wall_renderer__draw_window
+    # a wall straight across the view 100 units away, front sector 0..128
+    eye = VIEWHEIGHT
+    wall = (0.0, 1 / 100, float(DOOM_W), 1 / 100, 0, 128, 160, eye)
+    def row(height):
+        return int(project(height, eye, np.array([ 1 / 100 ]))[0])
+    # the sector behind is 24..96: an upper and a lower wall, the opening between
+    draw_window(100, 199, wall, 24, 96)
+    assert (ceiling_clip[100:200] == row(96) - 1).all() and (floor_clip[100:200] == row(24)).all()
+    # the columns either side are untouched
+    assert ceiling_clip[99] == -1 and floor_clip[200] == DOOM_H
+    # a bigger opening further on can't widen it again, a smaller one narrows it
+    draw_window(100, 199, wall, 0, 128)
+    assert (ceiling_clip[100:200] == row(96) - 1).all() and (floor_clip[100:200] == row(24)).all()
+    draw_window(150, 159, wall, 48, 64)
+    assert (ceiling_clip[150:160] == row(64) - 1).all() and (floor_clip[150:160] == row(48)).all()
+    assert (ceiling_clip[100:150] == row(96) - 1).all()
+    # shut completely, the arrays meet and nothing more can be drawn there
+    draw_window(160, 169, wall, 64, 64)
+    assert (ceiling_clip[160:170] >= floor_clip[160:170] - 1).all()
+
+def test_project_seg():
+    focal = DOOM_W / 2
+    # straight ahead, 90 degrees across, columns whose centres are inside
+    assert project_seg(100, -50, 100, 50, focal) == (80.0, 100, 240.0, 100, 80, 239)
+    # from behind, and behind the viewer
+    assert project_seg(100, 50, 100, -50, focal) is None
+    assert project_seg(-5, -50, 0.5, 50, focal) is None
+    # one end behind the near plane is clipped to it
+    sx1, z1, sx2, z2, x1, x2 = project_seg(-10, -20, 20, 10, focal)
+    assert z1 == NEAR_Z and sx1 < 0 and x1 == 0
+    assert (sx2, z2, x2) == (240.0, 20, 239)
+    # off the side of the screen
+    assert project_seg(10, 100, 10, 200, focal) is None
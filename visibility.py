@@ -0,0 +1,276 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from constants import DOOM_W, FOV
+from datatypes import NF_SUBSECTOR, FRONT, BACK
+from helper_routines import degs_to_bams, fine_sines, fine_cosines, deg_to_bam, fine_sine, fine_cosine, fine_tangent
+from wall_renderer import project_seg
+
+# headless "what can be seen from here" for whole batches of viewpoints, no
+# screen or player needed. by default the answer is what the renderers walk
+# would hand out: every subsector whose path down the BSP only goes through
+# child boxes in the view wedge (or on the near side), cut down to the PVS of
+# the viewpoints subsector when there is one. the PVS is checked per subsector
+# so this can come out a little tighter than the walk, which only uses it to
+# skip whole subtrees. it's worked out for a block of viewpoints at a time, one
+# numpy pass per BSP level.
+#
+# with occlusion=True every viewpoint also gets the walls treatment: segs are
+# projected into DOOM_W columns front to back and solid walls close columns
+# off, the walk stopping once they're all closed. that's a python loop per
+# viewpoint, which is what the process pool is for.
+#
+#   batch = map.visibility(xs, ys, angles)
+#   batch.subsectors(0)                 index array for the first viewpoint
+#   batch.SUBSECTORS                    (viewpoints, bytes) np.packbits rows
+#   batch.viewpoints_per_second()
+
+# (viewpoints x child boxes) cells worked on at once
+CHUNK = 1 << 22
+# viewpoints per pool task
+TASK_SIZE = 1024
+
+class visibility_batch:
+    # the answers for a batch of viewpoints as packed bit rows, SEGS is only
+    # there when occlusion was asked for
+    __slots__ = [ 'SUBSECTORS', 'SEGS', 'NUM_SUBSECTORS', 'NUM_SEGS', 'seconds' ]
+
+    def __init__(self, subsectors, segs, num_subsectors, num_segs, seconds=0.0):
+        self.SUBSECTORS = subsectors
+        self.SEGS = segs
+        self.NUM_SUBSECTORS = num_subsectors
+        self.NUM_SEGS = num_segs
+        self.seconds = seconds
+
+    def __len__(self):
+        return len(self.SUBSECTORS)
+
+    def __str__(self):
+        return f'visibility_batch({len(self)} viewpoints, {self.viewpoints_per_second():.0f}/s)'
+
+    def viewpoints_per_second(self):
+        return len(self) / self.seconds if self.seconds > 0 else 0.0
+
+    def subsector_mask(self, viewpoint):
+        return np.unpackbits(self.SUBSECTORS[viewpoint], count=self.NUM_SUBSECTORS).astype(bool)
+
+    def subsectors(self, viewpoint):
+        return np.flatnonzero(self.subsector_mask(viewpoint))
+
+    def segs(self, viewpoint):
+        if self.SEGS is None:
+            return None
+        return np.flatnonzero(np.unpackbits(self.SEGS[viewpoint], count=self.NUM_SEGS))
+
+class visibility_query:
+    # the read-only tables a query needs, pickled once to each pool worker
+    __slots__ = [ 'BSP', 'PVS', 'FOV', 'NUM_SUBSECTORS', 'LEVELS', 'BOXES', 'VERTEXES', 'SEG_LINES', 'SEG_SOLID',
+                  'RANGES', '__focal' ]
+
+    def __init__(self, map, pvs=None, fov=FOV):
+        bsp = map.BSP
+        self.BSP = bsp
+        self.PVS = pvs
+        self.FOV = fov
+        self.NUM_SUBSECTORS = len(map.SSECTORS)
+        # nodes grouped by depth, parents always a level above their children
+        levels = []
+        frontier = [] if bsp.ROOT & NF_SUBSECTOR else [ bsp.ROOT ]
+        children = bsp.CHILDREN
+        while frontier:
+            levels.append(np.array(frontier, dtype=np.int64))
+            below = children[frontier].ravel()
+            frontier = below[(below & NF_SUBSECTOR) == 0].tolist()
+        self.LEVELS = levels
+        # child boxes as (nodes, 2) top, bottom, left, right each
+        self.BOXES = [ bsp.BBOXES[..., n].astype(np.float64) for n in range(4) ]
+        # what the occlusion pass needs
+        verts = map.VERTEXES.array
+        segs = map.SEGS.array
+        geometry = map.GEOMETRY
+        sectors = map.SECTORS.array
+        self.VERTEXES = np.stack([ verts['x'], verts['y'] ], axis=1).astype(np.float64)
+        self.SEG_LINES = np.stack([ segs['start'], segs['end'] ], axis=1).tolist()
+        # one-sided lines, and two-sided ones that are shut, close columns off
+        front, back = geometry.SEG_FRONT, geometry.SEG_BACK
+        floor, ceiling = sectors['floor'].astype(np.int64), sectors['ceiling'].astype(np.int64)
+        closed = np.zeros(len(front), dtype=bool)
+        two = (front >= 0) & (back >= 0)
+        closed[two] = (ceiling[back[two]] <= floor[front[two]]) | (floor[back[two]] >= ceiling[front[two]])
+        self.SEG_SOLID = ((back < 0) | closed).tolist()
+        self.RANGES = geometry.SSECTOR_RANGES.tolist()
+        self.__focal = (DOOM_W / 2) / fine_tangent(deg_to_bam(fov / 2))
+
+    def child_visibility(self, xs, ys, angles):
+        # (viewpoints, nodes, 2) True where the renderers walk would go into
+        # that child: the near side always, the far side when its box isn't
+        # entirely outside one edge of the view wedge
+        left, right = degs_to_bams(angles + self.FOV / 2), degs_to_bams(angles - self.FOV / 2)
+        lx, ly = fine_cosines(left)[:, None, None], fine_sines(left)[:, None, None]
+        rx, ry = fine_cosines(right)[:, None, None], fine_sines(right)[:, None, None]
+        x, y = xs[:, None, None], ys[:, None, None]
+        top, bottom, lo_x, hi_x = self.BOXES
+        # the edge tests are linear in the corner, so the corner that decides
+        # each one can be picked per viewpoint instead of trying all four
+        out_left = lx * (np.where(lx > 0, bottom, top) - y) - ly * (np.where(ly > 0, hi_x, lo_x) - x) > 0
+        out_right = rx * (np.where(rx > 0, top, bottom) - y) - ry * (np.where(ry > 0, lo_x, hi_x) - x) < 0
+        visible = ~(out_left | out_right)
+        part = self.BSP.PARTITIONS
+        front = (xs[:, None] - part[:, 0]) * part[:, 3] - (ys[:, None] - part[:, 1]) * part[:, 2] > 0
+        # the near side is front when the viewpoint is in front
+        visible[:, :, FRONT] |= front
+        visible[:, :, BACK] |= ~front
+        return visible
+
+    def subsector_masks(self, xs, ys, angles):
+        # (viewpoints, subsectors) bool, the walk without any occlusion
+        xs, ys, angles = [ np.asarray(v, dtype=np.float64).ravel() for v in (xs, ys, angles) ]
+        count = len(xs)
+        rv = np.zeros((count, self.NUM_SUBSECTORS), dtype=bool)
+        bsp = self.BSP
+        if bsp.ROOT & NF_SUBSECTOR:
+            rv[:, bsp.ROOT & ~NF_SUBSECTOR] = True
+            return rv
+        step = max(1, CHUNK // max(len(bsp) * 2, 1))
+        children = bsp.CHILDREN
+        for lo in range(0, count, step):
+            hi = min(lo + step, count)
+            passes = self.child_visibility(xs[lo:hi], ys[lo:hi], angles[lo:hi])
+            reached = np.zeros((hi - lo, len(bsp)), dtype=bool)
+            reached[:, bsp.ROOT] = True
+            for level in self.LEVELS:
+                for side in (FRONT, BACK):
+                    child = children[level, side]
+                    ok = reached[:, level] & passes[:, level, side]
+                    leaf = (child & NF_SUBSECTOR) != 0
+                    rv[lo:hi, child[leaf] & ~NF_SUBSECTOR] = ok[:, leaf]
+                    reached[:, child[~leaf]] = ok[:, ~leaf]
+        return rv
+
+    def walk(self, xs, ys, angles):
+        # packed subsector rows for a block of viewpoints, PVS applied
+        xs, ys, angles = [ np.asarray(v, dtype=np.float64).ravel() for v in (xs, ys, angles) ]
+        rows = np.packbits(self.subsector_masks(xs, ys, angles), axis=1)
+        if self.PVS is not None and len(xs):
+            rows &= self.PVS.BITS[self.BSP.locate_many(xs, ys)]
+        return rows
+
+    def occluded(self, xs, ys, angles):
+        # (packed subsector rows, packed seg rows) with the walls in the way
+        # taken into account, one viewpoint at a time
+        xs, ys, angles = [ np.asarray(v, dtype=np.float64).ravel() for v in (xs, ys, angles) ]
+        count = len(xs)
+        num_segs = len(self.SEG_LINES)
+        subsectors = np.zeros((count, self.NUM_SUBSECTORS), dtype=bool)
+        segs = np.zeros((count, num_segs), dtype=bool)
+        step = max(1, CHUNK // max(len(self.BSP) * 2, 1))
+        for lo in range(0, count, step):
+            hi = min(lo + step, count)
+            passes = self.child_visibility(xs[lo:hi], ys[lo:hi], angles[lo:hi])
+            if self.PVS is not None:
+                located = self.BSP.locate_many(xs[lo:hi], ys[lo:hi])
+            for n in range(hi - lo):
+                allowed = passes[n]
+                if self.PVS is not None:
+                    allowed = allowed & self.PVS.bsp_visibility(self.BSP, located[n])
+                self.__occlude(xs[lo + n], ys[lo + n], angles[lo + n], allowed.tolist(), subsectors[lo + n], segs[lo + n])
+        return np.packbits(subsectors, axis=1), np.packbits(segs, axis=1)
+
+    def __occlude(self, x, y, angle, allowed, ss_row, seg_row):
+        bam = deg_to_bam(angle)
+        cos_a, sin_a = fine_cosine(bam), fine_sine(bam)
+        dx = self.VERTEXES[:, 0] - x
+        dy = self.VERTEXES[:, 1] - y
+        depth = (dx * cos_a + dy * sin_a).tolist()
+        side = (dx * sin_a - dy * cos_a).tolist()
+        focal = self.__focal
+        # open columns, kept as a bytearray so a span check is one slice
+        solid = bytearray(DOOM_W)
+        left = [ DOOM_W ]
+        lines, ranges, seg_solid = self.SEG_LINES, self.RANGES, self.SEG_SOLID
+        full = bytes([ 1 ]) * DOOM_W
+        def done():
+            return left[0] == 0
+        for ss in self.BSP.front_to_back(x, y, lambda node, s: allowed[node][s], done):
+            first, end = ranges[ss]
+            for seg in range(first, end):
+                a, b = lines[seg]
+                # the same columns the wall renderer would give the seg
+                projected = project_seg(depth[a], side[a], depth[b], side[b], focal)
+                if projected is None:
+                    continue
+                x1, x2 = projected[4:]
+                if solid[x1:x2 + 1] == full[x1:x2 + 1]:
+                    continue
+                seg_row[seg] = True
+                ss_row[ss] = True
+                if seg_solid[seg]:
+                    left[0] -= (x2 - x1 + 1) - solid[x1:x2 + 1].count(1)
+                    solid[x1:x2 + 1] = full[x1:x2 + 1]
+        return ss_row, seg_row
+
+# one query per pool worker, set up when the worker starts
+_worker_query = None
+
+def _start_worker(query):
+    global _worker_query
+    _worker_query = query
+
+def _worker_batch(xs, ys, angles, occlusion):
+    if occlusion:
+        return _worker_query.occluded(xs, ys, angles)
+    return _worker_query.walk(xs, ys, angles), None
+
+def batch_visibility(map, xs, ys, angles, pvs=None, occlusion=False, workers=None, fov=FOV, task_size=TASK_SIZE):
+    # visible subsectors (and segs with occlusion) from every (x, y, angle),
+    # angles in degrees with 0 east like the player. batches bigger than one
+    # task are spread over a process pool, each worker gets the query tables
+    # once when it starts and then only viewpoint arrays go back and forth
+    start = time.perf_counter()
+    xs, ys, angles = [ np.asarray(v, dtype=np.float64).ravel() for v in (xs, ys, angles) ]
+    if not len(xs) == len(ys) == len(angles):
+        raise ValueError('xs, ys and angles need one entry per viewpoint')
+    query = visibility_query(map, pvs, fov)
+    tasks = [ (xs[lo:lo + task_size], ys[lo:lo + task_size], angles[lo:lo + task_size], occlusion)
+              for lo in range(0, len(xs), task_size) ]
+    if workers == 1 or len(tasks) < 2:
+        _start_worker(query)
+        results = [ _worker_batch(*task) for task in tasks ]
+    else:
+        with ProcessPoolExecutor(workers or os.cpu_count(), initializer=_start_worker, initargs=(query,)) as pool:
+            results = list(pool.map(_worker_batch, *zip(*tasks)))
+    num_segs = len(query.SEG_LINES)
+    empty_ss = np.zeros((0, (query.NUM_SUBSECTORS + 7) // 8), dtype=np.uint8)
+    subsectors = np.concatenate([ r[0] for r in results ]) if results else empty_ss
+    segs = None
+    if occlusion:
+        segs = np.concatenate([ r[1] for r in results ]) if results else np.zeros((0, (num_segs + 7) // 8), dtype=np.uint8)
+    return visibility_batch(subsectors, segs, query.NUM_SUBSECTORS, num_segs, time.perf_counter() - start)
+
+if __name__ == '__main__':
+    import argparse
+    from wadfile import WADFile
+    from pvs import load_pvs
+    parser = argparse.ArgumentParser(description='visibility throughput from random viewpoints')
+    parser.add_argument('wad')
+    parser.add_argument('maps', nargs='*', help='default is every map in the WAD')
+    parser.add_argument('--viewpoints', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=None, help='default is one per CPU')
+    parser.add_argument('--occlusion', action='store_true', help='clip against the walls as well')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+    with WADFile(args.wad) as wad:
+        print(f'{"":<8}{"viewpoints":>11}{"pvs":>5}{"avg visible":>13}{"seconds":>9}{"viewpoints/s":>14}')
+        for name in args.maps or wad.map_markers():
+            m = wad.load_map(name)
+            x_min, x_max, y_min, y_max = m.get_map_bounds()
+            xs = rng.uniform(x_min, x_max, args.viewpoints)
+            ys = rng.uniform(y_min, y_max, args.viewpoints)
+            angles = rng.uniform(0, 360, args.viewpoints)
+            pvs = load_pvs(wad, name)
+            batch = m.visibility(xs, ys, angles, pvs, args.occlusion, args.workers)
+            visible = np.unpackbits(batch.SUBSECTORS, axis=1).sum() / max(len(batch), 1)
+            print(f'{name:<8}{len(batch):>11}{"yes" if pvs is not None else "no":>5}{visible:>13.1f}{batch.seconds:>9.2f}'
+                  f'{batch.viewpoints_per_second():>14.0f}')
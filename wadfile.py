@@ -1,71 +1,276 @@
 from data_readers import *
 import re
+import mmap
+import struct
+import weakref
 from pygame.math import Vector2 as vec2
 import json
 import math
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from helper_routines import *
-from datatypes import tree_node, tree, tree_data
+from datatypes import *
+from nodebuilder import build_nodes, SPLIT_WEIGHT, CANDIDATES
+from visibility import batch_visibility
+import numpy as np
 
 def to_radians(angle):
-    return bam16_to_rad(angle)
+    # a lumps 16 bit angle through the 32 bit BAM, 0 to 2 pi
+    return bam_to_rad(bam16_to_bam(angle))
+
+# on-disk header and directory layouts, the map lumps are in datatypes
+HEADER_RECORD = struct.Struct('<4sii')
+DIRECTORY_RECORD = struct.Struct('<ii8s')
+
+# the marker names the engine will actually warp to
+MAP_MARKER = re.compile(r'^(E[1-9]M[1-9]|MAP[0-9][0-9])$')
+
+MAP_LUMPS = ( 'THINGS', 'LINEDEFS', 'SIDEDEFS', 'VERTEXES', 'SEGS', 'SSECTORS', 'NODES', 'SECTORS', 'REJECT', 'BLOCKMAP' )
 
 class WADHeader:
     __slots__ = [ 'MAGIC', 'num_lumps', 'dir_offs' ]
 
-    def __init__(self, file):
-        self.MAGIC = "".join([chr(ord(x)) for x in read_4(file)])
-        self.num_lumps = read_int(file)
-        self.dir_offs = read_int(file)
+    def __init__(self, data):
+        magic, self.num_lumps, self.dir_offs = HEADER_RECORD.unpack_from(data, 0)
+        self.MAGIC = magic.decode('ascii', errors='replace')
 
     def __str__(self):
         return f'MAGIC: {self.MAGIC}\nNumber of Lumps: {self.num_lumps}\nDirectory Offset: 0x{self.dir_offs:08x}'
 
+# map attribute -> the lump it's decoded from
+LUMP_ATTRIBUTES = { 'THINGS': 'THINGS', 'LINEDEFS': 'LINEDEFS', 'SIDEDEFS': 'SIDEDEFS', 'VERTEXES': 'VERTEXES', 'SEGS': 'SEGS',
+                    'SSECTORS': 'SSECTORS', 'NODE_ARRAY': 'NODES', 'BSP': 'NODES', 'SECTORS': 'SECTORS', 'REJECT': 'REJECT',
+                    'BLOCKMAP': 'BLOCKMAP' }
+
+class detached_lumps:
+    # stands in for a WADFile that has been closed: a copy of the raw lumps a
+    # map hadn't decoded yet, taken just before the file went away
+    __slots__ = [ 'NAME', '__data' ]
+
+    def __init__(self, wad, entries):
+        self.NAME = wad.NAME
+        self.__data = { entry.name: bytes(wad.lump(entry)) for entry in entries }
+
+    def lump(self, entry):
+        return memoryview(self.__data[entry.name])
+
 class WADMap:
-    __slots__ = [ 'name', 'THINGS', 'LINEDEFS','SIDEDEFS','VERTEXES','SEGS','SSECTORS','NODES','SECTORS','REJECT','BLOCKMAP']
+    __slots__ = [ 'name', 'THINGS', 'LINEDEFS','SIDEDEFS','VERTEXES','SEGS','SSECTORS','NODE_ARRAY','SECTORS','REJECT','BLOCKMAP', 'BSP', 'SSECTOR_SECTORS',
+                  'GEOMETRY', '__tree', '__bounds', '__wad', '__entries', '__weakref__' ]
 
     def __init__(self, name):
         self.name = name
+        self.__tree = None
+        self.__bounds = None
+        # where each not yet decoded lump lives, see load()
+        self.__wad = None
+        self.__entries = {}
+
+    def __getattr__(self, attr):
+        # only reached for slots that haven't been filled, which means a lump
+        # nobody has asked for yet. decode it now and keep it
+        if attr == 'SSECTOR_SECTORS':
+            self.SSECTOR_SECTORS = self.__resolve_subsector_sectors()
+            return self.SSECTOR_SECTORS
+        if attr == 'GEOMETRY':
+            self.GEOMETRY = map_geometry(self.VERTEXES.array, self.LINEDEFS.array, self.SIDEDEFS.array, self.SEGS.array,
+                                         self.SSECTORS.array, len(self.SECTORS))
+            return self.GEOMETRY
+        lump = LUMP_ATTRIBUTES.get(attr)
+        if lump is None or self.__wad is None:
+            raise AttributeError(f'{type(self).__name__} {self.name} has no {attr}')
+        entry = self.__entries.get(lump)
+        if entry is not None:
+            self.load_lump(self.__wad, entry)
+        elif lump == 'REJECT':
+            # plenty of maps ship without one, an empty table rejects nothing
+            self.REJECT = self.__load_reject(b'')
+        elif lump == 'BLOCKMAP':
+            self.BLOCKMAP = None
+        elif lump in ('SEGS', 'SSECTORS', 'NODES'):
+            # no nodes shipped, build some
+            self.rebuild_nodes()
+        else:
+            raise AttributeError(f'Map {self.name} has no {lump} lump')
+        return object.__getattribute__(self, attr)
+
+    @property
+    def NODES(self):
+        # the old tree_node tree, only built if something still asks for it.
+        # BSP has the same nodes as flat arrays
+        if self.__tree is None:
+            self.__tree = self.__build_tree(self.__load_nodes(self.NODE_ARRAY))
+        return self.__tree
+
+    @classmethod
+    def from_arrays(cls, name, arrays, bsp, reject, blockmap, ssector_sectors, bounds=None, geometry=None):
+        # put a map back together from already decoded arrays (the map cache)
+        m = cls(name)
+        m.THINGS = m.__things_view(arrays['THINGS'])
+        m.LINEDEFS = record_view(arrays['LINEDEFS'])
+        m.SIDEDEFS = m.__sidedefs_view(arrays['SIDEDEFS'])
+        m.VERTEXES = record_view(arrays['VERTEXES'], vec2)
+        m.SEGS = record_view(arrays['SEGS'])
+        m.SSECTORS = record_view(arrays['SSECTORS'])
+        m.NODE_ARRAY = arrays['NODES']
+        m.SECTORS = m.__sectors_view(arrays['SECTORS'])
+        m.BSP = bsp
+        m.REJECT = reject
+        m.BLOCKMAP = blockmap
+        m.SSECTOR_SECTORS = ssector_sectors
+        m.__bounds = bounds
+        if geometry is not None:
+            m.GEOMETRY = geometry
+        return m
+
+    def arrays(self):
+        # the decoded lumps by name, what from_arrays takes back
+        return { 'THINGS': self.THINGS.array, 'LINEDEFS': self.LINEDEFS.array, 'SIDEDEFS': self.SIDEDEFS.array,
+                 'VERTEXES': self.VERTEXES.array, 'SEGS': self.SEGS.array, 'SSECTORS': self.SSECTORS.array,
+                 'NODES': self.NODE_ARRAY, 'SECTORS': self.SECTORS.array }
+
+    def __reduce__(self):
+        # the lump arrays are views into an mmap, pickling copies them out so a
+        # map can come back from another process
+        return (WADMap.from_arrays, (self.name, self.arrays(), self.BSP, self.REJECT, self.BLOCKMAP, self.SSECTOR_SECTORS,
+                                     self.get_map_bounds(), self.GEOMETRY))
+
+    def summary(self):
+        # the handful of numbers the map stats tooling wants, small enough to
+        # send between processes
+        return {
+            'map': self.name, 'things': len(self.THINGS), 'linedefs': len(self.LINEDEFS), 'sidedefs': len(self.SIDEDEFS),
+            'vertexes': len(self.VERTEXES), 'segs': len(self.SEGS), 'subsectors': len(self.SSECTORS),
+            'nodes': len(self.BSP), 'sectors': len(self.SECTORS), 'bounds': self.get_map_bounds(),
+            'bsp_depth': self.BSP.depth()
+        }
 
     def __str__(self):
         return f'Map: {self.name}'
     
-    def load(self, file):
-        for c in range(0,10):
-            noffs = read_int(file)
-            nsz = read_int(file)
-            type = ''.join([ chr(a) for a in [ ord(b) for b in read_8(file) ] ])
-            offs = file.tell()
-            if type == 'THINGS':
-                self.THINGS = self.__load_things(file, noffs, nsz)
-                file.seek(offs)
-            elif type == 'LINEDEFS':
-                self.LINEDEFS = self.__load_linedefs(file, noffs, nsz)
-                file.seek(offs)
-            elif type == 'SIDEDEFS':
-                self.SIDEDEFS = self.__load_sidedefs(file, noffs, nsz)
-                file.seek(offs)
-            elif type == 'VERTEXES':
-                self.VERTEXES = self.__load_vertexes(file, noffs, nsz)
-                file.seek(offs)
-            elif type == 'SEGS':
-                self.SEGS = self.__load_segs(file, noffs, nsz)
-                file.seek(offs)
-            elif type == 'SSECTORS':
-                self.SSECTORS = self.__load_ssectors(file, noffs, nsz)
-                file.seek(offs)
-            elif type == 'NODES':
-                raw_data = self.__load_nodes(file, noffs, nsz)
-                self.NODES = self.__build_tree(raw_data)
-                file.seek(offs)
-            elif type == 'SECTORS':
-                self.SECTORS = self.__load_sectors(file, noffs, nsz)
-                file.seek(offs)
-            elif type == 'REJECT':
-                self.REJECT = self.__load_reject(file, noffs, nsz)
-                file.seek(offs)
-            elif type == 'BLOCKMAP':
-                self.BLOCKMAP = self.__load_blockmap(file, noffs, nsz)
-                file.seek(offs)
+    def load(self, wad, entries):
+        # entries are the directory entries following the map marker. nothing
+        # is decoded here, each lump comes straight out of the WADs memory-map
+        # the first time its attribute is used. closing the WAD detaches the
+        # map, see detach()
+        self.__wad = wad
+        self.__entries = { entry.name: entry for entry in entries }
+
+    def detach(self):
+        # copy the lumps nobody has asked for yet out of the WAD, which is
+        # about to close. they still decode on first use, from the copies
+        if self.__wad is None or isinstance(self.__wad, detached_lumps):
+            return self
+        decoded = { lump for attr, lump in LUMP_ATTRIBUTES.items() if self.__is_set(attr) }
+        self.__wad = detached_lumps(self.__wad, [ entry for name, entry in self.__entries.items() if name not in decoded ])
+        return self
+
+    def __is_set(self, attr):
+        # without going through __getattr__, which would decode it
+        try:
+            object.__getattribute__(self, attr)
+            return True
+        except AttributeError:
+            return False
+
+    def preload(self, *lumps):
+        # decode the named lumps now (all of them and the derived tables when
+        # none are named) for callers that can't take the hit mid-frame
+        for lump in lumps or MAP_LUMPS:
+            getattr(self, 'BSP' if lump == 'NODES' else lump)
+        if not lumps:
+            self.SSECTOR_SECTORS
+            self.GEOMETRY
+        return self
+
+    def rebuild_nodes(self, split_weight=SPLIT_WEIGHT, candidates=CANDIDATES):
+        # throw away SEGS, SSECTORS and NODES and build new ones from the
+        # linedefs, VERTEXES gains whatever points the splits needed. the
+        # tables derived from the old ones are rebuilt on next use
+        vertexes, segs, ssectors, nodes = build_nodes(self.VERTEXES.array, self.LINEDEFS.array, self.SIDEDEFS.array,
+                                                      split_weight, candidates)
+        self.VERTEXES = record_view(vertexes, vec2)
+        self.SEGS = record_view(segs)
+        self.SSECTORS = record_view(ssectors)
+        self.NODE_ARRAY = nodes
+        self.BSP = flat_bsp(nodes)
+        self.__tree = None
+        self.__bounds = None
+        for derived in ('SSECTOR_SECTORS', 'GEOMETRY'):
+            try:
+                delattr(self, derived)
+            except AttributeError:
+                # never built
+                pass
+        return self
+
+    def load_lump(self, wad, entry):
+        # decode a single map lump
+        data = wad.lump(entry)
+        type = entry.name
+        if type == 'THINGS':
+            self.THINGS = self.__load_things(data)
+        elif type == 'LINEDEFS':
+            self.LINEDEFS = self.__load_linedefs(data)
+        elif type == 'SIDEDEFS':
+            self.SIDEDEFS = self.__load_sidedefs(data)
+        elif type == 'VERTEXES':
+            self.VERTEXES = self.__load_vertexes(data)
+        elif type == 'SEGS':
+            self.SEGS = self.__load_segs(data)
+        elif type == 'SSECTORS':
+            self.SSECTORS = self.__load_ssectors(data)
+        elif type == 'NODES':
+            num_subsectors = len(self.SSECTORS)
+            self.NODE_ARRAY = self.__load_array(data, NODE_DTYPE)
+            self.BSP = flat_bsp(self.NODE_ARRAY)
+            self.__tree = None
+            if not self.BSP.is_valid(num_subsectors):
+                # children out of range would break locate, a cycle would walk forever
+                print(f'Map {self.name} has a broken NODES lump, rebuilding the nodes')
+                self.rebuild_nodes()
+        elif type == 'SECTORS':
+            self.SECTORS = self.__load_sectors(data)
+        elif type == 'REJECT':
+            self.REJECT = self.__load_reject(data)
+        elif type == 'BLOCKMAP':
+            self.BLOCKMAP = self.__load_blockmap(data)
+
+    def __resolve_subsector_sectors(self):
+        # a subsectors sector is the one on the facing side of its first segs
+        # linedef, SSECTORS -> SEGS -> LINEDEFS -> SIDEDEFS -> sector for every
+        # subsector at once. anything that doesn't resolve is -1
+        segs, linedefs, sidedefs = self.SEGS.array, self.LINEDEFS.array, self.SIDEDEFS.array
+        first = self.SSECTORS.array['first'].astype(np.int64)
+        rv = np.full(len(first), -1, dtype=np.int32)
+        ok = first < len(segs)
+        seg = segs[first[ok]]
+        ld = seg['linedef'].astype(np.int64)
+        good = ld < len(linedefs)
+        side = np.full(len(ld), -1, dtype=np.int64)
+        side[good] = np.where(seg['direction'][good] == 0, linedefs['front'][ld[good]], linedefs['back'][ld[good]])
+        good &= (side >= 0) & (side < len(sidedefs))
+        sectors = np.full(len(ld), -1, dtype=np.int32)
+        sectors[good] = sidedefs['sector'][side[good]]
+        rv[ok] = sectors
+        return rv
+
+    def locate(self, x, y):
+        # (subsector, sector) holding the point
+        ss = self.BSP.locate(x, y)
+        return ss, int(self.SSECTOR_SECTORS[ss])
+
+    def locate_many(self, xs, ys):
+        # (subsectors, sectors) arrays for a whole batch of points
+        ss = self.BSP.locate_many(xs, ys)
+        return ss, self.SSECTOR_SECTORS[ss]
+
+    def locator(self):
+        # a caching locator for one caller (the player, a monster...)
+        return point_locator(self.BSP, self.SSECTOR_SECTORS)
+
+    def visibility(self, xs, ys, angles, pvs=None, occlusion=False, workers=None):
+        # what can be seen from a whole batch of viewpoints, see visibility.py
+        return batch_visibility(self, xs, ys, angles, pvs, occlusion, workers)
 
     def __build_tree(self, nodemap):
         tree_ = tree()
@@ -95,200 +300,130 @@ class WADMap:
     def __subsector_node(self, parent, index):
         return self.SSECTORS[index]
     
-    def __load_things(self, file, offset, size):
-        num_things = size // 10 # five shorts
-        file.seek(offset)
-        rv = []
-        for th in range(0,num_things):
-            pos = vec2(read_short(file), read_short(file))
-            facing = read_short(file)
-            type = read_short(file)
-            flags = read_short(file)
-            rv.append((pos,facing,type,flags))
-        return rv
+    def __load_array(self, data, dtype):
+        # one shot decode, the array is a view straight onto the lump
+        count = len(data) // dtype.itemsize
+        return np.frombuffer(data, dtype=dtype, count=count)
 
-    def __load_linedefs(self, file, offset, size):
-        num_defs = size // 14 ## each entry is 7 shorts
-        file.seek(offset)
-        rv = []
-        for ld in range(0,num_defs):
-            start = read_short(file)
-            end = read_short(file)
-            flags = read_short(file)
-            special = read_short(file)
-            sector = read_short(file)
-            front = read_short(file)
-            back = read_short(file)
-            rv.append((start,end,flags,special,sector,front,back))
-        return rv
+    def __load_things(self, data):
+        return self.__things_view(self.__load_array(data, THING_DTYPE))
 
-    def __load_sidedefs(self, file, offset, size):
-        num_defs = size // 30 # three 8-character names, 3 shorts
-        file.seek(offset)
-        rv = []
-        for sd in range(0,num_defs):
-            x_off = read_short(file)
-            y_off = read_short(file)
-            upper_name = ''.join([ chr(x) for x in [ ord(y) for y in read_8(file)]])
-            lower_name = ''.join([ chr(x) for x in [ ord(y) for y in read_8(file)]])
-            middle_name = ''.join([ chr(x) for x in [ ord(y) for y in read_8(file)]])
-            sector = read_short(file)
-            rv.append( (x_off, y_off, upper_name, lower_name, middle_name, sector) )
-        return rv
+    def __things_view(self, array):
+        return record_view(array, lambda x, y, facing, type, flags: (vec2(x, y), facing, type, flags))
 
-    def __load_vertexes(self, file, offset, size):
-        file.seek(offset)
-        numverts = size // 4 # each vertex is a pair of signed 16 bit ints
-        rv = []
-        for v in range(0,numverts):
-            x = read_short(file)
-            y = read_short(file)
-            rv.append(vec2(x,y))
-        return rv
+    def __load_linedefs(self, data):
+        # start, end, flags, special, sector, front, back
+        return record_view(self.__load_array(data, LINEDEF_DTYPE))
 
-    def __load_segs(self, file, offset, size):
-        file.seek(offset)
-        num_segs = size // 12 # 6 shorts
-        rv = []
-        for seg in range(0,num_segs):
-            start = read_short(file)
-            end = read_short(file)
-            angle = read_short(file)
-            linedef = read_short(file)
-            direction = read_short(file)
-            offset_distance = read_short(file)
-            rv.append((start,end,angle,linedef,direction,offset_distance))
-        return rv
+    def __load_sidedefs(self, data):
+        return self.__sidedefs_view(self.__load_array(data, SIDEDEF_DTYPE))
 
-    def __load_ssectors(self, file, offset, size):
-        num_subsectors = size // 4
-        rv = []
-        file.seek(offset)
-        for subs in range(0,num_subsectors):
-            seg_count = read_short(file)
-            first_seg = read_short(file)
-            rv.append((seg_count, first_seg))
-        return rv
+    def __sidedefs_view(self, array):
+        # x_off, y_off, upper_name, lower_name, middle_name, sector
+        return record_view(array,
+                           lambda x_off, y_off, upper, lower, middle, sector: (x_off, y_off, name_from_bytes(upper),
+                               name_from_bytes(lower), name_from_bytes(middle), sector))
+
+    def __load_vertexes(self, data):
+        return record_view(self.__load_array(data, VERTEX_DTYPE), vec2)
 
-    def __load_nodes(self, file, offset, size):
-        file.seek(offset)
+    def __load_segs(self, data):
+        # start, end, angle, linedef, direction, offset_distance
+        return record_view(self.__load_array(data, SEG_DTYPE))
+
+    def __load_ssectors(self, data):
+        # seg_count, first_seg
+        return record_view(self.__load_array(data, SSECTOR_DTYPE))
+
+    def __load_nodes(self, nodes):
         rv = []
-        while file.tell() < offset+size:
-            x_start = read_short(file)
-            y_start = read_short(file)
-            x_diff = read_short(file)
-            y_diff = read_short(file)
-            rbt = read_short(file)
-            rbb = read_short(file)
-            rbl = read_short(file)
-            rbr = read_short(file)
+        for x_start, y_start, x_diff, y_diff, rbox, lbox, right_child, left_child in nodes.tolist():
+            rbt, rbb, rbl, rbr = rbox
+            lbt, lbb, lbl, lbr = lbox
             right_box = (vec2(rbl,rbt),vec2(rbr,rbb))
-            lbt = read_short(file)
-            lbb = read_short(file)
-            lbl = read_short(file)
-            lbr = read_short(file)
             left_box = (vec2(lbl,lbt),vec2(lbr,lbb))
-            right_child = read_unsigned_short(file)
-            left_child = read_unsigned_short(file)
             rv.append((x_start,y_start,x_diff,y_diff,right_box, left_box, right_child, left_child))
         return rv
 
-    def __load_sectors(self, file, offset, size):
-        num_sectors = size // 26
-        file.seek(offset)
-        rv = []
-        for sector in range(0,num_sectors):
-            floor = read_short(file)
-            ceiling = read_short(file)
-            floor_tex = ''.join([ chr(x) for x in [ ord(y) for y in read_8(file)]])
-            ceiling_tex = ''.join([ chr(x) for x in [ ord(y) for y in read_8(file)]])
-            light = read_short(file)
-            special = read_short(file)
-            tag = read_short(file)
-            rv.append((floor, ceiling, floor_tex, ceiling_tex, light, special, tag))
-        return rv
+    def __load_sectors(self, data):
+        return self.__sectors_view(self.__load_array(data, SECTOR_DTYPE))
 
-    def __load_reject(self, file, offset, size):
-        pass
-        # # size is a bit tetchy, each entry is 4 bytes long, but this thing is _special_
-        # # for now... lets load it the special way...
-        # # in fact, this whole thing is rather tetchy and works for special purposes
-        # # each bit of the bytes read maps into a 5x5 grid 
-        # rv = []
-        # end = offset+size
-        # file.seek(offset)
-        # while file.tell() < end:
-        #     r = []
-        #     r.append(read_unsigned_byte(file))
-        #     r.append(read_unsigned_byte(file))
-        #     r.append(read_unsigned_byte(file))
-        #     r.append(read_unsigned_byte(file))
-        #     rv.append(r)
-        # return rv
-
-    def __load_blockmap(self, file, offset, size):
-        pass
-        # # this this is even worse than the f*cking POS REJECTS
-        # rv = { 'HEADER': {}, 'MAP': [] }
-        # end = offset+size
-        # file.seek(offset)
-        # # read the header
-        # rv['HEADER']['X_GRID'] = read_short(file)
-        # rv['HEADER']['Y_GRID'] = read_short(file)
-        # rv['HEADER']['NUM_COLS'] = read_short(file)
-        # rv['HEADER']['NUM_ROWS'] = read_short(file)
-        # bc = rv['HEADER']['NUM_COLS'] * rv['HEADER']['NUM_ROWS']
-        # offsets = []
-        # for bln in range(0,bc):
-        #     offsets.append(read_short(file)*2)
-        # for offs in offsets:
-        #     mv = []
-        #     file.seek(offset) # reset to the start of the blockmap
-        #     file.seek(offs, 1) # seek to the start of the map data for this block
-        #     v = read_short(file)
-        #     while v != 0xFFFF and file.tell() < (offset+size):
-        #         mv.append(v)
-        #         if file.tell() < (offset+size):
-        #             v = read_short(file)
-        #         else:
-        #             break
-        #     rv['MAP'].append(mv)
-        # return rv
+    def __sectors_view(self, array):
+        # floor, ceiling, floor_tex, ceiling_tex, light, special, tag
+        return record_view(array,
+                           lambda floor, ceiling, floor_tex, ceiling_tex, light, special, tag: (floor, ceiling,
+                               name_from_bytes(floor_tex), name_from_bytes(ceiling_tex), light, special, tag))
 
-    def get_map_bounds(self):
-        x_sorted = sorted(self.VERTEXES, key=lambda v: v.x)
-        x_min, x_max = x_sorted[0].x, x_sorted[-1].x
+    def __load_reject(self, data):
+        return reject_table(data, len(self.SECTORS))
 
-        y_sorted = sorted(self.VERTEXES, key=lambda v: v.y)
-        y_min, y_max = y_sorted[0].y, y_sorted[-1].y
+    def __load_blockmap(self, data):
+        return block_map(data)
 
-        return x_min, x_max, y_min, y_max
+    def get_map_bounds(self):
+        if self.__bounds is None:
+            verts = self.VERTEXES.array
+            self.__bounds = int(verts['x'].min()), int(verts['x'].max()), int(verts['y'].min()), int(verts['y'].max())
+        return self.__bounds
     
 class WADDirEntry:
-    __slots__ = [ 'offset', 'size', 'name', 'base_offset' ]
+    __slots__ = [ 'offset', 'size', 'name', 'base_offset', 'index', 'source' ]
 
-    def __init__(self, base, offs, sz, n):
+    def __init__(self, base, offs, sz, n, index=0, source=0):
         self.offset = offs
         self.size = sz
         self.name = n
         self.base_offset = base
+        # position in its own directory and which loaded WAD it lives in
+        self.index = index
+        self.source = source
 
     def __str__(self):
         return f'Name: {self.name}\nOffset: 0x{self.offset:08X}\nsize: {self.size/1024:2.02f}kb'
+
+# S_START/S_END, FF_START/FF_END, P1_START/P1_END and so on, the doubled letter
+# form is what PWADs use so they can add to the IWADs ranges
+NAMESPACE_MARKER = re.compile(r'^([SFP])\1?([0-9]?)_(START|END)$')
     
 class WADDir:
-    __slots__ = 'lumps'
-    def __init__(self, wad_header, file):
+    __slots__ = [ 'lumps', 'index', 'namespaces', 'maps' ]
+    def __init__(self, wad_header, data, source=0):
         self.lumps = []
-        file.seek(wad_header.dir_offs)
-        lcount = 0
-        while lcount < wad_header.num_lumps:
-            base_offs = file.tell()
-            offs = read_int(file)
-            size = read_int(file)
-            name = ''.join([ chr(a) for a in [ ord(b) for b in read_8(file) ] ])
-            self.lumps.append(WADDirEntry(base_offs, offs,size,name))
-            lcount += 1
+        base_offs = wad_header.dir_offs
+        for offs, size, name in iter_records(DIRECTORY_RECORD, data[base_offs:base_offs + wad_header.num_lumps * DIRECTORY_RECORD.size]):
+            self.lumps.append(WADDirEntry(base_offs, offs, size, name_from_bytes(name), len(self.lumps), source))
+            base_offs += DIRECTORY_RECORD.size
+        self.__build_index()
+
+    def __build_index(self):
+        # name -> entry, later lumps win like they do in the engine
+        self.index = {}
+        # namespace letter -> { name -> entry }
+        self.namespaces = { 'S': {}, 'F': {}, 'P': {} }
+        # map name -> the entries following its marker
+        self.maps = {}
+        namespace = None
+        lumps = self.lumps
+        for idx, entry in enumerate(lumps):
+            self.index[entry.name] = entry
+            marker = NAMESPACE_MARKER.match(entry.name)
+            if marker is not None:
+                # F1_START and friends are nested inside the outer range, only
+                # the plain markers open and close a namespace
+                if marker.group(2) == '':
+                    if marker.group(3) == 'START':
+                        namespace = marker.group(1)
+                    elif namespace == marker.group(1):
+                        namespace = None
+                continue
+            if namespace is not None:
+                self.namespaces[namespace][entry.name] = entry
+            elif idx + 1 < len(lumps) and lumps[idx + 1].name == 'THINGS':
+                # a map marker is whatever sits in front of a THINGS lump
+                end = idx + 1
+                while end < len(lumps) and lumps[end].name in MAP_LUMPS:
+                    end += 1
+                self.maps[entry.name] = lumps[idx + 1:end]
 
     def __str__(self):
         rv = [ "DIRECTORY" ]
@@ -296,32 +431,151 @@ class WADDir:
             rv.append(str(lump))
         return '\n'.join(rv)
         
-    def get_entry_named(self, name):
-        for l in self.lumps:
-            if l.name == name:
-                return l
-        return None
+    def get_entry_named(self, name, namespace=None):
+        if namespace is not None:
+            return self.namespaces[namespace].get(name)
+        return self.index.get(name)
+
+    def map_entries(self, mapname):
+        return self.maps.get(mapname)
+
+class WADLumpIndex:
+    # the resolution layer over every loaded WAD. directories are layered in load
+    # order so a PWAD overrides IWAD lumps, namespace entries and whole maps
+    __slots__ = [ 'directories', 'index', 'namespaces', 'maps' ]
+
+    def __init__(self):
+        self.directories = []
+        self.index = {}
+        self.namespaces = { 'S': {}, 'F': {}, 'P': {} }
+        self.maps = {}
+
+    def add(self, directory):
+        self.directories.append(directory)
+        self.index.update(directory.index)
+        for ns, entries in directory.namespaces.items():
+            self.namespaces[ns].update(entries)
+        self.maps.update(directory.maps)
+
+    def get_entry_named(self, name, namespace=None):
+        if namespace is not None:
+            return self.namespaces[namespace].get(name)
+        return self.index.get(name)
+
+    def map_entries(self, mapname):
+        return self.maps.get(mapname)
+
+    def map_names(self):
+        return list(self.maps.keys())
     
 class WADFile:
-    __slots__ = ['NAME', 'DIRECTORY', 'HEADER']
+    __slots__ = ['NAME', 'DIRECTORY', 'HEADER', 'DATA', 'LUMPS', 'PWADS', 'closed', '__mmaps', '__views', '__maps']
 
-    def __init__(self, filename):
+    def __init__(self, filename, *pwads):
         self.NAME = filename
+        self.PWADS = []
+        self.LUMPS = WADLumpIndex()
+        self.closed = False
+        self.__mmaps = []
+        self.__views = []
+        # every map loaded from here that's still around, they're detached
+        # from the file when it closes
+        self.__maps = weakref.WeakSet()
+        self.HEADER, self.DIRECTORY = self.__open(filename)
+        self.DATA = self.__views[0]
+        for pwad in pwads:
+            self.add_pwad(pwad)
+
+    def __open(self, filename):
+        # map the whole file once, everything after this is slicing
         with open(filename, 'rb') as f:
-            self.HEADER = WADHeader(f)
-            self.DIRECTORY = WADDir(self.HEADER,f)
-
-    def load_map(self, mapname):
-        with open(self.NAME, 'rb') as file:
-            m = WADMap(mapname)
-            d_ent = self.DIRECTORY.get_entry_named(mapname)
-            if d_ent is None:
-                print(f'Map {mapname} not found in WAD File {self.NAME}')
-                return
-            file.seek(d_ent.base_offset)
-            # the next few bits are a throw-away to clear the map-marker entry
-            a = read_int(file)
-            a = read_int(file)
-            a = read_8(file)
-            m.load(file)
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = memoryview(mm)
+        self.__mmaps.append(mm)
+        self.__views.append(data)
+        header = WADHeader(data)
+        directory = WADDir(header, data, len(self.__views) - 1)
+        self.LUMPS.add(directory)
+        return header, directory
+
+    def add_pwad(self, filename):
+        header, _ = self.__open(filename)
+        if header.MAGIC not in ('PWAD', 'IWAD'):
+            print(f'WAD File {filename} has unknown magic {header.MAGIC}')
+        self.PWADS.append(filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        for m in list(self.__maps):
+            m.detach()
+        self.__maps.clear()
+        self.closed = True
+        for data, mm in zip(self.__views, self.__mmaps):
+            data.release()
+            try:
+                mm.close()
+            except BufferError:
+                # someone is still holding a lump view, the mapping goes away with them
+                pass
+
+    def lump(self, entry):
+        if self.closed:
+            raise ValueError(f'WAD File {self.NAME} is closed')
+        return self.__views[entry.source][entry.offset:entry.offset + entry.size]
+
+    def get_lump_named(self, name, namespace=None):
+        entry = self.LUMPS.get_entry_named(name, namespace)
+        return None if entry is None else self.lump(entry)
+
+    def load_map(self, mapname, cache=None):
+        # cache is an optional map_cache.map_cache, maps come out of it when
+        # it has a fresh copy and go into it when it doesn't
+        if cache is not None:
+            return cache.load(self, mapname)
+        m = WADMap(mapname)
+        entries = self.LUMPS.map_entries(mapname)
+        if entries is None:
+            print(f'Map {mapname} not found in WAD File {self.NAME}')
+            return
+        m.load(self, entries)
+        self.__maps.add(m)
         return m
+
+    def map_markers(self):
+        # every ExMy and MAPxx map across the loaded WADs, in directory order
+        return [ name for name in self.LUMPS.map_names() if MAP_MARKER.match(name) ]
+
+    def load_maps(self, mapnames=None, workers=None, summary=False):
+        # load every map (or just mapnames) across a process pool, yielding
+        # (name, map) as each one finishes rather than in directory order. each
+        # worker maps the same files so the pages are shared, and with
+        # summary=True only WADMap.summary() comes back instead of the whole map
+        if mapnames is None:
+            mapnames = self.map_markers()
+        if workers == 1 or len(mapnames) < 2:
+            for name in mapnames:
+                m = self.load_map(name)
+                yield name, m.summary() if summary and m is not None else m
+            return
+        with ProcessPoolExecutor(workers, initializer=_open_worker_wad, initargs=(self.NAME, tuple(self.PWADS))) as pool:
+            pending = [ pool.submit(_load_worker_map, name, summary) for name in mapnames ]
+            for done in as_completed(pending):
+                yield done.result()
+
+# one WADFile per pool worker, opened once when the worker starts
+_worker_wad = None
+
+def _open_worker_wad(filename, pwads):
+    global _worker_wad
+    _worker_wad = WADFile(filename, *pwads)
+
+def _load_worker_map(mapname, summary):
+    m = _worker_wad.load_map(mapname)
+    return mapname, m.summary() if summary and m is not None else m
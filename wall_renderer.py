@@ -0,0 +1,252 @@
+import math
+import numpy as np
+from constants import DOOM_W, DOOM_H, FOV
+from helper_routines import deg_to_bam, fine_sine, fine_cosine, fine_tangent
+
+# first-person walls drawn a column at a time into a DOOM_W x DOOM_H palette
+# indexed framebuffer, the way the original renderer does it. subsectors come
+# in front to back, each seg is projected to a range of columns and clipped
+# against the solid wall list and the per column ceiling/floor clip arrays, so
+# every pixel is written once and the walk stops once the screen is covered.
+# the buffer is indexed [x, y] which is what pygame.surfarray wants and keeps a
+# column contiguous
+
+VIEWHEIGHT = 41
+NEAR_Z = 1.0
+# how quickly walls darken with distance, in light levels per map unit
+LIGHT_FALLOFF = 0.08
+# fake contrast, walls running north/south are a little brighter than ones
+# running east/west like in the engine
+FAKE_CONTRAST = 16
+
+# until the real PLAYPAL is around: a grey ramp for walls and a brown and a
+# blue ramp for floors and ceilings, all indexed by light level
+WALL_RAMP, FLOOR_RAMP, CEILING_RAMP = 0, 128, 192
+PALETTE = ([ (i * 2, i * 2, i * 2) for i in range(128) ] +
+           [ (i * 3, i * 2, i) for i in range(64) ] +
+           [ (i, i * 3 // 2, i * 3) for i in range(64) ])
+
+# sentinels either side of the screen so the clip list never runs out
+SOLID_LEFT = (-(1 << 30), -1)
+SOLID_RIGHT = (DOOM_W, 1 << 30)
+
+def project_seg(z1, s1, z2, s2, focal):
+    # a seg in view space (depth along the view, offset to the right of it)
+    # clipped to the near plane and projected, as the screen x and depth of
+    # each end and the first and last column whose centre falls inside it.
+    # None when nothing is on screen, segs seen from behind come out right to
+    # left and count as nothing
+    if z1 < NEAR_Z and z2 < NEAR_Z:
+        return None
+    if z1 < NEAR_Z:
+        t = (NEAR_Z - z1) / (z2 - z1)
+        z1, s1 = NEAR_Z, s1 + t * (s2 - s1)
+    elif z2 < NEAR_Z:
+        t = (NEAR_Z - z2) / (z1 - z2)
+        z2, s2 = NEAR_Z, s2 + t * (s1 - s2)
+    sx1 = DOOM_W / 2 + s1 * focal / z1
+    sx2 = DOOM_W / 2 + s2 * focal / z2
+    if sx2 <= sx1:
+        return None
+    x1 = max(math.ceil(sx1 - 0.5), 0)
+    x2 = min(math.ceil(sx2 - 0.5) - 1, DOOM_W - 1)
+    if x1 > x2:
+        return None
+    return sx1, z1, sx2, z2, x1, x2
+
+class wall_renderer:
+    __slots__ = [ 'FRAMEBUFFER', 'subsectors', 'segs', 'fills', '__map', '__seg_lines', '__seg_front', '__seg_back', '__seg_contrast',
+                  '__sectors', '__ranges', '__focal', '__solid', '__ceiling_clip', '__floor_clip', '__rows' ]
+
+    def __init__(self, map, fov=FOV):
+        self.__map = map
+        self.FRAMEBUFFER = np.zeros((DOOM_W, DOOM_H), dtype=np.uint8)
+        # what the last frame did, for the frame stats
+        self.subsectors = 0
+        self.segs = 0
+        self.fills = 0
+        # seg -> the sector on its facing side and the one behind it (-1 for
+        # one-sided walls), all fixed for the map
+        geometry = map.GEOMETRY
+        segs = map.SEGS.array
+        self.__seg_front = geometry.SEG_FRONT.tolist()
+        self.__seg_back = geometry.SEG_BACK.tolist()
+        self.__seg_lines = np.stack([ segs['start'], segs['end'] ], axis=1).tolist()
+        normal = geometry.SEG_NORMAL
+        self.__seg_contrast = np.where(normal[:, 1] == 0, FAKE_CONTRAST, np.where(normal[:, 0] == 0, -FAKE_CONTRAST, 0)).tolist()
+        sectors = map.SECTORS.array
+        self.__sectors = list(zip(sectors['floor'].tolist(), sectors['ceiling'].tolist(), sectors['light'].tolist()))
+        self.__ranges = [ tuple(r) for r in geometry.SSECTOR_RANGES.tolist() ]
+        # distance to the projection plane that makes fov span the screen
+        self.__focal = (DOOM_W / 2) / fine_tangent(deg_to_bam(fov / 2))
+        self.__rows = np.arange(DOOM_H, dtype=np.int32)
+        self.__ceiling_clip = np.empty(DOOM_W, dtype=np.int32)
+        self.__floor_clip = np.empty(DOOM_W, dtype=np.int32)
+        self.__solid = []
+
+    def screen_full(self):
+        # every column is behind a solid wall, nothing further away can show
+        return len(self.__solid) == 1
+
+    def render(self, subsectors, x, y, angle):
+        # subsectors is a front to back iterable, usually the renderers frustum
+        # culled walk with screen_full as its done check. returns the framebuffer
+        bam = deg_to_bam(angle)
+        cos_a, sin_a = fine_cosine(bam), fine_sine(bam)
+        verts = self.__map.VERTEXES.array
+        dx = verts['x'] - x
+        dy = verts['y'] - y
+        # every vertex in view space once, depth along the view and offset to
+        # the right of it
+        depth = (dx * cos_a + dy * sin_a).tolist()
+        side = (dx * sin_a - dy * cos_a).tolist()
+        _, sector = self.__map.locate(x, y)
+        eye = (self.__sectors[sector][0] if sector >= 0 else 0) + VIEWHEIGHT
+
+        self.__solid = [ SOLID_LEFT, SOLID_RIGHT ]
+        self.__ceiling_clip.fill(-1)
+        self.__floor_clip.fill(DOOM_H)
+        self.subsectors = 0
+        self.segs = 0
+        self.fills = 0
+        lines, ranges = self.__seg_lines, self.__ranges
+        for ssc in subsectors:
+            self.subsectors += 1
+            first, end = ranges[ssc]
+            for seg in range(first, end):
+                a, b = lines[seg]
+                self.__add_seg(seg, depth[a], side[a], depth[b], side[b], eye)
+        return self.FRAMEBUFFER
+
+    def __add_seg(self, seg, z1, s1, z2, s2, eye):
+        # project to columns and hand the visible parts on
+        projected = project_seg(z1, s1, z2, s2, self.__focal)
+        if projected is None:
+            return
+        sx1, z1, sx2, z2, x1, x2 = projected
+        front = self.__seg_front[seg]
+        if front < 0:
+            return
+        back = self.__seg_back[seg]
+        self.segs += 1
+        f_floor, f_ceiling, light = self.__sectors[front]
+        solid = back < 0
+        if not solid:
+            b_floor, b_ceiling, _ = self.__sectors[back]
+            # closed doors and lifts block the view like a one-sided wall
+            solid = b_ceiling <= f_floor or b_floor >= f_ceiling
+        wall = (sx1, 1 / z1, sx2, 1 / z2, f_floor, f_ceiling, light + self.__seg_contrast[seg], eye)
+        if solid:
+            for first, last in self.__clip_solid(x1, x2):
+                self.__draw_solid(first, last, wall)
+        else:
+            for first, last in self.__visible_spans(x1, x2):
+                self.__draw_window(first, last, wall, b_floor, b_ceiling)
+
+    def __visible_spans(self, first, last):
+        # the parts of first..last not already behind a solid wall
+        spans = []
+        x = first
+        for lo, hi in self.__solid:
+            if hi < x:
+                continue
+            if lo > last:
+                break
+            if lo > x:
+                spans.append((x, lo - 1))
+            x = hi + 1
+            if x > last:
+                break
+        if x <= last:
+            spans.append((x, last))
+        return spans
+
+    def __clip_solid(self, first, last):
+        # visible parts of a solid wall, which then joins the solid list
+        spans = self.__visible_spans(first, last)
+        if spans:
+            merged = []
+            placed = False
+            for lo, hi in self.__solid:
+                if hi < first - 1:
+                    merged.append((lo, hi))
+                elif lo > last + 1:
+                    if not placed:
+                        merged.append((first, last))
+                        placed = True
+                    merged.append((lo, hi))
+                else:
+                    first, last = min(first, lo), max(last, hi)
+            if not placed:
+                merged.append((first, last))
+            self.__solid = merged
+        return spans
+
+    def __columns(self, first, last, wall):
+        # 1/z is linear in screen x, everything else follows from it
+        sx1, iz1, sx2, iz2, _, _, _, _ = wall
+        centres = np.arange(first, last + 1) + 0.5
+        return iz1 + (centres - sx1) * ((iz2 - iz1) / (sx2 - sx1))
+
+    def __project(self, height, eye, inv_z):
+        # the first screen row at or below a world height in each column
+        return np.ceil(DOOM_H / 2 - (height - eye) * self.__focal * inv_z).astype(np.int32)
+
+    def __fill(self, first, top, bottom, colour):
+        # rows top..bottom of each column from first on, colour is one palette
+        # index or one per column
+        if not (bottom >= top).any():
+            return
+        self.fills += 1
+        rows = self.__rows
+        mask = (rows >= top[:, None]) & (rows <= bottom[:, None])
+        colour = np.asarray(colour, dtype=np.uint8)
+        np.copyto(self.FRAMEBUFFER[first:first + len(top)], colour[:, None] if colour.ndim else colour, where=mask)
+
+    def __shades(self, inv_z, light):
+        return np.clip(light - LIGHT_FALLOFF / inv_z, 0, 255).astype(np.int32)
+
+    def __draw_flats(self, first, last, top, bottom, light):
+        # ceiling above the wall and floor below it, down/up to the clip arrays
+        ceiling_clip = self.__ceiling_clip[first:last + 1]
+        floor_clip = self.__floor_clip[first:last + 1]
+        shade = max(0, min(255, light))
+        self.__fill(first, ceiling_clip + 1, np.minimum(top - 1, floor_clip - 1), CEILING_RAMP + (shade >> 2))
+        self.__fill(first, np.maximum(bottom + 1, ceiling_clip + 1), floor_clip - 1, FLOOR_RAMP + (shade >> 2))
+
+    def __draw_solid(self, first, last, wall):
+        _, _, _, _, f_floor, f_ceiling, light, eye = wall
+        inv_z = self.__columns(first, last, wall)
+        top = self.__project(f_ceiling, eye, inv_z)
+        bottom = self.__project(f_floor, eye, inv_z) - 1
+        ceiling_clip = self.__ceiling_clip[first:last + 1]
+        floor_clip = self.__floor_clip[first:last + 1]
+        self.__draw_flats(first, last, top, bottom, light)
+        shades = WALL_RAMP + (self.__shades(inv_z, light) >> 1)
+        self.__fill(first, np.maximum(top, ceiling_clip + 1), np.minimum(bottom, floor_clip - 1), shades)
+
+    def __draw_window(self, first, last, wall, b_floor, b_ceiling):
+        # a two-sided line: upper and lower walls where the sector behind
+        # steps down from the ceiling or up from the floor, then the clip arrays
+        # close in to the opening that's left
+        _, _, _, _, f_floor, f_ceiling, light, eye = wall
+        inv_z = self.__columns(first, last, wall)
+        top = self.__project(f_ceiling, eye, inv_z)
+        bottom = self.__project(f_floor, eye, inv_z) - 1
+        ceiling_clip = self.__ceiling_clip[first:last + 1]
+        floor_clip = self.__floor_clip[first:last + 1]
+        self.__draw_flats(first, last, top, bottom, light)
+        shades = WALL_RAMP + (self.__shades(inv_z, light) >> 1)
+        opening_top = top
+        opening_bottom = bottom
+        if b_ceiling < f_ceiling:
+            back_top = self.__project(b_ceiling, eye, inv_z)
+            self.__fill(first, np.maximum(top, ceiling_clip + 1), np.minimum(back_top - 1, floor_clip - 1), shades)
+            opening_top = np.maximum(top, back_top)
+        if b_floor > f_floor:
+            back_bottom = self.__project(b_floor, eye, inv_z) - 1
+            self.__fill(first, np.maximum(back_bottom + 1, ceiling_clip + 1), np.minimum(bottom, floor_clip - 1), shades)
+            opening_bottom = np.minimum(bottom, back_bottom)
+        # the slices are views so this updates the clip arrays in place
+        np.maximum(ceiling_clip, np.minimum(opening_top - 1, floor_clip), out=ceiling_clip)
+        np.minimum(floor_clip, np.maximum(opening_bottom + 1, ceiling_clip), out=floor_clip)